@@ -10,31 +10,72 @@
 # bits 15:0   y-coord
 #---------------------------------------------------------------
 # 
-# Reads a .png  or .h5 file, scales it to fit in a canvas widget.
-# .h5 is converted to png.
-# User clicks on center of gaussian blobs. 
+# Reads a .png, .h5, .raw or .npy file, scales it to fit in a canvas widget.
+# The canvas follows the window size. Mouse wheel zooms, right button pans,
+# right double-click fits the image to the canvas again.
+# Live mode (-l) shows frames from a stack replay, a growing .raw file
+# or a local socket at camera rate.
+# A 2-D .h5 image is also saved as a .png; one frame of an .h5 stack is shown.
+# .raw (with .hdr sidecar) and .npy are memory mapped and one frame is shown.
+# The displayed image is mapped to 8 bits through a contrast lookup table.
+# User clicks on center of gaussian blobs, or 'Detect' proposes boxes
+# on the brightest spots. 
 # A box is drawn on the image.
 # Co-ordinates of upper left of the box are put into a FIFO list.
 # List can be downloaded to FPGA. 
 
+import  time
+tScriptStart = time.perf_counter()  # Start of the startup span for --profile
+
 from    tkinter import *
 from    PIL import ImageTk, Image
 
-import  math 
 import  serial
-import  h5py
 import  serial.tools.list_ports
 import  numpy as np
 import  argparse as ap
-import  sys                 # for command line params
-import  os.path
+
+from    rheed.frames import open_frames, FRAME_TYPES
+from    rheed.display import DisplayNormalizer, CONTRAST_MODES
+from    rheed.view import ImagePyramid, CanvasView
+from    rheed.crop import CropBoxList
+from    rheed.overlay import CropOverlay, HISTORY_CAP
+# Option defaults only. The analysis modules (spots, golden model,
+# kymograph, scheduler, ...) are imported by the features that use them.
+from    rheed.tracking import DRIFT_THRESHOLD
+from    rheed.oscillation import WINDOW
+from    rheed.calibrate import FramePreprocessor, load_calibration, FILTER_MODES
+from    rheed.regclient import RegisterClient
+from    rheed.profiling import Profiler, TRACE_FILE
+from    rheed.eventlog import LOG, verbosity_level
+from    rheed.live import LIVE_SOURCES, DEFAULT_PORT, StackReplaySource, RawTailSource, SocketSource, FrameGrabber, LiveDisplay
 
 #---------------------------------------------------------------
 # 1.1  : Add pny image import with boxes
 # 1.2  : h5 and png image import. Arg parsing
 # 1.3  : Keep track of boxes. Delete old ones. Keep crosses
+# 1.4  : Memory mapped .raw and .npy frame import. Frame select
+# 1.5  : 8-bit display through a contrast LUT (percentile/minmax, gamma, log)
+# 1.6  : Resizable canvas with zoom and pan from a cached image pyramid
+# 1.7  : Live frame display (replay, growing .raw file, socket)
+# 1.8  : Fixed pool of overlay items. Click history capped (--history)
+# 1.9  : Automatic spot detection proposes crop boxes. Auto re-detect in live mode
+# 1.10 : Spot drift tracking in live mode. Only changed registers are written
+# 1.11 : Streaming oscillation period (growth rate) per box in live mode
+# 1.12 : Dark/flat calibration (<base>.cal.npz) and EMA / N-frame mean filter
+# 1.13 : Sampled validation of the result registers against the host model
+# 1.14 : Shift-drag draws a line; kymograph of the line across the stack
+# 1.15 : Synthetic live frame source (-l synthetic)
+# 1.16 : Record result registers of every live frame to .h5 (--record)
+# 1.17 : Crop box archive (<base>.crops.h5) shown with crops in place (-t crops)
+# 1.18 : Live frames from a shared-memory ring filled by another process (-l ring)
+# 1.19 : Scan rotates spots and frame tiles through the crop boxes in live mode (--scan)
+# 1.20 : h5py imported only for .h5 files. Headless register access is python -m rheed
+# 1.21 : --profile times startup, load, conversion, resize, render, serial and analysis stages
+# 1.22 : Register accesses go to an in-memory event log (Ctrl+L dumps it). -v / -vv print them
+# 1.23 : Plot window of the result channels of every box over the run (min/max decimated)
 #---------------------------------------------------------------
-strScriptVersion = "GUI_demo_RHEED 1.3" 
+strScriptVersion = "GUI_demo_RHEED 1.23" 
 fileNameH5       = 'not set'
 fileNamePng      = 'not set'
 #---------------------------------------------------------------
@@ -48,18 +89,16 @@ ADDR_REG_VERSION    = 0x0008
 ADDR_REG_LED        = 0x0009
 dataGpo             = 0x55555555
 
-# Size of canvas to display image
+# Initial size of canvas to display image
 nCanvasSizeX        = 700  # 
 nCanvasSizeY        = 500  # 
 
 nCropBoxPixX        = 48   # Box size in image pixels
 nCropBoxPixY        = 48   # Box size in image pixels
-nCropBoxDrawX       = 0    # Box size in canvas 
-nCropBoxDrawY       = 0    # Box size in canvas 
-
-# Scale factors to use to convert between image pixels and canvas co-ordinates
-xfactor             = 0.0
-yfactor             = 0.0
+nPanX               = 0    # Last pointer location while panning
+nPanY               = 0
+lineKymo            = None # Kymograph line (x0, y0, x1, y1) in image pixels
+nKymoMax            = 600  # Largest kymograph window size
 
 
 #---------------------------------------------------------------
@@ -67,7 +106,7 @@ yfactor             = 0.0
 #---------------------------------------------------------------
 root = Tk()
 root.title(strScriptVersion)
-root.resizable(1, 1)        # Don't allow resizing in the x or y direction
+root.resizable(1, 1)        # Allow resizing in the x and y direction
 
 strMsg              = StringVar()
 strMsg1             = StringVar()
@@ -82,13 +121,45 @@ strVersion.set("00000001")
 #---------------------------------------------------------------
 parser = ap.ArgumentParser(prog="GUI_demo_rheed", description = "Set image crop areas")
 parser.add_argument('fileNameBase', default = 'none'  , help = 'Image file name base' )
-parser.add_argument("-t", "--type", dest = 'fileType'   , choices = ['png', 'h5'], default = 'h5', help = 'Image file type: .h5 (default) or .png)')
+parser.add_argument("-t", "--type", dest = 'fileType'   , choices = FRAME_TYPES, default = 'h5', help = 'Image file type: .h5 (default), .png, .raw (with .hdr sidecar), .npy or crops (.crops.h5 archive)')
+parser.add_argument("-f", "--frame", dest = 'frameIndex', type = int, default = 0, help = 'Frame to show from an .h5, .raw, .npy or crops stack (default 0)')
+parser.add_argument("-c", "--contrast", dest = 'contrast', choices = CONTRAST_MODES, default = 'percentile', help = 'Display contrast window (default percentile)')
+parser.add_argument("--clip", dest = 'clip', type = float, nargs = 2, default = [0.5, 99.9], metavar = ('LOW', 'HIGH'), help = 'Percentiles for the percentile window (default 0.5 99.9)')
+parser.add_argument("-g", "--gamma", dest = 'gamma', type = float, default = 1.0, help = 'Display gamma. < 1 brightens faint spots (default 1.0)')
+parser.add_argument("--log", dest = 'log', action = 'store_true', help = 'Log display mapping')
+parser.add_argument("-l", "--live", dest = 'live', choices = LIVE_SOURCES, default = None, help = 'Live frame source: replay the file stack, tail a growing .raw file, a local socket, synthetic frames or a shared-memory ring')
+parser.add_argument("--fps", dest = 'fps', type = float, default = 30.0, help = 'Replay rate and display rate in frames/s (default 30)')
+parser.add_argument("--ring", dest = 'ring', default = None, help = 'Name of the shared-memory frame ring for -l ring')
+parser.add_argument("--port", dest = 'port', type = int, default = DEFAULT_PORT, help = 'Local socket port for -l socket (default {})' .format(DEFAULT_PORT))
+parser.add_argument("--history", dest = 'history', type = int, default = HISTORY_CAP, help = 'Crosses kept for boxes pushed off the list (default {})' .format(HISTORY_CAP))
+parser.add_argument("--filter", dest = 'filter', choices = FILTER_MODES, default = 'none', help = 'Live frame filter: exponential moving average or mean of the last N frames')
+parser.add_argument("--alpha", dest = 'alpha', type = float, default = 0.2, help = 'Weight of the newest frame for --filter ema (default 0.2)')
+parser.add_argument("--navg", dest = 'navg', type = int, default = 8, help = 'Frames averaged for --filter mean (default 8)')
+parser.add_argument("--network", dest = 'network', default = None, help = 'hls4ml network .npz for result validation (default: dummy hls4ml block)')
+parser.add_argument("--record", dest = 'record', default = None, help = 'Record the result registers of every live frame to this .h5 file (readable while recording)')
+parser.add_argument("--window", dest = 'window', type = int, default = WINDOW, help = 'Frames in the oscillation analysis window (default {})' .format(WINDOW))
+parser.add_argument("--scan", dest = 'scan', type = int, default = 16, help = 'Spots scanned with the frame tiles when Scan is on in live mode (default 16)')
+parser.add_argument("--drift", dest = 'drift', type = float, default = DRIFT_THRESHOLD, help = 'Tracking re-centres a box when its spot drifts this many pixels (default {})' .format(DRIFT_THRESHOLD))
+parser.add_argument("--profile", dest = 'profile', nargs = '?', const = TRACE_FILE, default = None, metavar = 'TRACE', help = 'Time the GUI stages; summary at exit, timeline to TRACE (default {})' .format(TRACE_FILE))
+parser.add_argument("--cprofile", dest = 'cprofile', action = 'store_true', help = 'With --profile: also run cProfile (stats to TRACE .prof)')
+parser.add_argument("--tracemalloc", dest = 'tracemalloc', action = 'store_true', help = 'With --profile: also trace memory allocations')
+parser.add_argument("-v", "--verbose", dest = 'verbose', action = 'count', default = 0, help = 'Print events as they happen: -v info, -vv every register access')
 
 #---------------------------------------------------------------
 # Parse the argument list and then extract the settings
 args                = parser.parse_args()
 arg_fileNameBase    = args.fileNameBase
 arg_fileType        = args.fileType
+arg_frameIndex      = args.frameIndex
+
+# Events are kept in memory; only warnings and errors reach the console unless -v
+LOG.console_level = verbosity_level(args.verbose)
+
+# Stage timers. Without --profile every hook is a no-op.
+profiler = Profiler(enabled = args.profile is not None, cprofile = args.cprofile, memory = args.tracemalloc, t0 = tScriptStart).start()
+
+# Maps the raw frame (any dtype) to the 8-bit displayed image
+normDisplay = DisplayNormalizer(mode = args.contrast, low = args.clip[0], high = args.clip[1], gamma = args.gamma, log = args.log)
 print ("Image filename base  = ", arg_fileNameBase)
 print ("Image file type      = ", arg_fileType)
 
@@ -113,57 +184,66 @@ for i in range(NUM_REGS):
     listY.append(StringVar())
     listY[i].set(0)
 
-nListPtrEnd = 0 # point to next available list entry.    
-# Array to store canvas box objects
-arrCropBox = [[0] for i in range(NUM_REGS)] 
-
 #---------------------------------------------------------------
-# Open the .h5 file, convert to a .png
+# Open the .h5 file (first root key, a 2-D image or a 3-D stack)
+# and take one frame. A 2-D image is also saved as a .png.
 #---------------------------------------------------------------
+tLoad = profiler.begin()
 if (arg_fileType == 'none') or (arg_fileType == 'h5'):
 
-        with h5py.File(fileNameH5, "r") as f:
+        stackFrames = open_frames(arg_fileNameBase, 'h5')
+        ds_arr      = stackFrames[arg_frameIndex]
+        LOG.info('load', '{} frames of {} {}, frame {} max value {}', len(stackFrames), stackFrames.shape, stackFrames.dtype,
+                 arg_frameIndex, ds_arr.max())
 
-            # Print all root level object names (aka keys) 
-            # these can be group or dataset names 
-            print("Keys: %s" % f.keys())
-            # get first object name/key; may or may NOT be a group
-            a_group_key = list(f.keys())[0]
+        if len(stackFrames) == 1:
+            # Create image object from numpy array and save it as a PNG file
+            Image.fromarray(ds_arr).save(fileNamePng)
 
-            # get the object type for a_group_key: usually group or dataset
-            print(type(f[a_group_key])) 
+#---------------------------------------------------------------
+# Memory map the .raw or .npy stack and take one frame.
+# The frame is a view of the file; no conversion to png.
+# Frames of a crop archive are rebuilt with the crops in place.
+#---------------------------------------------------------------
+if (arg_fileType == 'raw') or (arg_fileType == 'npy') or (arg_fileType == 'crops'):
 
-            # If a_group_key is a group name, 
-            # this getsp the object names in the group and returns as a list
-            data = list(f[a_group_key])
+        stackFrames = open_frames(arg_fileNameBase, arg_fileType)
+        print ('Frames in stack = {0:8}' .format(len(stackFrames)))
+        print ('Frame shape     = {}' .format(stackFrames.shape))
+        ds_arr      = stackFrames[arg_frameIndex]
 
-            # If a_group_key is a dataset name, 
-            # this gets the dataset values and returns as a list
-            data = list(f[a_group_key])
-            # preferred methods to get dataset values:
-            ds_obj = f[a_group_key]      # returns as a h5py dataset object
-            ds_arr = f[a_group_key][()]  # returns as a numpy array
-            max_value = np.max(ds_arr)
-            print(" ")
-            print('Image array:')
-            print(ds_arr)
-            print('Image shape:') 
-            print(ds_arr.shape) 
-            print('Image max value:')
-            print(max_value)
+elif (arg_fileType == 'png'):
 
-            # Create image object from numpy array 
-            data = Image.fromarray(ds_arr) 
-              
-            # saving the final output as a PNG file 
-            data.save(fileNamePng) 
+        ds_arr      = open_frames(arg_fileNameBase, 'png')[0]
+profiler.end('load', tLoad)
+
+#---------------------------------------------------------------
+# Dark / flat calibration of the dataset, if <base>.cal.npz exists
+#---------------------------------------------------------------
+calFrames = load_calibration(arg_fileNameBase)
+if (calFrames is not None) and (calFrames.shape != ds_arr.shape):
+    print ('Calibration shape {} does not match frame shape {}. Not used.' .format(calFrames.shape, ds_arr.shape))
+    calFrames = None
+if calFrames is not None:
+    print ('Calibration     = {}' .format(arg_fileNameBase + '.cal.npz'))
+    with profiler.stage('preprocess'):
+        ds_arr = FramePreprocessor(ds_arr.shape, calFrames)(ds_arr).copy()
+
+#---------------------------------------------------------------
+# Map the frame to 8 bits for display. The contrast window is
+# computed once and the mapping is a table lookup.
+#---------------------------------------------------------------
+with profiler.stage('conversion'):
+    lo, hi      = normDisplay.window(ds_arr)
+    imageFrame  = Image.fromarray(normDisplay(ds_arr))
+print ('Display window  = {} .. {}' .format(lo, hi))
 
 
 #---------------------------------------------------------------
 # Function to send a single byte to COM port
 #---------------------------------------------------------------
 def gj_send(ser, byte):
-    print ('Send {}' .format(byte))
+    LOG.debug('send', '{!r}', byte)
     ser.write(byte)
 
 #---------------------------------------------------------------
@@ -171,86 +251,79 @@ def gj_send(ser, byte):
 #---------------------------------------------------------------
 def gj_recvline(ser):
     line = ser.readline()
-    print ('{}' .format(line))
+    LOG.debug('recv', '{!r}', line)
     
 
 #---------------------------------------------------------------
-# Read a register from the FPGA.
-#---------------------------------------------------------------
-# Convert address into a byte array.
-# Send a read command sequence ('R' address16 data32)
+# Read a register from the FPGA. The address is a hex string from
+# an Entry box. The command sequence ('R' address16 data32) and the
+# reply check are done by the register client (rheed.regclient),
+# which python -m rheed uses too.
 #---------------------------------------------------------------
-def gj_reg_read(ser, strRegAddr):
-    regaddr     = 0
+def gj_reg_read(client, strRegAddr):
     regaddr = int(strRegAddr.get(), base = 16)
-    wdata   = 0xFFFFFFFE # dummy data to get the correct message length
-    print ('Read regaddr    = 0x{:04x}' .format(regaddr))
-    print ('Write data      = 0x{:08x}' .format(wdata))
-    strMsg = regaddr.to_bytes(2, byteorder='big') + wdata.to_bytes(4, byteorder='big')
+    return client.read(regaddr)
 
-    ser.write(b'\x52')
-    ser.write(strMsg)
 
-    # Read 5 characters from serial port ('A' and  4 bytes for data32)
-    rdata = ser.read(5)
-
-    # Convert 32-bit data into a hex string, print it and set it into the GUI entry box
-    str_rdata = str(rdata[1:].hex())
-    rvalue = int(str_rdata, 16)
-    str_rdata = '0x' + str_rdata.upper()
-    print ('Read data     = ' + str_rdata)
-    return rvalue
+#---------------------------------------------------------------
+# Read a register from the FPGA at an integer address.
+#---------------------------------------------------------------
+def gj_reg_read_int(client, regaddress):
+    return client.read(regaddress)
 
 
 #---------------------------------------------------------------
 # Read version register from FPGA and set value in Entry box
 #---------------------------------------------------------------
-def read_version(ser):
-    rvalue = gj_reg_read(ser, strAddrRegVersion)
+def read_version(client):
+    try:
+        rvalue = gj_reg_read(client, strAddrRegVersion)
+    except OSError:
+        strVersion.set('no reply')
+        return
     str_rdata = hex(rvalue)
     strVersion.set(str_rdata) 
 
 
 #---------------------------------------------------------------
 # Write 32-bit data to a 16-bit register address in the FPGA.
-# Convert address and data strings into byte arrays.
+# Address and data are hex strings from Entry boxes.
 # Send a write command sequence (W address16 data32)
 #---------------------------------------------------------------
-def gj_reg_write(ser, strRegAddr, strRegData):
+def gj_reg_write(client, strRegAddr, strRegData):
     
-    regaddr     = 0
-    wdata       = 0
-
     regaddr = int(strRegAddr.get(), base = 16)
     wdata   = int(strRegData.get(), base = 16)
-
-    print ('Write regaddr   = 0x{:04x}' .format(regaddr))
-    print ('Write data      = 0x{:08x}' .format(wdata))
-
-    strMsg = regaddr.to_bytes(2, byteorder='big') + wdata.to_bytes(4, byteorder='big')
-    ser.write(b'\x57')
-    ser.write(strMsg)
+    client.write(regaddr, wdata)
      
 
 #---------------------------------------------------------------
 # Write 32-bit data to a 16-bit register address in the FPGA.
-# Convert address and data into byte arrays.
-# Send a write command sequence (W address16 data32)
 #---------------------------------------------------------------
-def gj_reg_write_int(ser, regaddress, wdata):
-    
-    print ('Write regaddress = 0x{:04x}' .format(regaddress))
-    print ('Write data       = 0x{:08x}' .format(wdata))
-    strMsg = regaddress.to_bytes(2, byteorder='big') + wdata.to_bytes(4, byteorder='big')
-    ser.write(b'\x57')
-    ser.write(strMsg)
+def gj_reg_write_int(client, regaddress, wdata):
+    client.write(regaddress, wdata)
+
+
+#---------------------------------------------------------------
+# Several register writes [(address, word)] in one serial message
+#---------------------------------------------------------------
+def gj_reg_write_many(client, writes):
+    client.write_many(writes)
+
+
+#---------------------------------------------------------------
+# Crop box words and result registers of all boxes in one serial
+# round trip: ([word, ...], [[word, ...], ...])
+#---------------------------------------------------------------
+def gj_reg_read_snapshot(client, num_boxes):
+    return client.read_snapshot(num_boxes)
 
 
 #---------------------------------------------------------------
 # Combines an X and Y value into a 32-bit value to be written 
 # to an FPGA register
 #---------------------------------------------------------------
-def set_xy(ser, index):
+def set_xy(client, index):
 
     # Combine X and Y values into a 32-bit value
    #pt_x = int(.get(), base = 16)
@@ -260,7 +333,7 @@ def set_xy(ser, index):
     regaddress = index
 
     # Write to the FPGA
-    gj_reg_write_int(ser, regaddress, wdata)
+    gj_reg_write_int(client, regaddress, wdata)
 
 
 #---------------------------------------------------------------
@@ -268,7 +341,7 @@ def set_xy(ser, index):
 #---------------------------------------------------------------
 def set_all_xy():
     for i in range(NUM_REGS):
-        set_xy(ser, i)
+        set_xy(clientFpga, i)
 
 
 #---------------------------------------------------------------
@@ -277,77 +350,529 @@ def set_all_xy():
 #---------------------------------------------------------------
 def OnCanvasClick(event):                  
 
-    global nListPtrEnd
-    global listx
-    global listy
-    global nCanvasSizeX
-    global nCanvasSizeY
+    pixel_x, pixel_y = viewCanvas.canvas_to_pixel(event.x, event.y)
+    LOG.debug('click', 'canvas {} {} pixel {:.1f} {:.1f}', event.x, event.y, pixel_x, pixel_y)
 
-    print ('Got canvas click', event.x, event.y)
-    
-    print   ('click_x , click_y ', event.x, event.y)
-    pixel_x = event.x * xfactor
-    pixel_y = event.y * yfactor
-    print   ('pixel_x , pixel_y ', pixel_x, pixel_y)
-    box_x0 = event.x - nCropBoxDrawX/2
-    box_y0 = event.y - nCropBoxDrawY/2
-    box_x1 = event.x + nCropBoxDrawX/2
-    box_y1 = event.y + nCropBoxDrawY/2
-
-    if (box_x0 < 0):
-        box_x0 = 0
-        box_x1 = nCropBoxDrawX
-
-    if (box_y0 < 0):
-        box_y0 = 0
-        box_y1 = nCropBoxDrawY
-
-    if (box_x1 > resize_width):
-        box_x1 = resize_width
-        box_x0 = resize_width - nCropBoxDrawX
-
-    if (box_y1 > resize_height):
-        box_y1 = resize_height
-        box_y0 = resize_height - nCropBoxDrawY
-
-    print ('box x0,y0' , box_x0, box_y0)
-    print ('box x1,y1' , box_x1, box_y1)
-    print ('ptr = '    , nListPtrEnd)
-
-    cross = canvas1.create_line((event.x-5, event.y  ), (event.x+5, event.y  ), fill= 'green', width = 2)
-    cross = canvas1.create_line((event.x  , event.y-5), (event.x  , event.y+5), fill= 'green', width = 2)
-    box = canvas1.create_line((box_x0, box_y0), (box_x1, box_y0), (box_x1, box_y1), (box_x0, box_y1), (box_x0, box_y0), fill= 'red', width = 2)
-
-    pixel_box_x0 = box_x0 / scale_factor
-    pixel_box_y0 = box_y0 / scale_factor
-
-    # Add first NUM_REGS box co-ordinates to the list
-    if (nListPtrEnd < NUM_REGS) :
-        listX[nListPtrEnd].set(math.floor(pixel_box_x0))
-        listY[nListPtrEnd].set(math.floor(pixel_box_y0)) 
-        arrCropBox[nListPtrEnd] = box
-        nListPtrEnd+= 1
-
-    # Additional box co-ordinates push older ones off the list
-    else : 
-        canvas1.delete(arrCropBox[0])
-        for nEntry in range(1, NUM_REGS) :
-            listX[nEntry-1].set(listX[nEntry].get()) 
-            listY[nEntry-1].set(listY[nEntry].get()) 
-            arrCropBox[nEntry-1] = arrCropBox[nEntry]
-
-        arrCropBox[NUM_REGS-1] = box
-        listX[NUM_REGS-1].set(math.floor(pixel_box_x0))
-        listY[NUM_REGS-1].set(math.floor(pixel_box_y0)) 
+    # Additional box co-ordinates push older ones off the list.
+    # The cross of a box pushed off goes to the history layer.
+    if len(cropBoxes) == NUM_REGS:
+        overlayBoxes.add_history(*cropBoxes.centres[0])
+
+    # Box centred on the click, clamped to the image
+    (box_x0, box_y0), bDropped = cropBoxes.add_centred(pixel_x, pixel_y)
+    LOG.info('box', 'x0,y0 {} {}  boxes {}', box_x0, box_y0, len(cropBoxes))
+
+    show_boxes()
+
+
+#---------------------------------------------------------------
+# Put the crop box list into the entry boxes and move the overlay.
+# Existing canvas items are moved; none are created.
+#---------------------------------------------------------------
+def show_boxes():
+
+    for nEntry, (x0, y0) in enumerate(cropBoxes):
+        listX[nEntry].set(x0)
+        listY[nEntry].set(y0)
+    overlayBoxes.set_boxes(cropBoxes.boxes, cropBoxes.centres)
+
+
+#---------------------------------------------------------------
+# Detect the brightest spots in the shown frame and put a box on
+# each. Boxes replaced go to the history layer unless bHistory is
+# False (auto re-detect in live mode).
+#---------------------------------------------------------------
+def detect_boxes(bHistory = True):
+
+    from rheed.spots import propose_crop
+
+    if (liveDisplay is not None) and (liveDisplay.frame is not None):
+        frame = liveDisplay.frame
+    else:
+        frame = ds_arr
+    spots, boxes, words = propose_crop(frame, NUM_REGS, nCropBoxPixX, nCropBoxPixY)
+    LOG.info('detect', 'spots found {}', len(spots))
+
+    for (box_x0, box_y0), spot in zip(boxes, spots):
+        if bHistory and len(cropBoxes) == NUM_REGS:
+            overlayBoxes.add_history(*cropBoxes.centres[0])
+        cropBoxes.add(box_x0, box_y0, (float(spot['x']), float(spot['y'])))
+        LOG.debug('detect', 'spot x,y {:7.2f} {:7.2f}  box x0,y0 {} {}', spot['x'], spot['y'], box_x0, box_y0)
+    show_boxes()
+
+
+#---------------------------------------------------------------
+# Show the pyramid level for the current view. A level is rendered
+# the first time it is shown, and only around the visible part of
+# the canvas; after that the image item and overlay are moved.
+#---------------------------------------------------------------
+def draw_view():
+
+    region = viewCanvas.visible_region()
+    if liveDisplay is not None:
+        (x0, y0), photo = liveDisplay.photo_for(viewCanvas.level, region)
+    else:
+        (x0, y0), photo = pyramidImage.photo(viewCanvas.level, region)
+    canvas1.itemconfig(nImageItem, image = photo)
+    canvas1.coords(nImageItem, viewCanvas.offset_x + x0, viewCanvas.offset_y + y0)
+    overlayBoxes.draw()
+    draw_line()
+
+
+#---------------------------------------------------------------
+# Canvas resized with the window
+#---------------------------------------------------------------
+def OnCanvasResize(event):
+
+    viewCanvas.resize(event.width, event.height)
+    draw_view()
+
+
+#---------------------------------------------------------------
+# Mouse wheel zooms about the pointer.
+# Windows/Mac send <MouseWheel>, X11 sends <Button-4>/<Button-5>
+#---------------------------------------------------------------
+def OnCanvasWheel(event):
+
+    if (event.num == 4) or (event.delta > 0):
+        nSteps = 1
+    else:
+        nSteps = -1
+    if viewCanvas.zoom_at(event.x, event.y, nSteps):
+        draw_view()
+
+
+#---------------------------------------------------------------
+# Right button drag pans, right double-click fits the canvas
+#---------------------------------------------------------------
+def OnCanvasPanStart(event):
+
+    global nPanX, nPanY
+    nPanX, nPanY = event.x, event.y
+
+
+def OnCanvasPan(event):
+
+    global nPanX, nPanY
+    viewCanvas.pan(event.x - nPanX, event.y - nPanY)
+    nPanX, nPanY = event.x, event.y
+    draw_view()
+
+
+def OnCanvasFit(event):
+
+    viewCanvas.fit()
+    draw_view()
+
+
+#---------------------------------------------------------------
+# Shift + left button drag draws a line (e.g. along the specular
+# streak). On release the line is sampled across the whole stack
+# and the kymograph (frames down, position along the line across)
+# is shown in its own window.
+#---------------------------------------------------------------
+def OnLineStart(event):
+
+    global lineKymo
+    x, y = viewCanvas.canvas_to_pixel(event.x, event.y)
+    lineKymo = (x, y, x, y)
+    draw_line()
+
+
+def OnLineDrag(event):
+
+    global lineKymo
+    x, y = viewCanvas.canvas_to_pixel(event.x, event.y)
+    lineKymo = lineKymo[:2] + (x, y)
+    draw_line()
+
+
+def OnLineEnd(event):
+
+    OnLineDrag(event)
+    if (lineKymo[0], lineKymo[1]) != (lineKymo[2], lineKymo[3]):
+        show_kymograph()
+
+
+def draw_line():
+
+    if lineKymo is None:
+        return
+    x0, y0 = viewCanvas.pixel_to_canvas(lineKymo[0], lineKymo[1])
+    x1, y1 = viewCanvas.pixel_to_canvas(lineKymo[2], lineKymo[3])
+    canvas1.coords(nLineItem, x0, y0, x1, y1)
+    canvas1.itemconfig(nLineItem, state = 'normal')
+
+
+def show_kymograph():
+
+    from rheed.kymograph import LineProfile, kymograph, kymograph_h5
+
+    global photoKymo
+    points = [lineKymo[:2], lineKymo[2:]]
+    if (arg_fileType == 'none') or (arg_fileType == 'h5'):
+        kymo = kymograph_h5(fileNameH5, points)
+    elif (arg_fileType == 'raw') or (arg_fileType == 'npy') or (arg_fileType == 'crops'):
+        kymo = kymograph(stackFrames, LineProfile(points, stackFrames.shape))
+    else:
+        kymo = LineProfile(points, ds_arr.shape)(ds_arr)[None]
+    print ('Kymograph {} frames x {} samples' .format(*kymo.shape))
+
+    # Own contrast window; scaled to fit the window
+    imageKymo = Image.fromarray(DisplayNormalizer('percentile')(kymo))
+    nScale    = min(nKymoMax / imageKymo.width, nKymoMax / imageKymo.height)
+    size      = (max(1, int(imageKymo.width * nScale)), max(1, int(imageKymo.height * nScale)))
+    imageKymo = imageKymo.resize(size, Image.NEAREST if nScale >= 1 else Image.BOX)
+
+    if windowKymo is None or not windowKymo.winfo_exists():
+        open_kymograph_window()
+    photoKymo = ImageTk.PhotoImage(imageKymo)
+    labelKymo.config(image = photoKymo)
+    windowKymo.title('Kymograph ({}, {}) - ({}, {})  {} frames' .format(*[int(v) for v in lineKymo], kymo.shape[0]))
+
+
+def open_kymograph_window():
+
+    global windowKymo, labelKymo
+    windowKymo = Toplevel(root)
+    labelKymo  = Label(windowKymo)
+    labelKymo.pack(fill=BOTH, expand=True)
+
+
+#---------------------------------------------------------------
+# Start/stop live display. The still image is shown while stopped.
+#---------------------------------------------------------------
+def live_start_stop():
+
+    if liveDisplay.running:
+        liveDisplay.stop()
+        buttonLive.config(text = "Live")
+    else:
+        liveDisplay.start()
+        buttonLive.config(text = "Stop")
+        live_status()
+
+
+def live_status():
+
+    if liveDisplay.running:
+        strLive.set('frame {}  {:5.1f} fps  dropped {}' .format(liveDisplay.nCounter, liveDisplay.fps, grabberLive.nDropped))
+        if varAutoDetect.get():
+            detect_boxes(bHistory = False)
+            if varTrack.get():
+                track_retarget()
+        if varTrack.get():
+            strLive.set(strLive.get() + '  writes {}' .format(trackerSpots.nWrites))
+        if varValidate.get():
+            strLive.set(strLive.get() + '  wrong {}/{}' .format(int(validatorResults.nMismatch.sum()), int(validatorResults.nChecked.sum())))
+        osc_status()
+        root.after(500, live_status)
+
+
+#---------------------------------------------------------------
+# Spot tracking. Turning it on downloads the boxes once; after
+# that only registers of boxes that moved or were re-detected are
+# written.
+#---------------------------------------------------------------
+def track_start_stop():
+
+    if varTrack.get():
+        varScan.set(0)
+        track_start()
+
+
+def track_start():
+
+    nBoxes = len(cropBoxes)
+    trackerSpots.reset(cropBoxes.words(), cropBoxes.centres + [cropBoxes.box_centre((0, 0))] * (NUM_REGS - nBoxes),
+                       active = [nBox < nBoxes for nBox in range(NUM_REGS)])
+    if len(comlist) > 0:
+        set_all_xy()
+
+
+#---------------------------------------------------------------
+# Re-detected boxes while tracking. The tracker follows the new
+# boxes; only the registers that changed are written, within the
+# tracker's serial budget.
+#---------------------------------------------------------------
+def track_retarget():
+
+    nBoxes = len(cropBoxes)
+    writes = trackerSpots.retarget(cropBoxes.words(), cropBoxes.centres + [cropBoxes.box_centre((0, 0))] * (NUM_REGS - nBoxes),
+                                   active = [nBox < nBoxes for nBox in range(NUM_REGS)])
+    if (len(comlist) > 0) and writes:
+        gj_reg_write_many(clientFpga, writes)
+
+
+#---------------------------------------------------------------
+# Scan. Turning it on detects up to --scan spots in the shown frame
+# and schedules them (priority 2) with tiles covering the frame
+# (priority 1). The boxes that change are written in one serial
+# message. Tracking is turned off while scanning.
+# With the FPGA, the results of a frame go to the regions whose boxes
+# were read with them. The next boxes are only written after a read
+# with steady boxes, so every assignment gets its results.
+#---------------------------------------------------------------
+def scan_start_stop():
+
+    from rheed.spots import propose_crop
+    from rheed.scheduler import CropScheduler, tile_regions, spot_regions
+
+    global schedulerScan
+    if not varScan.get():
+        return
+    varTrack.set(0)
+    if (liveDisplay.frame is not None):
+        frame = liveDisplay.frame
+    else:
+        frame = ds_arr
+    spots, _, _ = propose_crop(frame, args.scan, nCropBoxPixX, nCropBoxPixY)
+    regionsSpot = spot_regions(spots, image_width, image_height, nCropBoxPixX, nCropBoxPixY)
+    regionsTile = tile_regions(image_width, image_height, nCropBoxPixX, nCropBoxPixY)
+    schedulerScan = CropScheduler(regionsSpot + regionsTile, [2.0] * len(regionsSpot) + [1.0] * len(regionsTile), num_slots = NUM_REGS,
+                                  words = cropBoxes.words(),
+                                  image_cols = image_width, image_rows = image_height, box_cols = nCropBoxPixX, box_rows = nCropBoxPixY)
+    print ('Scanning {} spots and {} tiles' .format(len(regionsSpot), len(regionsTile)))
+
+
+def scan_frame(nCounter, frame, snapshot):
+
+    if not varScan.get():
+        return
+    if snapshot is not None:
+        words, regs, bSteady = snapshot
+        if not bSteady:
+            return
+        schedulerScan.tag_words(words, regs_to_results(regs), nCounter)
+    writes = schedulerScan.next_frame()
+    if (len(comlist) > 0) and writes:
+        gj_reg_write_many(clientFpga, writes)
+    for (regaddress, wdata) in writes:
+        if regaddress < NUM_REGS:
+            cropBoxes.set(regaddress, (wdata >> 16) & 0xFFFF, wdata & 0xFFFF)
+    if writes:
+        show_boxes()
+
+
+#---------------------------------------------------------------
+# Called by the live display for every frame shown. The box and
+# result registers of the frame were read in the grabber thread
+# (grab_registers) and are shared by the analyses.
+#---------------------------------------------------------------
+def on_live_frame(nCounter, frame):
+
+    global bReadRegisters
+    snapshot = liveDisplay.grabbed
+    track_frame(nCounter, frame)
+    scan_frame(nCounter, frame, snapshot)
+    osc_frame(nCounter, frame)
+    validate_frame(nCounter, liveDisplay.raw, snapshot)
+    record_frame(nCounter, frame, snapshot)
+    bReadRegisters = (recorderResults is not None) or bool(varScan.get()) or bool(varPlot.get()) or bool(varValidate.get())
+
+
+#---------------------------------------------------------------
+# Runs in the grabber thread for every frame received: the crop box
+# and result registers in one batched read, or None when nothing
+# uses them or the read failed (the error is in the event log).
+# bSteady is True when the boxes are the same as at the read of the
+# frame before, so the results belong to these boxes and this frame.
+#---------------------------------------------------------------
+def grab_registers(nCounter, frame):
+
+    global wordsGrabbed
+    if not bReadRegisters:
+        wordsGrabbed = None
+        return None
+    try:
+        words, regs = gj_reg_read_snapshot(clientFpga, NUM_REGS)
+    except OSError:
+        wordsGrabbed = None
+        return None
+    bSteady      = (words == wordsGrabbed)
+    wordsGrabbed = words
+    return words, regs, bSteady
+
+
+#---------------------------------------------------------------
+# Append the result registers, with the frame counter and the crop
+# box words, to the results file. The same read feeds the result
+# plot.
+#---------------------------------------------------------------
+def record_frame(nCounter, frame, snapshot):
+
+    if (recorderResults is None) and (not varPlot.get()):
+        return
+    if len(comlist) == 0:
+        # No FPGA: plot the host model results of the boxes
+        if varPlot.get():
+            historyResults.push(nCounter, validatorResults.model.results(frame, cropBoxes.words())[0])
+        return
+    if snapshot is None:
+        return
+    words, regs, _ = snapshot
+    if recorderResults is not None:
+        recorderResults.append_registers(regs, nCounter, words)
+    if varPlot.get():
+        historyResults.push(nCounter, regs_to_results(regs))
+
+
+#---------------------------------------------------------------
+# Result plot window: the result channels of every box over the
+# whole run. Frames only go into the history ring; the plot folds
+# them in and moves its lines every REFRESH_MS. Closing the window
+# turns the plot off.
+#---------------------------------------------------------------
+def plot_start_stop():
+
+    global windowPlot, plotResults, afterPlot
+    if afterPlot is not None:
+        root.after_cancel(afterPlot)
+        afterPlot = None
+    if windowPlot is not None:
+        windowPlot.destroy()
+        windowPlot = None
+    if not varPlot.get():
+        return
+    historyResults.reset()
+    windowPlot = Toplevel(root)
+    windowPlot.title('Results')
+    windowPlot.protocol('WM_DELETE_WINDOW', lambda: (varPlot.set(0), plot_start_stop()))
+    canvasPlot = Canvas(windowPlot, width = 600, background = 'white')
+    canvasPlot.pack(fill = BOTH, expand = True)
+    plotResults = ResultPlot(canvasPlot, historyResults)
+    plot_refresh()
+
+
+def plot_refresh():
+
+    global afterPlot
+    plotResults.update()
+    afterPlot = root.after(REFRESH_MS, plot_refresh)
+
+
+#---------------------------------------------------------------
+# Compare the result registers with the host model on a sample of
+# the frames. The model gets the frame as grabbed (before dark/flat
+# and filtering) and the boxes and registers read for that frame.
+# Frames without a read, or read while the boxes changed, are not
+# offered. The sample rate adapts to mismatches and check cost.
+#---------------------------------------------------------------
+def validate_frame(nCounter, frame, snapshot):
+
+    if (not varValidate.get()) or (snapshot is None):
+        return
+    words, regs, bSteady = snapshot
+    if not bSteady:
+        LOG.debug('validate', 'frame {} skipped: boxes changed', nCounter)
+        return
+    nInvalid = int(validatorResults.nInvalid.sum())
+    wrong    = validatorResults.offer(frame, words, regs)
+    if (wrong is None) or (not wrong.any()):
+        return
+    if validatorResults.nInvalid.sum() > nInvalid:
+        LOG.warning('validate', 'frame {} boxes {} outside the {}x{} frame', nCounter, np.nonzero(wrong)[0].tolist(), frame.shape[1], frame.shape[0])
+    else:
+        LOG.warning('validate', 'frame {} result mismatch in boxes {}', nCounter, np.nonzero(wrong)[0].tolist())
+
+
+def validate_start_stop():
+
+    if varValidate.get():
+        validatorResults.reset()
+    else:
+        print (validatorResults.summary())
+
+
+def track_frame(nCounter, frame):
+
+    if not varTrack.get():
+        return
+    writes = trackerSpots.update(frame)
+    if (len(comlist) > 0) and writes:
+        gj_reg_write_many(clientFpga, writes)
+    for (regaddress, wdata) in writes:
+        if regaddress < len(cropBoxes):
+            x0, y0 = (wdata >> 16) & 0xFFFF, wdata & 0xFFFF
+            cropBoxes.set(regaddress, x0, y0)
+    if writes:
+        for nBox in range(len(cropBoxes)):
+            cropBoxes.centres[nBox] = tuple(trackerSpots.centres[nBox])
+        show_boxes()
+
+
+#---------------------------------------------------------------
+# Oscillation analysis of the mean intensity of each box.
+# Restarts when the boxes change. Off while scanning: the boxes
+# change every few frames, so no window would ever fill.
+#---------------------------------------------------------------
+def osc_frame(nCounter, frame):
+
+    global wordsOsc, statsOsc
+    if varScan.get():
+        wordsOsc = None
+        return
+    words = cropBoxes.words()
+    if words != wordsOsc:
+        wordsOsc = words
+        statsOsc = RoiStats.from_words(words, nCropBoxPixX, nCropBoxPixY)
+        analyzerOsc.reset()
+    analyzerOsc.push(statsOsc.compute(frame)['mean'])
+
+
+def osc_status():
+
+    if varScan.get():
+        strOsc.set('Oscillation: off while Scan is on')
+        return
+    if not analyzerOsc.ready:
+        strOsc.set('Oscillation: {} / {} frames' .format(analyzerOsc.sdft.nCount, analyzerOsc.sdft.window))
+        return
+    osc = analyzerOsc.estimate()
+    strOsc.set('Period (s): ' + '  '.join('{:6.2f}' .format(osc['period'][nBox]) for nBox in range(len(cropBoxes))))
         
 
+#---------------------------------------------------------------
+# Tk callback exception: the error event dumps the event log, then
+# the traceback is printed as Tk would
+#---------------------------------------------------------------
+def report_callback_exception(excType, excValue, excTraceback):
+
+    import traceback
+    LOG.error('exception', '{}: {}', excType.__name__, excValue)
+    traceback.print_exception(excType, excValue, excTraceback)
+
+
 #---------------------------------------------------------------
 # END OF FUNCTION DEFINITIONS
 #---------------------------------------------------------------
 
+#---------------------------------------------------------------
+# With --profile the serial, render and analysis functions are
+# replaced by timed ones. Callers look them up by name, so the
+# buttons and the live display use the timed versions.
+#---------------------------------------------------------------
+gj_send              = profiler.timed('serial write', gj_send)
+gj_reg_write         = profiler.timed('serial write', gj_reg_write)
+gj_reg_write_int     = profiler.timed('serial write', gj_reg_write_int)
+gj_reg_write_many    = profiler.timed('serial write', gj_reg_write_many)
+gj_reg_read          = profiler.timed('serial read', gj_reg_read)
+gj_reg_read_int      = profiler.timed('serial read', gj_reg_read_int)
+gj_reg_read_snapshot = profiler.timed('serial read', gj_reg_read_snapshot)
+draw_view            = profiler.timed('render', draw_view)
+detect_boxes         = profiler.timed('detect', detect_boxes)
+track_frame          = profiler.timed('track', track_frame)
+scan_frame           = profiler.timed('scan', scan_frame)
+osc_frame            = profiler.timed('oscillation', osc_frame)
+validate_frame       = profiler.timed('validate', validate_frame)
+record_frame         = profiler.timed('record', record_frame)
+plot_refresh         = profiler.timed('plot', plot_refresh)
+show_kymograph       = profiler.timed('kymograph', show_kymograph)
+
 #---------------------------------------------------------------
 # Get a list of serial ports. Open first COM port.
 #---------------------------------------------------------------
+tSerial = profiler.begin()
 comlist = (list(serial.tools.list_ports.comports()))
 print('Number of ports = {0:8}' .format(len(comlist)))
 
@@ -365,6 +890,7 @@ if len(comlist) > 0:
         stopbits=serial.STOPBITS_ONE,\
         bytesize=serial.EIGHTBITS,\
         timeout=1)
+    clientFpga = RegisterClient(ser = ser)
 
     strMsg.set(ser.name)
     strMsg1.set(comlist[0][0])
@@ -375,6 +901,7 @@ else:
     print("No ports")
     strMsg.set("None")
     strMsg1.set("0")
+profiler.end('serial open', tSerial)
 
 
 #---------------------------------------------------------------
@@ -393,7 +920,7 @@ frameSerialPorts.pack(side=TOP, padx = 10, pady = 1)
 frameVersion   = Frame(root, borderwidth=3,relief=FLAT, padx = 5, pady = 2)
 Label (frameVersion, text = 'Version ').pack(side = LEFT, padx = 5, pady = 2)
 Entry (frameVersion, width = 12, textvariable = strVersion).pack(side=LEFT, padx = 5, pady = 2)
-buttonVerRead  = Button (frameVersion, width = 10, text = "Read",  command = lambda: read_version(ser), state=DISABLED)
+buttonVerRead  = Button (frameVersion, width = 10, text = "Read",  command = lambda: read_version(clientFpga), state=DISABLED)
 buttonVerRead.pack(side=LEFT)
 frameVersion.pack(side=TOP, padx = 5, pady = 2)
 
@@ -422,6 +949,8 @@ frameParamTop.pack(side=TOP, padx = 5, pady = 0)
 frameSetXY      = Frame(root, borderwidth=3, relief=FLAT, padx = 5, pady = 2)
 buttonSetXY     = Button (frameSetXY, width = 10, text = "Download",  command = lambda: set_all_xy(), state=DISABLED)
 buttonSetXY.pack(side=LEFT,  padx = 5, pady = 5)
+buttonDetect    = Button (frameSetXY, width = 10, text = "Detect",  command = lambda: detect_boxes())
+buttonDetect.pack(side=LEFT,  padx = 5, pady = 5)
 frameSetXY.pack(side=TOP, padx = 5, pady = 1)
 
 #-----------------------------------------------------------------------------------------------------------------------------
@@ -429,43 +958,163 @@ frameSetXY.pack(side=TOP, padx = 5, pady = 1)
 #-----------------------------------------------------------------------------------------------------------------------------
 #image = Image.open("D:/Work/Blob.png")
 #image = Image.open("single_sample.png")
-image = Image.open(fileNamePng)
+image = imageFrame
 image_width, image_height = image.size
 print ('image width  = {0:8}' .format(image_width))
 print ('image height = {0:8}' .format(image_height))
 
-# Calculate the best scale factor to use for the image to fit the canvas while keeping the aspect ratio
-xfactor = nCanvasSizeX/image_width      # e.g 700 / 1400 = 0.5
-yfactor = nCanvasSizeY/image_height     # e.g.500 /  600 = 0.83  
-scale_factor = min(xfactor, yfactor)    # We scale both dimensions by 0.5
+# Crop boxes are kept in image pixels, clamped to the image
+cropBoxes = CropBoxList(NUM_REGS, image_width, image_height, nCropBoxPixX, nCropBoxPixY)
 
-# Resize the image to fit the canvas
-resize_width  =  int(image_width*scale_factor)
-resize_height =  int(image_height*scale_factor)
-print ('image width resize  = {0:8}' .format(resize_width))
-print ('image height resize = {0:8}' .format(resize_height))
-img = image.resize((resize_width, resize_height))
-resize_width, resize_height = img.size
-
-# Calculate scale factors. xfactor * click_x = x pixel location in original image
-xfactor = image_width/resize_width
-yfactor = image_height/resize_height
-
-nCropBoxDrawX   = nCropBoxPixX / xfactor  # Box size in canvas 
-nCropBoxDrawY   = nCropBoxPixY / yfactor  # Box size in canvas 
+# Image resampled per zoom level when first shown. The view object
+# does all canvas <-> image pixel transforms.
+with profiler.stage('resize'):
+    pyramidImage = ImagePyramid(image)
+profiler.instrument(pyramidImage, 'photo', 'photoimage')
+viewCanvas   = CanvasView(image_width, image_height, nCanvasSizeX, nCanvasSizeY, pyramidImage.scales)
+print ('image scale         = {0:8.3f}' .format(viewCanvas.scale))
 
 canvas1 = Canvas(root, width=nCanvasSizeX, height=nCanvasSizeY, relief=SUNKEN, borderwidth=1)
-canvas1.image = ImageTk.PhotoImage(img)     
-canvas1.create_image(0, 0, image=canvas1.image, anchor='nw')
-canvas1.pack()
+nImageItem = canvas1.create_image(0, 0, anchor='nw')
 canvas1.bind('<Button-1>', OnCanvasClick)                  
 
+# Crop boxes, their centre crosses and the click history are a fixed pool of canvas items
+overlayBoxes = CropOverlay(canvas1, viewCanvas, NUM_REGS, nCropBoxPixX, nCropBoxPixY, history_cap = args.history)
+canvas1.bind('<Configure>', OnCanvasResize)
+canvas1.bind('<MouseWheel>', OnCanvasWheel)
+canvas1.bind('<Button-4>', OnCanvasWheel)
+canvas1.bind('<Button-5>', OnCanvasWheel)
+canvas1.bind('<ButtonPress-3>', OnCanvasPanStart)
+canvas1.bind('<B3-Motion>', OnCanvasPan)
+canvas1.bind('<Double-Button-3>', OnCanvasFit)
+
+# Kymograph line. One canvas item, moved as the line is drawn.
+nLineItem  = canvas1.create_line(0, 0, 0, 0, fill = 'cyan', width = 2, state = 'hidden', tags = ('overlay',))
+windowKymo = None
+photoKymo  = None
+canvas1.bind('<Shift-ButtonPress-1>', OnLineStart)
+canvas1.bind('<Shift-B1-Motion>', OnLineDrag)
+canvas1.bind('<Shift-ButtonRelease-1>', OnLineEnd)
+
+# A crop archive frame comes with the boxes it was cropped with
+if arg_fileType == 'crops':
+    for box_x0, box_y0 in stackFrames.archive.boxes(arg_frameIndex):
+        cropBoxes.add(int(box_x0), int(box_y0))
+    show_boxes()
+
+#-----------------------------------------------------------------------------------------------------------------------------
+# Live display. Frames are grabbed in a background thread; the display
+# pastes the latest one into a single PhotoImage every tick.
+#-----------------------------------------------------------------------------------------------------------------------------
+liveDisplay = None
+if args.live is not None:
+
+    from rheed.tracking import SpotTracker, SerialBudget
+    from rheed.roistats import RoiStats
+    from rheed.oscillation import OscillationAnalyzer
+    from rheed.golden import GoldenModel, regs_to_results
+    from rheed.validate import ResultValidator
+    from rheed.resultplot import ResultHistory, ResultPlot, REFRESH_MS
+
+    if args.live == 'replay':
+        sourceLive = StackReplaySource(open_frames(arg_fileNameBase, arg_fileType), fps = args.fps, start = arg_frameIndex)
+    elif args.live == 'tail':
+        sourceLive = RawTailSource(arg_fileNameBase + '.raw', arg_fileNameBase + '.hdr')
+    elif args.live == 'synthetic':
+        from rheed.synthetic import SyntheticRheed, SyntheticSource
+        # Drifting, oscillating spots the size and type of the shown frame
+        generatorLive = SyntheticRheed(ds_arr.shape[0], ds_arr.shape[1], dtype = ds_arr.dtype, drift = (0.01, 0.005),
+                                       walk = 0.02, period = 2.0 * args.fps, decay = 60.0 * args.fps)
+        sourceLive = SyntheticSource(generatorLive, fps = args.fps)
+    elif args.live == 'ring':
+        from rheed.shmring import RingSource
+        sourceLive = RingSource(args.ring)
+    else:
+        sourceLive = SocketSource(port = args.port)
+
+    grabberLive = FrameGrabber(sourceLive)
+    liveDisplay = LiveDisplay(root, canvas1, nImageItem, grabberLive, normDisplay, pyramidImage.level_size,
+                              period_ms = max(1, int(1000 / args.fps)))
+    liveDisplay.profiler = profiler
+    # The loaded frame is shown until Live brings in the first frame
+    liveDisplay.frame    = ds_arr
+
+    # Calibration and filtering of live frames, in preallocated buffers
+    if (calFrames is not None) or (args.filter != 'none'):
+        liveDisplay.preprocess = FramePreprocessor(ds_arr.shape, calFrames, args.filter, alpha = args.alpha, n = args.navg)
+
+    strLive     = StringVar()
+    frameLive   = Frame(root, borderwidth=3, relief=FLAT, padx = 5, pady = 2)
+    buttonLive  = Button (frameLive, width = 10, text = "Live", command = live_start_stop)
+    buttonLive.pack(side=LEFT, padx = 5, pady = 2)
+    varAutoDetect = IntVar()
+    Checkbutton (frameLive, text = 'Auto detect', variable = varAutoDetect).pack(side=LEFT, padx = 5, pady = 2)
+
+    # Spot tracking runs on every live frame. Serial traffic is limited to a share of the line.
+    trackerSpots  = SpotTracker(cropBoxes.words(), image_cols = image_width, image_rows = image_height,
+                                box_cols = nCropBoxPixX, box_rows = nCropBoxPixY, threshold = args.drift, budget = SerialBudget())
+    varTrack      = IntVar()
+    Checkbutton (frameLive, text = 'Track', variable = varTrack, command = track_start_stop).pack(side=LEFT, padx = 5, pady = 2)
+
+    # More regions than boxes, rotated through the boxes frame by frame
+    schedulerScan = None
+    varScan       = IntVar()
+    Checkbutton (frameLive, text = 'Scan', variable = varScan, command = scan_start_stop).pack(side=LEFT, padx = 5, pady = 2)
+
+    # Oscillation period of each box from a sliding DFT of its mean intensity
+    analyzerOsc   = OscillationAnalyzer(NUM_REGS, args.window, dt = 1.0 / args.fps)
+    statsOsc      = None
+    wordsOsc      = None
+    strOsc        = StringVar()
+    Label (frameLive, width = 44, textvariable = strOsc, anchor = 'w').pack(side=LEFT, padx = 5, pady = 2)
+
+    # Result register validation. swap_xy counts boxes matching crops with x and y exchanged.
+    validatorResults = ResultValidator(GoldenModel(args.network, nCropBoxPixX, nCropBoxPixY), NUM_REGS,
+                                       alternatives = {'swap_xy': GoldenModel(args.network, nCropBoxPixX, nCropBoxPixY, swap_xy = True)})
+    varValidate   = IntVar()
+    Checkbutton (frameLive, text = 'Validate', variable = varValidate, command = validate_start_stop).pack(side=LEFT, padx = 5, pady = 2)
+
+    # Result channels of every box, pushed into a ring each frame and plotted in their own window
+    historyResults = ResultHistory(NUM_REGS)
+    windowPlot    = None
+    plotResults   = None
+    afterPlot     = None
+    varPlot       = IntVar()
+    Checkbutton (frameLive, text = 'Plot', variable = varPlot, command = plot_start_stop).pack(side=LEFT, padx = 5, pady = 2)
+    liveDisplay.on_frame = on_live_frame
+
+    # Registers of each frame, read in the grabber thread while the analyses want them
+    bReadRegisters = False
+    wordsGrabbed   = None
+    if len(comlist) > 0:
+        grabberLive.on_grab = grab_registers
+
+    # Results file, appended to in batches while the GUI runs
+    recorderResults = None
+    if args.record is not None:
+        from rheed.recorder import ResultsRecorder
+        recorderResults = ResultsRecorder(args.record, NUM_REGS, attrs = {'source': arg_fileNameBase, 'gui': strScriptVersion})
+        print ('Recording results to {}' .format(args.record))
+    Label (frameLive, width = 36, textvariable = strLive, anchor = 'w').pack(side=LEFT, padx = 5, pady = 2)
+    frameLive.pack(side=BOTTOM, padx = 5, pady = 1)
+
+# First level shown (live mode: its PhotoImage is the live one)
+draw_view()
+
 #-----------------------------------------------------------------------------------------------------------------------------
-# Quit button
+# Quit button. Packed before the canvas so it stays visible when the window shrinks.
 #-----------------------------------------------------------------------------------------------------------------------------
 frameQuitHelp   = Frame(root, borderwidth=3,relief=FLAT, padx = 2, pady = 2)
 buttonQuit      = Button (frameQuitHelp, width = 10, text = "Quit",        command = root.quit).pack(side=RIGHT, padx = 5, pady = 5)
-frameQuitHelp.pack(side=TOP, padx = 1, pady = 1)
+buttonLog       = Button (frameQuitHelp, width = 10, text = "Event log",   command = lambda: LOG.dump(everything = True)).pack(side=RIGHT, padx = 5, pady = 5)
+frameQuitHelp.pack(side=BOTTOM, padx = 1, pady = 1)
+
+# Ctrl+L prints the events since the last dump. An exception in a
+# callback prints the events that led up to it before the traceback.
+root.bind('<Control-l>', lambda event: LOG.dump())
+root.report_callback_exception = report_callback_exception
+
+canvas1.pack(side=TOP, fill=BOTH, expand=True)
 
 #-----------------------------------------------------------------------------------------------------------------------------
 # Enable buttons if a COM port is present
@@ -475,5 +1124,13 @@ if len(comlist) != 0:
     buttonSetXY.config(state=NORMAL)
     buttonVerRead.config(state=NORMAL)
 
+profiler.end('startup', profiler.tOrigin)
 mainloop()
 
+if (liveDisplay is not None) and (recorderResults is not None):
+    recorderResults.close()
+    print ('Recorded {} result sets' .format(len(recorderResults)))
+
+# Stage summary and timeline of the session
+profiler.report(args.profile)
+
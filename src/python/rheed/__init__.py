@@ -0,0 +1,34 @@
+#---------------------------------------------------------------
+# Host-side support library for the RHEED FPGA GUI and tools
+#---------------------------------------------------------------
+# Modules:
+#   frames  : .h5 / .png / raw / .npy frame loaders
+#   display : 8-bit display normalization through a contrast LUT
+#   view    : cached image pyramid and canvas <-> pixel view transforms
+#   crop    : crop box list and parameter register packing
+#   live    : live frame sources and PhotoImage-reusing live display
+#   overlay : fixed pool of canvas items for crop boxes and click history
+#   spots   : diffraction spot detection and crop box proposal
+#   golden  : bit-exact model of the crop + hls4ml result registers
+#   fitting : batched 2-D Gaussian fits of crop boxes, process pool over .h5 runs
+#   roistats: integral image sum / mean / variance of many boxes over frame stacks
+#   tracking: closed-loop spot drift tracking, changed-register writes on a byte budget
+#   oscillation: sliding-DFT period / phase / damping of per-box sample streams
+#   calibrate: dark / flat calibration and EMA / N-frame mean in preallocated buffers
+#   validate: sampled check of the FPGA result registers against the golden model
+#   kymograph: line profiles (precomputed bilinear gather) and kymographs of stacks
+#   synthetic: vectorized synthetic RHEED frames with ground truth (h5 / raw / npy / live)
+#   recorder: append-only SWMR .h5 recorder of result sets with frame / crop config
+#   archive : compact crop-box-only .crops.h5 archive, benchmark-chosen compression
+#   shmring : shared-memory frame ring, one producer and lock-free readers in other processes
+#   perfmodel: clock-level model of the CustomLogic sequentializer / crop filter / hls4ml chain
+#   scheduler: rotates more regions than crop boxes through the boxes, tags results by region
+#   regclient: serial register client (batched reads / writes), standard library + pyserial only
+#   bench   : frames/s and peak memory of each host image stage (h5 read .. canvas update), JSON report
+#   profiling: per-stage timers, summary table and Chrome trace timeline (--profile), cProfile / tracemalloc
+#   eventlog: leveled event log in a preallocated ring, formatted only when printed or dumped
+#   resultplot: per-box result channel history (ring + min/max decimation) and its Tk canvas plot
+#   cli     : headless command line, python -m rheed (imports each command's modules on use)
+#
+# Modules are not imported here; import the one you need.
+#---------------------------------------------------------------
@@ -0,0 +1,10 @@
+#---------------------------------------------------------------
+# python -m rheed : headless command line (rheed.cli)
+# Guarded: process pool workers (fit) import this module again.
+#---------------------------------------------------------------
+import  sys
+
+from    .cli import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+#---------------------------------------------------------------
+# Compact crop-box archive of long recordings
+#---------------------------------------------------------------
+# Only the crop box pixels of each frame are kept, with the box
+# words, the frame counter and the time. Layout of <base>.crops.h5:
+#
+#   crops      (N, boxes, box_rows, box_cols)   frame dtype
+#   params     (N, boxes)                       uint32 crop box words
+#   frame      (N,)                             int64 frame counter
+#   timestamp  (N,)                             float64
+#   attrs      rows, cols, box_cols, box_rows, compression, benchmark
+#
+# Five 48x48 boxes are 11520 pixels per frame, so the saving over
+# full frames grows with the sensor size (1.4x for 160x104, 27x for
+# 640x480) before compression.
+#
+# The lossless compression is chosen by benchmark: the first batch
+# of crops is written with every available h5 filter setting to an
+# in-memory file. Of the settings that write faster than 'min_mb_s'
+# the fastest within 5% of the best ratio is used. The benchmark
+# table is saved in the file.
+#
+# CropArchive reads one chunk-aligned block at a time and returns
+# crops as views of that block. frame() puts the crops of a frame
+# back in their original positions; open_crop_archive() presents
+# the archive as a FrameStack so the GUI can show it like a stack.
+#---------------------------------------------------------------
+import  io
+import  json
+import  time
+
+import  numpy as np
+
+from    .crop import NUM_BOXES, BOX_COLS, BOX_ROWS, IN_COLS, IN_ROWS
+from    .golden import crop_boxes
+
+ARCHIVE_SUFFIX  = '.crops.h5'
+BATCH_FRAMES    = 256       # Frames per write (and per h5 chunk)
+MIN_MB_S        = 20.0      # Slowest acceptable compressed write speed
+RATIO_TOLERANCE = 0.05      # Ratios this close to the best count as equal
+
+# (name, compression, compression_opts, shuffle)
+COMPRESSION_CANDIDATES = [('none',          None,   None,   False),
+                          ('lzf',           'lzf',  None,   False),
+                          ('lzf+shuffle',   'lzf',  None,   True),
+                          ('gzip1',         'gzip', 1,      False),
+                          ('gzip1+shuffle', 'gzip', 1,      True),
+                          ('gzip4+shuffle', 'gzip', 4,      True),
+                          ('gzip9+shuffle', 'gzip', 9,      True)]
+
+
+#---------------------------------------------------------------
+# Write 'sample' with each candidate filter to an in-memory h5 file.
+# Returns a list of dicts: name, ratio (raw / stored), write and
+# read speed in MB/s of raw data.
+#---------------------------------------------------------------
+def benchmark_compression(sample, candidates = COMPRESSION_CANDIDATES):
+    import h5py
+
+    sample  = np.ascontiguousarray(sample)
+    nMB     = sample.nbytes / 1e6
+    results = []
+    for name, compression, opts, shuffle in candidates:
+        with h5py.File(io.BytesIO(), 'w') as f:
+            tStart = time.perf_counter()
+            ds = f.create_dataset('x', data = sample, chunks = sample.shape, compression = compression,
+                                  compression_opts = opts, shuffle = shuffle)
+            f.flush()
+            tWrite = time.perf_counter() - tStart
+            stored = ds.id.get_storage_size()
+            tStart = time.perf_counter()
+            ds[()]
+            tRead  = time.perf_counter() - tStart
+        results.append({'name': name, 'compression': compression, 'compression_opts': opts, 'shuffle': shuffle,
+                        'ratio': sample.nbytes / max(stored, 1),
+                        'write_mb_s': nMB / max(tWrite, 1e-9), 'read_mb_s': nMB / max(tRead, 1e-9)})
+    return results
+
+
+#---------------------------------------------------------------
+# Best benchmark entry: among those writing at least min_mb_s, the
+# fastest within 'tolerance' of the highest ratio. The fastest
+# entry if none is fast enough.
+#---------------------------------------------------------------
+def choose_compression(results, min_mb_s = MIN_MB_S, tolerance = RATIO_TOLERANCE):
+    fast = [r for r in results if r['write_mb_s'] >= min_mb_s]
+    if not fast:
+        return max(results, key = lambda r: r['write_mb_s'])
+    best = max(r['ratio'] for r in fast)
+    return max([r for r in fast if r['ratio'] >= best * (1 - tolerance)], key = lambda r: r['write_mb_s'])
+
+
+#---------------------------------------------------------------
+# Archive writer. Use as a context manager or call close().
+#---------------------------------------------------------------
+class CropArchiveWriter:
+
+    #-----------------------------------------------------------
+    # compression : 'auto' (benchmark the first batch) or the name
+    #               of one of COMPRESSION_CANDIDATES
+    #-----------------------------------------------------------
+    def __init__(self, fileNameH5, dtype = np.uint8, num_boxes = NUM_BOXES, image_cols = IN_COLS, image_rows = IN_ROWS,
+                 box_cols = BOX_COLS, box_rows = BOX_ROWS, compression = 'auto', batch = BATCH_FRAMES, min_mb_s = MIN_MB_S):
+        import h5py
+
+        self.fileName       = fileNameH5
+        self.dtype          = np.dtype(dtype)
+        self.num_boxes      = num_boxes
+        self.box_cols       = box_cols
+        self.box_rows       = box_rows
+        self.batch          = batch
+        self.compression    = compression
+        self.min_mb_s       = min_mb_s
+        self.benchmark      = None
+        self.nWritten       = 0
+        self.nBuffered      = 0
+
+        self._buffers = {'crops'     : np.zeros((batch, num_boxes, box_rows, box_cols), dtype = self.dtype),
+                         'params'    : np.zeros((batch, num_boxes), dtype = np.uint32),
+                         'frame'     : np.zeros(batch, dtype = np.int64),
+                         'timestamp' : np.zeros(batch, dtype = np.float64)}
+        self._datasets = None
+
+        self.file = h5py.File(fileNameH5, 'w')
+        self.file.attrs['rows']      = image_rows
+        self.file.attrs['cols']      = image_cols
+        self.file.attrs['box_cols']  = box_cols
+        self.file.attrs['box_rows']  = box_rows
+        self.file.attrs['num_boxes'] = num_boxes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.nWritten + self.nBuffered
+
+    #-----------------------------------------------------------
+    # Add one frame (H, W) cropped with its box words (boxes,)
+    #-----------------------------------------------------------
+    def append(self, frame, words, counter = None, timestamp = None):
+        i = self.nBuffered
+        self._buffers['crops'][i]     = crop_boxes(frame, words, self.box_cols, self.box_rows)[0]
+        self._buffers['params'][i]    = words
+        self._buffers['frame'][i]     = len(self) if counter is None else counter
+        self._buffers['timestamp'][i] = time.time() if timestamp is None else timestamp
+        self.nBuffered += 1
+        if self.nBuffered == self.batch:
+            self.flush()
+
+    #-----------------------------------------------------------
+    # Add a block of frames (F, H, W) with words (boxes,) or (F, boxes)
+    #-----------------------------------------------------------
+    def extend(self, frames, words, counters = None, timestamps = None):
+        frames = np.asarray(frames)
+        n      = frames.shape[0]
+        words  = np.broadcast_to(np.asarray(words, dtype = np.uint32), (n, self.num_boxes))
+        crops  = crop_boxes(frames, words, self.box_cols, self.box_rows)
+        if counters is None:
+            counters = np.arange(len(self), len(self) + n)
+        if timestamps is None:
+            timestamps = np.full(n, time.time())
+        i = 0
+        while i < n:
+            nTake = min(n - i, self.batch - self.nBuffered)
+            j     = self.nBuffered
+            self._buffers['crops'][j:j + nTake]     = crops[i:i + nTake]
+            self._buffers['params'][j:j + nTake]    = words[i:i + nTake]
+            self._buffers['frame'][j:j + nTake]     = counters[i:i + nTake]
+            self._buffers['timestamp'][j:j + nTake] = timestamps[i:i + nTake]
+            self.nBuffered += nTake
+            i += nTake
+            if self.nBuffered == self.batch:
+                self.flush()
+
+    def flush(self):
+        n = self.nBuffered
+        if n == 0:
+            return
+        if self._datasets is None:
+            self._create(self._buffers['crops'][:n])
+        for name, ds in self._datasets.items():
+            ds.resize(self.nWritten + n, axis = 0)
+            ds[self.nWritten:self.nWritten + n] = self._buffers[name][:n]
+        self.file.flush()
+        self.nWritten  += n
+        self.nBuffered  = 0
+
+    #-----------------------------------------------------------
+    # Create the datasets with the compression picked for 'sample'
+    #-----------------------------------------------------------
+    def _create(self, sample):
+        if self.compression == 'auto':
+            self.benchmark = benchmark_compression(sample)
+            best = choose_compression(self.benchmark, self.min_mb_s)
+            self.file.attrs['benchmark'] = json.dumps(self.benchmark)
+        else:
+            best = [dict(zip(('name', 'compression', 'compression_opts', 'shuffle'), c)) for c in COMPRESSION_CANDIDATES
+                    if c[0] == self.compression]
+            if not best:
+                raise ValueError('Unknown compression "{}". Expected auto or one of {}'
+                                 .format(self.compression, [c[0] for c in COMPRESSION_CANDIDATES]))
+            best = best[0]
+        self.file.attrs['compression'] = best['name']
+
+        self._datasets = {}
+        for name, buf in self._buffers.items():
+            filters = {}
+            if name == 'crops':
+                filters = {'compression': best['compression'], 'compression_opts': best['compression_opts'], 'shuffle': best['shuffle']}
+            elif best['compression'] is not None:
+                filters = {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True}
+            self._datasets[name] = self.file.create_dataset(name, shape = (0,) + buf.shape[1:], maxshape = (None,) + buf.shape[1:],
+                                                            dtype = buf.dtype, chunks = (self.batch,) + buf.shape[1:], **filters)
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+#---------------------------------------------------------------
+# Archive reader
+#---------------------------------------------------------------
+class CropArchive:
+
+    def __init__(self, fileNameH5):
+        import h5py
+
+        self.file       = h5py.File(fileNameH5, 'r')
+        self.fileName   = fileNameH5
+        attrs           = self.file.attrs
+        self.rows       = int(attrs['rows'])
+        self.cols       = int(attrs['cols'])
+        self.box_cols   = int(attrs['box_cols'])
+        self.box_rows   = int(attrs['box_rows'])
+        self.num_boxes  = int(attrs['num_boxes'])
+        self.compression = attrs.get('compression', 'none')
+        if 'crops' in self.file:
+            self._crops     = self.file['crops']
+            self.params     = self.file['params'][()]      # Small; kept in memory
+            self.counters   = self.file['frame'][()]
+            self.timestamps = self.file['timestamp'][()]
+            self._nBlock    = self._crops.chunks[0]
+        else:
+            self._crops     = None
+            self.params     = np.zeros((0, self.num_boxes), dtype = np.uint32)
+            self.counters   = np.zeros(0, dtype = np.int64)
+            self.timestamps = np.zeros(0)
+            self._nBlock    = BATCH_FRAMES
+        self._block     = None
+        self._nFirst    = -1
+        self._frameBuf  = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.params.shape[0]
+
+    @property
+    def dtype(self):
+        return np.dtype(self._crops.dtype) if self._crops is not None else np.dtype(np.uint8)
+
+    @property
+    def benchmark(self):
+        text = self.file.attrs.get('benchmark')
+        return None if text is None else json.loads(text)
+
+    #-----------------------------------------------------------
+    # Crops of frame i, (boxes, box_rows, box_cols): a view of the
+    # cached block, valid until a frame of another block is read
+    #-----------------------------------------------------------
+    def crops(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('frame index {} out of range'.format(index))
+        nFirst = index - index % self._nBlock
+        if nFirst != self._nFirst:
+            self._block  = self._crops[nFirst:nFirst + self._nBlock]
+            self._nFirst = nFirst
+        return self._block[index - nFirst]
+
+    #-----------------------------------------------------------
+    # Crops of frames start .. stop-1 (n, boxes, box_rows, box_cols)
+    #-----------------------------------------------------------
+    def block(self, start = 0, stop = None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self._crops[start:stop]
+
+    #-----------------------------------------------------------
+    # Upper left corners (boxes, 2) of frame i
+    #-----------------------------------------------------------
+    def boxes(self, index):
+        words = self.params[index].astype(np.int64)
+        return np.stack([(words >> 16) & 0xFFFF, words & 0xFFFF], axis = -1)
+
+    #-----------------------------------------------------------
+    # Full frame i with the crops in their original positions and
+    # 'fill' elsewhere. Later boxes are drawn over earlier ones.
+    #-----------------------------------------------------------
+    def frame(self, index, fill = 0, out = None):
+        if out is None:
+            out = np.empty((self.rows, self.cols), dtype = self.dtype)
+        out[...] = fill
+        crops = self.crops(index)
+        for (x0, y0), crop in zip(self.boxes(index), crops):
+            out[y0:y0 + self.box_rows, x0:x0 + self.box_cols] = crop
+        return out
+
+    def close(self):
+        self.file.close()
+
+
+#---------------------------------------------------------------
+# Frames of an archive rebuilt on demand, as FrameStack data
+#---------------------------------------------------------------
+class _ArchiveFrames:
+
+    def __init__(self, archive):
+        self.archive    = archive
+        self.shape      = (len(archive), archive.rows, archive.cols)
+        self.dtype      = archive.dtype
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return np.stack([self.archive.frame(i) for i in range(*index.indices(self.shape[0]))]) if self.shape[0] else \
+                   np.zeros((0,) + self.shape[1:], dtype = self.dtype)
+        return self.archive.frame(index)
+
+
+#---------------------------------------------------------------
+# Open an archive as a FrameStack (see rheed.frames)
+#---------------------------------------------------------------
+def open_crop_archive(fileNameH5):
+    from .frames import FrameStack
+
+    archive = CropArchive(fileNameH5)
+    stack   = FrameStack(_ArchiveFrames(archive), fileNameH5, 'crops', closer = archive.close)
+    stack.archive = archive
+    return stack
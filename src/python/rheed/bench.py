@@ -0,0 +1,265 @@
+#---------------------------------------------------------------
+# Benchmarks of the host-side image pipeline stages
+#---------------------------------------------------------------
+# Each stage is timed on the frames of a source:
+#
+#   h5_read          one frame from the .h5 dataset
+#   h5_read_block    BLOCK_FRAMES frames per read (per frame rate)
+#   normalize_float  float64 min/max scaling to uint8 (plain numpy)
+#   normalize_lut    DisplayNormalizer table lookup into a reused buffer
+#   png_roundtrip    Image.fromarray -> save .png -> Image.open -> load
+#                    (the original GUI path, with a temporary file)
+#   fromarray        Image.fromarray of the 8-bit frame (direct path)
+#   resize_nearest   image.resize to DISPLAY_SIZE, NEAREST
+#   resize_bilinear  image.resize to DISPLAY_SIZE, BILINEAR
+#   photoimage_new   ImageTk.PhotoImage of the resized image
+#   photoimage_paste paste into one reused PhotoImage (live display)
+#   canvas_update    itemconfig of a canvas image + update_idletasks
+#
+# Sources are .h5 files (first root key, 2-D or 3-D) and synthetic
+# stacks 'ROWSxCOLSxFRAMES' written to a temporary .h5 file.
+#
+# A stage runs for at least 'seconds' and is then run once more under
+# tracemalloc for its peak memory. tracemalloc sees Python and numpy
+# allocations but not the C buffers of PIL, Tk or HDF5; 'max_rss_kb'
+# (process high-water mark after the stage) covers those coarsely.
+# Tk stages are skipped, with the reason, when no display is available.
+#
+# run() returns a JSON-ready dict; compare() puts two of them side by side.
+#---------------------------------------------------------------
+import  os
+import  sys
+import  time
+import  tracemalloc
+
+import  numpy as np
+
+BENCH_SECONDS   = 0.5           # Shortest timing run per stage
+BLOCK_FRAMES    = 64            # Frames per h5_read_block read
+DISPLAY_SIZE    = (800, 600)    # Resize target (canvas size)
+
+STAGES          = ['h5_read', 'h5_read_block', 'normalize_float', 'normalize_lut', 'png_roundtrip', 'fromarray',
+                   'resize_nearest', 'resize_bilinear', 'photoimage_new', 'photoimage_paste', 'canvas_update']
+TK_STAGES       = ['photoimage_new', 'photoimage_paste', 'canvas_update']
+
+
+#---------------------------------------------------------------
+# Time fn(i) for i = 0, 1, ... for at least 'seconds'. fn returns
+# the number of frames it handled. Returns frames/s, ms per frame,
+# calls made and the tracemalloc peak of one more call.
+#---------------------------------------------------------------
+def time_stage(fn, seconds = BENCH_SECONDS):
+    fn(0)                                                   # Warm up caches, lazy imports
+    nCalls  = 0
+    nFrames = 0
+    tStart  = time.perf_counter()
+    while True:
+        nFrames += fn(nCalls)
+        nCalls  += 1
+        tElapsed = time.perf_counter() - tStart
+        if tElapsed >= seconds:
+            break
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn(nCalls)
+    _, nPeak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'frames_per_s': nFrames / tElapsed, 'ms_per_frame': 1e3 * tElapsed / max(nFrames, 1), 'calls': nCalls,
+            'peak_kb': nPeak / 1024, 'max_rss_kb': _max_rss_kb()}
+
+
+def _max_rss_kb():
+    try:
+        import resource
+    except ImportError:                                     # Windows
+        return None
+    nRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return nRss / 1024 if sys.platform == 'darwin' else nRss
+
+
+#---------------------------------------------------------------
+# Synthetic stack 'ROWSxCOLSxFRAMES' written to fileNameH5
+#---------------------------------------------------------------
+def write_synthetic(spec, fileNameH5):
+    from .synthetic import SyntheticRheed, write_h5
+
+    rows, cols, frames = (int(v) for v in spec.lower().split('x'))
+    write_h5(fileNameH5, SyntheticRheed(rows, cols, seed = 1), frames)
+    return fileNameH5
+
+
+#---------------------------------------------------------------
+# Stage functions for one open dataset. Each returns fn(i) -> frames.
+#---------------------------------------------------------------
+def _stage_functions(ds, tk, tmpdir):
+    from PIL import Image
+    from .display import DisplayNormalizer
+
+    nFrames = ds.shape[0] if ds.ndim == 3 else 1
+    frame_n = (lambda i: ds[i % nFrames]) if ds.ndim == 3 else (lambda i: ds[()])
+    frames  = [frame_n(i) for i in range(min(nFrames, BLOCK_FRAMES))]     # In memory, for the later stages
+    frame   = lambda i: frames[i % len(frames)]
+    norm    = DisplayNormalizer('percentile')
+    buf8    = np.empty(frames[0].shape, dtype = np.uint8)
+    image8  = Image.fromarray(norm(frames[0], out = buf8))
+    resized = image8.resize(DISPLAY_SIZE, Image.NEAREST)
+    fileNamePng = os.path.join(tmpdir, 'bench.png')
+
+    def h5_read(i):
+        frame_n(i)
+        return 1
+
+    def h5_read_block(i):
+        if ds.ndim == 2:
+            ds[()]
+            return 1
+        nFirst = (i * BLOCK_FRAMES) % max(nFrames - BLOCK_FRAMES + 1, 1)
+        return ds[nFirst:nFirst + BLOCK_FRAMES].shape[0]
+
+    def normalize_float(i):
+        f  = frame(i).astype(np.float64)
+        lo = f.min()
+        ((f - lo) * (255.0 / max(f.max() - lo, 1e-12))).astype(np.uint8)
+        return 1
+
+    def normalize_lut(i):
+        norm(frame(i), out = buf8)
+        return 1
+
+    def png_roundtrip(i):
+        Image.fromarray(frame(i)).save(fileNamePng)
+        with Image.open(fileNamePng) as image:
+            image.load()
+        return 1
+
+    def fromarray(i):
+        Image.fromarray(norm(frame(i), out = buf8))
+        return 1
+
+    def resize_nearest(i):
+        image8.resize(DISPLAY_SIZE, Image.NEAREST)
+        return 1
+
+    def resize_bilinear(i):
+        image8.resize(DISPLAY_SIZE, Image.BILINEAR)
+        return 1
+
+    functions = {'h5_read': h5_read, 'h5_read_block': h5_read_block, 'normalize_float': normalize_float,
+                 'normalize_lut': normalize_lut, 'png_roundtrip': png_roundtrip, 'fromarray': fromarray,
+                 'resize_nearest': resize_nearest, 'resize_bilinear': resize_bilinear}
+    if tk is not None:
+        from PIL import ImageTk
+
+        root, canvas = tk
+        photo = ImageTk.PhotoImage(resized, master = root)
+        item  = canvas.create_image(0, 0, image = photo, anchor = 'nw')
+        keep  = [photo]
+
+        def photoimage_new(i):
+            keep[0] = ImageTk.PhotoImage(resized, master = root)
+            return 1
+
+        def photoimage_paste(i):
+            photo.paste(resized)
+            return 1
+
+        def canvas_update(i):
+            photo.paste(resized)
+            canvas.itemconfig(item, image = photo)
+            root.update_idletasks()
+            return 1
+
+        functions.update({'photoimage_new': photoimage_new, 'photoimage_paste': photoimage_paste, 'canvas_update': canvas_update})
+    return functions
+
+
+#---------------------------------------------------------------
+# A hidden Tk root and canvas, or (None, reason) without a display
+#---------------------------------------------------------------
+def _open_tk():
+    try:
+        import tkinter
+        root = tkinter.Tk()
+    except Exception as e:                                  # ImportError, TclError (no display)
+        return None, str(e).splitlines()[0] if str(e) else type(e).__name__
+    root.withdraw()
+    canvas = tkinter.Canvas(root, width = DISPLAY_SIZE[0], height = DISPLAY_SIZE[1])
+    canvas.pack()
+    return (root, canvas), None
+
+
+#---------------------------------------------------------------
+# Run the stages on every source.
+# sources   : .h5 file names
+# synthetic : stack specs 'ROWSxCOLSxFRAMES'
+# Returns {'machine': {...}, 'results': [{source, shape, dtype,
+# stage, frames_per_s, ms_per_frame, calls, peak_kb, max_rss_kb}
+# or {source, stage, skipped}]}
+#---------------------------------------------------------------
+def run(sources = (), synthetic = (), stages = None, seconds = BENCH_SECONDS, log = None):
+    import tempfile
+    import h5py
+
+    stages = list(STAGES if stages is None else stages)
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise ValueError('Unknown stages {}. Expected some of {}' .format(unknown, STAGES))
+    tk, strNoTk = (None, None)
+    if any(s in TK_STAGES for s in stages):
+        tk, strNoTk = _open_tk()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputs = [(fileName, fileName) for fileName in sources]
+        inputs += [(spec, write_synthetic(spec, os.path.join(tmpdir, 'synthetic_{}.h5' .format(spec)))) for spec in synthetic]
+        for name, fileNameH5 in inputs:
+            with h5py.File(fileNameH5, 'r') as f:
+                ds        = f['frames'] if 'frames' in f else f[list(f.keys())[0]]
+                functions = _stage_functions(ds, tk, tmpdir)
+                for stage in stages:
+                    if stage not in functions:
+                        result = {'source': name, 'stage': stage, 'skipped': 'no Tk display: {}' .format(strNoTk)}
+                    else:
+                        result = {'source': name, 'shape': list(ds.shape), 'dtype': str(ds.dtype), 'stage': stage}
+                        result.update(time_stage(functions[stage], seconds))
+                    results.append(result)
+                    if log is not None:
+                        log(format_result(result))
+    if tk is not None:
+        tk[0].destroy()
+    return {'machine': machine_info(), 'seconds': seconds, 'display_size': list(DISPLAY_SIZE), 'results': results}
+
+
+def machine_info():
+    import platform
+    import h5py
+    import PIL
+
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'numpy': np.__version__, 'h5py': h5py.__version__, 'pillow': PIL.__version__,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def format_result(result):
+    if 'skipped' in result:
+        return '{:<24} {:<17} skipped ({})' .format(result['source'][-24:], result['stage'], result['skipped'])
+    return '{:<24} {:<17} {:>10.1f} frames/s {:>9.3f} ms {:>9.1f} kB peak' .format(
+        result['source'][-24:], result['stage'], result['frames_per_s'], result['ms_per_frame'], result['peak_kb'])
+
+
+#---------------------------------------------------------------
+# Side by side frames/s of two run() outputs (e.g. loaded from
+# .json), with the speed-up of 'new' over 'old'
+#---------------------------------------------------------------
+def compare(old, new):
+    key    = lambda r: (r['source'], r['stage'])
+    before = {key(r): r for r in old['results'] if 'skipped' not in r}
+    lines  = ['{:<24} {:<17} {:>12} {:>12} {:>8}' .format('source', 'stage', 'old fr/s', 'new fr/s', 'speed-up')]
+    for r in new['results']:
+        if 'skipped' in r or key(r) not in before:
+            continue
+        rOld = before[key(r)]['frames_per_s']
+        lines.append('{:<24} {:<17} {:>12.1f} {:>12.1f} {:>7.2f}x' .format(r['source'][-24:], r['stage'], rOld, r['frames_per_s'],
+                                                                         r['frames_per_s'] / max(rOld, 1e-12)))
+    return '\n'.join(lines)
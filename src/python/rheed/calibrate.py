@@ -0,0 +1,217 @@
+#---------------------------------------------------------------
+# Dark / flat calibration and temporal filtering of frames
+#---------------------------------------------------------------
+# Sits between the frame loaders / live sources and the display
+# and analysis code:
+#
+#   frame -> (frame - dark) * gain -> EMA or N-frame mean -> out
+#
+#   gain = mean(flat - dark) / (flat - dark), 1 where flat <= dark
+#
+# A FramePreprocessor allocates all its buffers once for the frame
+# shape; processing a frame only writes into them (numpy out=).
+# The returned frame is a buffer of the preprocessor and is valid
+# until the next call. By default the output has the input dtype
+# (rounded and clipped), so the display lookup table and spot
+# detection see the same kind of frames as before.
+#
+# Calibrations are stored next to a dataset as <base>.cal.npz and
+# loaded once per dataset (cached on file name and modification
+# time).
+#---------------------------------------------------------------
+import  os
+
+import  numpy as np
+
+FILTER_MODES    = ['none', 'ema', 'mean']
+CAL_SUFFIX      = '.cal.npz'
+CHUNK_FRAMES    = 64        # Frames averaged per read when building a calibration
+
+_cache          = {}        # (path, mtime) -> Calibration
+
+
+#---------------------------------------------------------------
+# Dark offset and flat-field gain for one frame shape
+#---------------------------------------------------------------
+class Calibration:
+
+    def __init__(self, dark = None, flat = None):
+        self.dark = None if dark is None else np.asarray(dark, dtype = np.float32)
+        self.gain = None
+        if flat is not None:
+            flat  = np.asarray(flat, dtype = np.float32)
+            resp  = flat - (self.dark if self.dark is not None else 0.0)
+            good  = resp > 0
+            self.gain = np.ones(flat.shape, dtype = np.float32)
+            if np.any(good):
+                self.gain[good] = resp[good].mean() / resp[good]
+        self.flat = flat
+
+    @property
+    def shape(self):
+        for a in (self.dark, self.gain):
+            if a is not None:
+                return a.shape
+        return None
+
+    def save(self, fileName):
+        arrays = {}
+        if self.dark is not None:
+            arrays['dark'] = self.dark
+        if self.flat is not None:
+            arrays['flat'] = self.flat
+        np.savez(fileName, **arrays)
+
+
+#---------------------------------------------------------------
+# Mean of a stack of frames (F, H, W), FrameStack or h5 dataset,
+# read in chunks
+#---------------------------------------------------------------
+def mean_frame(frames, chunk = CHUNK_FRAMES):
+    if np.ndim(frames) == 2:
+        return np.asarray(frames, dtype = np.float32)
+    total = np.zeros(frames.shape[1:3], dtype = np.float64)
+    for i in range(0, len(frames), chunk):
+        total += np.asarray(frames[i:i + chunk]).sum(axis = 0, dtype = np.float64)
+    return (total / max(len(frames), 1)).astype(np.float32)
+
+
+#---------------------------------------------------------------
+# Build a calibration from dark and flat frame stacks (either may
+# be None) and optionally save it for a dataset
+#---------------------------------------------------------------
+def build_calibration(dark_frames = None, flat_frames = None, fileNameBase = None):
+    dark = None if dark_frames is None else mean_frame(dark_frames)
+    flat = None if flat_frames is None else mean_frame(flat_frames)
+    cal  = Calibration(dark, flat)
+    if fileNameBase is not None:
+        cal.save(fileNameBase + CAL_SUFFIX)
+    return cal
+
+
+#---------------------------------------------------------------
+# Calibration for a dataset from <base>.cal.npz, or None if there
+# is none. Loaded once; reloaded only when the file changes.
+#---------------------------------------------------------------
+def load_calibration(fileNameBase):
+    fileName = os.path.abspath(fileNameBase + CAL_SUFFIX)
+    if not os.path.exists(fileName):
+        return None
+    key = (fileName, os.stat(fileName).st_mtime_ns)
+    if key not in _cache:
+        with np.load(fileName) as f:
+            cal = Calibration(f['dark'] if 'dark' in f else None, f['flat'] if 'flat' in f else None)
+        for k in [k for k in _cache if k[0] == fileName]:
+            del _cache[k]
+        _cache[key] = cal
+    return _cache[key]
+
+
+#---------------------------------------------------------------
+# Calibration and temporal filter with preallocated buffers
+#---------------------------------------------------------------
+class FramePreprocessor:
+
+    #-----------------------------------------------------------
+    # shape        : (rows, cols) of the frames
+    # calibration  : Calibration or None
+    # mode         : 'none', 'ema' (exponential moving average with
+    #                weight alpha for the new frame) or 'mean' (mean
+    #                of the last n frames)
+    # dtype        : output dtype, default the input dtype; a float
+    #                dtype returns the float result
+    #-----------------------------------------------------------
+    def __init__(self, shape, calibration = None, mode = 'none', alpha = 0.2, n = 8, dtype = None):
+        if mode not in FILTER_MODES:
+            raise ValueError('Filter mode must be one of {}' .format(FILTER_MODES))
+        if calibration is not None and calibration.shape is not None and calibration.shape != tuple(shape):
+            raise ValueError('Calibration is {} but frames are {}' .format(calibration.shape, tuple(shape)))
+        self.shape          = tuple(shape)
+        self.calibration    = calibration
+        self.mode           = mode
+        self.alpha          = float(alpha)
+        self.n              = max(1, int(n))
+        self.dtype          = None if dtype is None else np.dtype(dtype)
+
+        self._work          = np.empty(self.shape, dtype = np.float32)
+        self._state         = np.empty(self.shape, dtype = np.float32) if mode == 'ema' else None
+        # The running mean is kept in float64 so the sum does not drift. Mixed
+        # float32/float64 ufuncs would allocate a cast copy, so all its buffers are float64.
+        self._ring          = np.empty((self.n,) + self.shape, dtype = np.float64) if mode == 'mean' else None
+        self._sum           = np.empty(self.shape, dtype = np.float64) if mode == 'mean' else None
+        self._mean          = np.empty(self.shape, dtype = np.float64) if mode == 'mean' else None
+        self._out           = {}    # Output buffers per dtype
+        self.reset()
+
+    #-----------------------------------------------------------
+    # Forget the filter history (e.g. when a new run starts)
+    #-----------------------------------------------------------
+    def reset(self):
+        self.nFrames = 0
+        self._nSlot  = 0
+        if self._sum is not None:
+            self._sum[...] = 0.0
+
+    #-----------------------------------------------------------
+    # Process one frame. Returns an internal buffer.
+    #-----------------------------------------------------------
+    def __call__(self, frame):
+        work = self._work
+        cal  = self.calibration
+        np.copyto(work, frame, casting = 'unsafe')
+        if cal is not None and cal.dark is not None:
+            np.subtract(work, cal.dark, out = work)
+        if cal is not None and cal.gain is not None:
+            np.multiply(work, cal.gain, out = work)
+
+        if self.mode == 'ema':
+            if self.nFrames == 0:
+                np.copyto(self._state, work)
+            else:
+                # state += alpha * (work - state)
+                np.subtract(work, self._state, out = work)
+                np.multiply(work, self.alpha, out = work)
+                np.add(self._state, work, out = self._state)
+            result = self._state
+
+        elif self.mode == 'mean':
+            slot = self._ring[self._nSlot]
+            if self.nFrames >= self.n:
+                np.subtract(self._sum, slot, out = self._sum)
+            np.copyto(slot, work)
+            np.add(self._sum, slot, out = self._sum)
+            self._nSlot = (self._nSlot + 1) % self.n
+            np.multiply(self._sum, 1.0 / min(self.nFrames + 1, self.n), out = self._mean)
+            np.copyto(work, self._mean, casting = 'unsafe')
+            result = work
+
+        else:
+            result = work
+
+        self.nFrames += 1
+        return self._output(result, np.asarray(frame).dtype if self.dtype is None else self.dtype)
+
+    def _output(self, result, dtype):
+        if np.issubdtype(dtype, np.floating):
+            if dtype == np.float32:
+                return result
+            out = self._buffer(dtype)
+            np.copyto(out, result, casting = 'unsafe')
+            return out
+
+        # Integer output: round and clip into the dtype range in the work
+        # buffer (the filter state must not be changed)
+        out  = self._buffer(dtype)
+        info = np.iinfo(dtype)
+        if result is not self._work:
+            np.copyto(self._work, result)
+        np.rint(self._work, out = self._work)
+        np.clip(self._work, info.min, info.max, out = self._work)
+        np.copyto(out, self._work, casting = 'unsafe')
+        return out
+
+    def _buffer(self, dtype):
+        out = self._out.get(dtype)
+        if out is None:
+            out = self._out[dtype] = np.empty(self.shape, dtype = dtype)
+        return out
@@ -0,0 +1,256 @@
+#---------------------------------------------------------------
+# Headless command line for scripted FPGA access
+#---------------------------------------------------------------
+#   python -m rheed ports
+#   python -m rheed version
+#   python -m rheed read 0x20 16 17
+#   python -m rheed write 0x21 0x55 [address word ...]
+#   python -m rheed boxes 10,5 50,20 100,50
+#   python -m rheed detect run1 -t raw -f 10 [--download]
+#   python -m rheed results [-n 100 --interval 0.1] [--record run1_results.h5]
+#   python -m rheed fit run1.h5 10,5 50,20 [--start 0 --stop 1000 --workers 8]
+#   python -m rheed -vv read 0x20                 ( also print every register access )
+#   python -m rheed --profile [trace.json] [--cprofile] [--tracemalloc] <command> ...
+#   python -m rheed bench single_sample.h5 --synthetic 104x160x1000 [--json out.json] [--compare old.json]
+#
+# Output is plain text, one value or box per line, for recipe
+# scripts. Modules are imported inside the commands that need them:
+# register commands load only the standard library and pyserial.
+# Exit status 1 with a message on stderr on any error.
+# --profile times the load, serial and analysis stages of a command
+# (rheed.profiling) and prints the summary to stderr at exit.
+#---------------------------------------------------------------
+import  sys
+import  time
+
+from    .crop import NUM_BOXES, IN_COLS, IN_ROWS, BOX_COLS, BOX_ROWS, unpack_xy
+from    .eventlog import LOG, verbosity_level
+
+
+def _int(text):
+    return int(text, 0)
+
+
+def _corner(text):
+    x0, y0 = text.split(',')
+    return int(x0), int(y0)
+
+
+#---------------------------------------------------------------
+# Every box must lie inside the frame the FPGA crops
+#---------------------------------------------------------------
+def _check_corners(corners):
+    for x0, y0 in corners:
+        if x0 < 0 or y0 < 0 or x0 + BOX_COLS > IN_COLS or y0 + BOX_ROWS > IN_ROWS:
+            raise ValueError('box at {},{} is outside the {}x{} frame' .format(x0, y0, IN_COLS, IN_ROWS))
+
+
+def _client(args):
+    from .regclient import RegisterClient
+
+    client = RegisterClient(args.port, args.baud, args.timeout)
+    args.profiler.instrument(client, 'write_many', 'serial write')
+    args.profiler.instrument(client, 'read_many', 'serial read')
+    return client
+
+
+def cmd_ports(args):
+    from .regclient import list_ports
+
+    for port in list_ports():
+        print (port)
+
+
+def cmd_version(args):
+    with _client(args) as client:
+        print ('0x{:08X}' .format(client.version()))
+
+
+def cmd_read(args):
+    with _client(args) as client:
+        for address, value in zip(args.address, client.read_many(args.address)):
+            print ('0x{:04X} 0x{:08X}' .format(address, value))
+
+
+def cmd_write(args):
+    if len(args.pairs) % 2:
+        raise ValueError('write needs address word pairs')
+    writes = list(zip(args.pairs[0::2], args.pairs[1::2]))
+    with _client(args) as client:
+        client.write_many(writes)
+
+
+def cmd_boxes(args):
+    _check_corners(args.corner)
+    with _client(args) as client:
+        if args.corner:
+            client.write_corners(args.corner, args.boxes)
+        for nBox, word in enumerate(client.read_boxes(args.boxes)):
+            print ('{} {} {}' .format(nBox, *unpack_xy(word)))
+
+
+#---------------------------------------------------------------
+# Detect spots in a frame file and print (or download) the boxes
+#---------------------------------------------------------------
+def cmd_detect(args):
+    from .frames import open_frames
+    from .spots import propose_crop
+
+    with args.profiler.stage('load'):
+        with open_frames(args.fileNameBase, args.fileType) as stack:
+            frame = stack[args.frameIndex]
+    with args.profiler.stage('detect'):
+        spots, boxes, words = propose_crop(frame, args.boxes)
+    for nBox, ((x0, y0), spot) in enumerate(zip(boxes, spots)):
+        print ('{} {} {} {:.2f} {:.2f}' .format(nBox, x0, y0, spot['x'], spot['y']))
+    if args.download:
+        _check_corners(boxes)
+        with _client(args) as client:
+            client.write_corners(boxes, args.boxes)
+
+
+#---------------------------------------------------------------
+# Read the results 'count' times; print them or record to .h5
+#---------------------------------------------------------------
+def cmd_results(args):
+    recorder = None
+    if args.record is not None:
+        from .recorder import ResultsRecorder
+        recorder = ResultsRecorder(args.record, args.boxes, attrs = {'source': 'rheed.cli'})
+    try:
+        with _client(args) as client:
+            words = client.read_boxes(args.boxes)
+            for nRead in range(args.count):
+                tStart = time.time()
+                regs   = client.read_result_registers(args.boxes)
+                if recorder is not None:
+                    with args.profiler.stage('record'):
+                        recorder.append_registers(regs, nRead, words, tStart)
+                else:
+                    from .regclient import unpack_results
+                    for nBox, boxRegs in enumerate(regs):
+                        print ('{} {} {}' .format(nRead, nBox, ' '.join(str(r) for r in unpack_results(boxRegs))))
+                if nRead + 1 < args.count:
+                    time.sleep(max(0.0, args.interval - (time.time() - tStart)))
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+#---------------------------------------------------------------
+# Fit a 2-D Gaussian to every box of every frame of an .h5 run
+# (rheed.fitting, process pool). One line per frame and box.
+#---------------------------------------------------------------
+def cmd_fit(args):
+    from .crop import pack_xy
+    from .fitting import fit_h5
+
+    with args.profiler.stage('fit'):
+        fits = fit_h5(args.fileNameH5, [pack_xy(x0, y0) for x0, y0 in args.corner], start = args.start, stop = args.stop,
+                      workers = args.workers)
+    for nFrame, frameFits in enumerate(fits, args.start):
+        for nBox, fit in enumerate(frameFits):
+            print ('{} {} {:.2f} {:.2f} {:.2f} {:.2f} {:.1f} {:.1f} {}' .format(nFrame, nBox, fit['x0'], fit['y0'], fit['sigma_x'],
+                   fit['sigma_y'], fit['amplitude'], fit['background'], int(fit['ok'])))
+
+
+#---------------------------------------------------------------
+# Time the host image pipeline stages (rheed.bench)
+#---------------------------------------------------------------
+def cmd_bench(args):
+    import json
+    from .bench import run, compare
+
+    report = run(args.source, args.synthetic, args.stage, args.seconds, log = print)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent = 1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            print (compare(json.load(f), report))
+
+
+def build_parser():
+    import argparse as ap
+    from .regclient import BAUD_RATE, TIMEOUT
+    from .profiling import TRACE_FILE
+
+    parser = ap.ArgumentParser(prog = 'python -m rheed', description = 'RHEED FPGA register access without the GUI')
+    parser.add_argument('--port', default = None, help = 'Serial port (default the first one found)')
+    parser.add_argument('--baud', type = int, default = BAUD_RATE, help = 'Baud rate (default {})' .format(BAUD_RATE))
+    parser.add_argument('--timeout', type = float, default = TIMEOUT, help = 'Read timeout in s (default {})' .format(TIMEOUT))
+    parser.add_argument('--boxes', type = int, default = NUM_BOXES, help = 'Number of crop boxes (default {})' .format(NUM_BOXES))
+    parser.add_argument('-v', '--verbose', action = 'count', default = 0, help = 'Print events as they happen: -v info, -vv every register access')
+    parser.add_argument('--profile', nargs = '?', const = TRACE_FILE, default = None, metavar = 'TRACE',
+                        help = 'Time the command stages; summary on stderr, timeline to TRACE (default {})' .format(TRACE_FILE))
+    parser.add_argument('--cprofile', action = 'store_true', help = 'With --profile: also run cProfile (stats to TRACE .prof)')
+    parser.add_argument('--tracemalloc', action = 'store_true', help = 'With --profile: also trace memory allocations')
+    sub = parser.add_subparsers(dest = 'command', required = True)
+
+    sub.add_parser('ports', help = 'List serial ports').set_defaults(func = cmd_ports)
+    sub.add_parser('version', help = 'Read the HDL version register').set_defaults(func = cmd_version)
+
+    p = sub.add_parser('read', help = 'Read registers')
+    p.add_argument('address', type = _int, nargs = '+', help = 'Register addresses (0x.. for hex)')
+    p.set_defaults(func = cmd_read)
+
+    p = sub.add_parser('write', help = 'Write registers in one message')
+    p.add_argument('pairs', type = _int, nargs = '+', metavar = 'address word', help = 'Address and 32-bit word pairs')
+    p.set_defaults(func = cmd_write)
+
+    p = sub.add_parser('boxes', help = 'Download crop box corners x0,y0 and print the box registers')
+    p.add_argument('corner', type = _corner, nargs = '*', help = 'Upper left corners x0,y0 (none: only print)')
+    p.set_defaults(func = cmd_boxes)
+
+    p = sub.add_parser('detect', help = 'Detect spots in a frame and propose crop boxes')
+    p.add_argument('fileNameBase', help = 'Image file name base')
+    p.add_argument('-t', '--type', dest = 'fileType', default = 'h5', help = 'Image file type: h5 (default), png, raw, npy or crops')
+    p.add_argument('-f', '--frame', dest = 'frameIndex', type = int, default = 0, help = 'Frame of a stack (default 0)')
+    p.add_argument('--download', action = 'store_true', help = 'Also write the boxes to the FPGA')
+    p.set_defaults(func = cmd_detect)
+
+    p = sub.add_parser('results', help = 'Read the result registers')
+    p.add_argument('-n', '--count', type = int, default = 1, help = 'Number of reads (default 1)')
+    p.add_argument('--interval', type = float, default = 0.0, help = 'Seconds between reads')
+    p.add_argument('--record', default = None, help = 'Append the results to this .h5 file instead of printing them')
+    p.set_defaults(func = cmd_results)
+
+    p = sub.add_parser('fit', help = 'Fit a 2-D Gaussian to each box of each frame of an .h5 run: frame box x0 y0 sx sy A B ok')
+    p.add_argument('fileNameH5', help = '.h5 file, first root key: an image or a stack')
+    p.add_argument('corner', type = _corner, nargs = '+', help = 'Upper left corners x0,y0 of the boxes')
+    p.add_argument('--start', type = int, default = 0, help = 'First frame (default 0)')
+    p.add_argument('--stop', type = int, default = None, help = 'Frame to stop at (default the end)')
+    p.add_argument('--workers', type = int, default = None, help = 'Processes (default one per CPU)')
+    p.set_defaults(func = cmd_fit)
+
+    p = sub.add_parser('bench', help = 'Time the host image pipeline stages (frames/s, peak memory)')
+    p.add_argument('source', nargs = '*', help = '.h5 files to read frames from')
+    p.add_argument('--synthetic', action = 'append', default = [], metavar = 'ROWSxCOLSxFRAMES', help = 'Also a synthetic stack')
+    p.add_argument('--stage', action = 'append', default = None, help = 'Only this stage (repeatable, default all)')
+    p.add_argument('--seconds', type = float, default = 0.5, help = 'Shortest timing run per stage (default 0.5)')
+    p.add_argument('--json', default = None, help = 'Write the results to this .json file')
+    p.add_argument('--compare', default = None, help = 'Print speed-ups against an earlier .json')
+    p.set_defaults(func = cmd_bench)
+    return parser
+
+
+def main(argv = None):
+    tStart = time.perf_counter()
+    args   = build_parser().parse_args(argv)
+    LOG.console_level = verbosity_level(args.verbose)
+    if args.profile is not None:
+        from .profiling import Profiler
+        args.profiler = Profiler(cprofile = args.cprofile, memory = args.tracemalloc, t0 = tStart).start()
+    else:
+        from .profiling import NULL_PROFILER
+        args.profiler = NULL_PROFILER
+    args.profiler.end('startup', args.profiler.tOrigin)
+    try:
+        with args.profiler.stage('command ' + args.command):
+            args.func(args)
+    except (OSError, ValueError) as e:
+        print ('rheed: {}' .format(e), file = sys.stderr)
+        return 1
+    finally:
+        args.profiler.report(args.profile)
+    return 0
@@ -0,0 +1,122 @@
+#---------------------------------------------------------------
+# Crop box model
+#---------------------------------------------------------------
+# The FPGA crops C_NUM_CROP_BOX boxes of OUT_COLS x OUT_ROWS pixels
+# from each IN_COLS x IN_ROWS camera frame (CustomLogic_GJ.vhdl,
+# rhd_fpga_pkg.vhdl). Each box is set by one 32-bit parameter
+# register holding the upper left corner of the box:
+#   bits 31:16  x-coord
+#   bits 15:0   y-coord
+# Box co-ordinates here are always in image pixels.
+#---------------------------------------------------------------
+
+NUM_BOXES   = 5     # C_NUM_CROP_BOX
+IN_COLS     = 160   # Camera frame size
+IN_ROWS     = 104
+BOX_COLS    = 48    # Crop box size (OUT_COLS, OUT_ROWS)
+BOX_ROWS    = 48
+
+
+#---------------------------------------------------------------
+# Combine an X and Y value into a 32-bit parameter register value
+#---------------------------------------------------------------
+def pack_xy(x, y):
+    return ((int(x) & 0xFFFF) << 16) | (int(y) & 0xFFFF)
+
+
+#---------------------------------------------------------------
+# Split a 32-bit parameter register value into X and Y
+#---------------------------------------------------------------
+def unpack_xy(word):
+    return (int(word) >> 16) & 0xFFFF, int(word) & 0xFFFF
+
+
+#---------------------------------------------------------------
+# Clamp the upper left corner of a box so the whole box lies
+# inside an image of image_cols x image_rows pixels
+#---------------------------------------------------------------
+def clamp_box(x0, y0, image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS):
+    x0 = min(max(x0, 0), max(image_cols - box_cols, 0))
+    y0 = min(max(y0, 0), max(image_rows - box_rows, 0))
+    return x0, y0
+
+
+#---------------------------------------------------------------
+# Upper left corner (whole pixels) of a box centred on a pixel location
+#---------------------------------------------------------------
+def box_at(pixel_x, pixel_y, image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS):
+    x0 = int(pixel_x - box_cols / 2)
+    y0 = int(pixel_y - box_rows / 2)
+    return clamp_box(x0, y0, image_cols, image_rows, box_cols, box_rows)
+
+
+#---------------------------------------------------------------
+# FIFO list of crop boxes. The first NUM_BOXES boxes fill the list,
+# additional boxes push the oldest one off the front.
+#---------------------------------------------------------------
+class CropBoxList:
+
+    def __init__(self, num_boxes = NUM_BOXES, image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS):
+        self.num_boxes  = num_boxes
+        self.image_cols = image_cols
+        self.image_rows = image_rows
+        self.box_cols   = box_cols
+        self.box_rows   = box_rows
+        self.boxes      = []        # (x0, y0) upper left corners, oldest first
+        self.centres    = []        # (x, y) location each box was placed on
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, index):
+        return self.boxes[index]
+
+    def __iter__(self):
+        return iter(self.boxes)
+
+    #-----------------------------------------------------------
+    # Add a box centred on a pixel location.
+    # Returns the box and True if the oldest box was pushed off.
+    #-----------------------------------------------------------
+    def add_centred(self, pixel_x, pixel_y):
+        box = box_at(pixel_x, pixel_y, self.image_cols, self.image_rows, self.box_cols, self.box_rows)
+        return box, self.add(box[0], box[1], (pixel_x, pixel_y))
+
+    #-----------------------------------------------------------
+    # Add a box by its upper left corner. 'centre' defaults to the
+    # centre of the box. Returns True if the oldest box was pushed off.
+    #-----------------------------------------------------------
+    def add(self, x0, y0, centre = None):
+        box = clamp_box(int(x0), int(y0), self.image_cols, self.image_rows, self.box_cols, self.box_rows)
+        if centre is None:
+            centre = self.box_centre(box)
+        dropped = len(self.boxes) >= self.num_boxes
+        if dropped:
+            del self.boxes[0]
+            del self.centres[0]
+        self.boxes.append(box)
+        self.centres.append(centre)
+        return dropped
+
+    def box_centre(self, box):
+        return box[0] + self.box_cols / 2, box[1] + self.box_rows / 2
+
+    #-----------------------------------------------------------
+    # Replace box 'index' (e.g. when edited in an Entry box)
+    #-----------------------------------------------------------
+    def set(self, index, x0, y0):
+        box = clamp_box(int(x0), int(y0), self.image_cols, self.image_rows, self.box_cols, self.box_rows)
+        while len(self.boxes) <= index:
+            self.boxes.append((0, 0))
+            self.centres.append(self.box_centre((0, 0)))
+        self.boxes[index]   = box
+        self.centres[index] = self.box_centre(box)
+        return box
+
+    #-----------------------------------------------------------
+    # Parameter register values for all NUM_BOXES registers.
+    # Unused boxes are (0, 0).
+    #-----------------------------------------------------------
+    def words(self):
+        boxes = self.boxes + [(0, 0)] * (self.num_boxes - len(self.boxes))
+        return [pack_xy(x, y) for (x, y) in boxes]
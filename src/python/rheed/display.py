@@ -0,0 +1,200 @@
+#---------------------------------------------------------------
+# Display normalization of RHEED frames to 8-bit
+#---------------------------------------------------------------
+# 12/16-bit frames are mapped to 8 bits through a lookup table.
+# The contrast window (lo, hi) is either the min/max of the data
+# or a pair of percentiles taken from a pixel histogram.
+#
+#   - window() computes the window once and caches it.
+#   - update() folds a new frame into a decaying histogram, for
+#     live streams, so the window follows the data without being
+#     recomputed from scratch.
+#   - The 8-bit table is rebuilt only when the window, gamma or
+#     log setting changes. Mapping a frame is then a single
+#     np.take() of the table with the raw pixel values.
+#
+# Float frames have no table and are mapped with float math.
+#---------------------------------------------------------------
+import  numpy as np
+
+CONTRAST_MODES  = ['percentile', 'minmax', 'none']
+
+LOG_GAIN        = 255.0     # Curvature of the log mapping
+HIST_FLOOR      = 0.5       # Decayed histogram bins below this count are dropped
+MAX_LUT_BITS    = 16        # Largest integer type mapped with a table
+
+
+#---------------------------------------------------------------
+# Shape of the transfer curve applied to t = (v-lo)/(hi-lo) in 0..1
+# gamma < 1 brightens faint features, log compresses bright spots.
+#---------------------------------------------------------------
+def transfer(t, gamma = 1.0, log = False):
+    if log:
+        t = np.log1p(t * LOG_GAIN) / np.log1p(LOG_GAIN)
+    if gamma != 1.0:
+        t = np.power(t, gamma)
+    return t
+
+
+#---------------------------------------------------------------
+# Number of table entries needed for an integer dtype, or 0 if
+# the dtype is not mapped with a table.
+#---------------------------------------------------------------
+def lut_size(dtype):
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'ub' and dtype.itemsize * 8 <= MAX_LUT_BITS:
+        return 2 ** (dtype.itemsize * 8)
+    return 0
+
+
+#---------------------------------------------------------------
+# Build an 8-bit lookup table for window (lo, hi) over all values
+# of an unsigned integer dtype.
+#---------------------------------------------------------------
+def make_lut(dtype, lo, hi, gamma = 1.0, log = False):
+    values = np.arange(lut_size(dtype), dtype = np.float64)
+    span   = max(float(hi) - float(lo), 1e-12)
+    t      = np.clip((values - lo) / span, 0.0, 1.0)
+    return np.round(transfer(t, gamma, log) * 255.0).astype(np.uint8)
+
+
+#---------------------------------------------------------------
+# Maps frames of one dataset or stream to 8-bit display images
+#---------------------------------------------------------------
+class DisplayNormalizer:
+
+    #-----------------------------------------------------------
+    # mode       : 'percentile', 'minmax' or 'none' (full dtype range)
+    # low, high  : percentiles used in 'percentile' mode
+    # gamma, log : transfer curve, see transfer()
+    # step       : every step'th pixel is used for histograms
+    # decay      : weight kept by the stream histogram per update()
+    #-----------------------------------------------------------
+    def __init__(self, mode = 'percentile', low = 0.5, high = 99.9, gamma = 1.0, log = False, step = 1, decay = 0.9):
+        if mode not in CONTRAST_MODES:
+            raise ValueError('Unknown contrast mode "{}". Expected one of {}'.format(mode, CONTRAST_MODES))
+        self.mode       = mode
+        self.low        = low
+        self.high       = high
+        self.gamma      = gamma
+        self.log        = log
+        self.step       = max(1, int(step))
+        self.decay      = decay
+
+        self.lo         = None      # Cached window
+        self.hi         = None
+        self._hist      = None      # Decaying stream histogram
+        self._lut       = None      # Cached table ...
+        self._lutKey    = None      # ... and the settings it was built for
+
+    #-----------------------------------------------------------
+    # Forget the cached window, e.g. when a new dataset is opened
+    #-----------------------------------------------------------
+    def reset(self):
+        self.lo     = None
+        self.hi     = None
+        self._hist  = None
+
+    def set_transfer(self, gamma = None, log = None):
+        if gamma is not None:
+            self.gamma = gamma
+        if log is not None:
+            self.log = log
+
+    #-----------------------------------------------------------
+    # Window of a frame. Computed on first use and cached.
+    #-----------------------------------------------------------
+    def window(self, frame):
+        if self.lo is None:
+            self._set_window(frame, self._histogram(frame))
+        return self.lo, self.hi
+
+    #-----------------------------------------------------------
+    # Fold a new stream frame into the window. The old histogram
+    # is decayed, so the window tracks slow changes in brightness.
+    #-----------------------------------------------------------
+    def update(self, frame):
+        hist = self._histogram(frame)
+        if hist is not None and self._hist is not None and self._hist.size == hist.size:
+            self._hist *= self.decay
+            self._hist += hist
+            self._hist[self._hist < HIST_FLOOR] = 0.0
+            hist = self._hist
+        elif hist is not None:
+            self._hist = hist.astype(np.float64)
+            hist = self._hist
+        self._set_window(frame, hist)
+        return self.lo, self.hi
+
+    #-----------------------------------------------------------
+    # Table for the current window and transfer curve
+    #-----------------------------------------------------------
+    def lut(self, dtype):
+        key = (np.dtype(dtype), self.lo, self.hi, self.gamma, self.log)
+        if self._lutKey != key:
+            self._lut    = make_lut(dtype, self.lo, self.hi, self.gamma, self.log)
+            self._lutKey = key
+        return self._lut
+
+    #-----------------------------------------------------------
+    # Map a frame to uint8. 'out' may be a preallocated uint8 array
+    # of the frame's shape to avoid an allocation per frame.
+    #-----------------------------------------------------------
+    def __call__(self, frame, out = None):
+        frame = np.asarray(frame)
+        lo, hi = self.window(frame)
+        if lut_size(frame.dtype):
+            return np.take(self.lut(frame.dtype), frame, out = out)
+
+        span = max(float(hi) - float(lo), 1e-12)
+        t    = np.clip((frame.astype(np.float64) - lo) / span, 0.0, 1.0)
+        t    = np.round(transfer(t, self.gamma, self.log) * 255.0)
+        if out is None:
+            return t.astype(np.uint8)
+        out[...] = t
+        return out
+
+    #-----------------------------------------------------------
+    # Pixel histogram over the full range of an integer dtype.
+    # None for dtypes not mapped with a table.
+    #-----------------------------------------------------------
+    def _histogram(self, frame):
+        frame = np.asarray(frame)
+        nBins = lut_size(frame.dtype)
+        if not nBins:
+            return None
+        sample = frame.reshape(-1)[::self.step]
+        return np.bincount(sample, minlength = nBins)
+
+    def _set_window(self, frame, hist):
+        frame = np.asarray(frame)
+        if self.mode == 'none':
+            if frame.dtype.kind in 'ui':
+                info = np.iinfo(frame.dtype)
+                lo, hi = info.min, info.max
+            else:
+                lo, hi = 0.0, 1.0
+        elif hist is not None:
+            lo, hi = self._hist_window(hist)
+        else:
+            sample = frame.reshape(-1)[::self.step]
+            if self.mode == 'minmax':
+                lo, hi = np.min(sample), np.max(sample)
+            else:
+                lo, hi = np.percentile(sample, [self.low, self.high])
+        if hi <= lo:
+            hi = lo + 1
+        self.lo = float(lo)
+        self.hi = float(hi)
+
+    def _hist_window(self, hist):
+        nz = np.flatnonzero(hist)
+        if nz.size == 0:
+            return 0, 1
+        if self.mode == 'minmax':
+            return nz[0], nz[-1]
+        cdf   = np.cumsum(hist, dtype = np.float64)
+        total = cdf[-1]
+        lo    = np.searchsorted(cdf, total * self.low  / 100.0, side = 'left')
+        hi    = np.searchsorted(cdf, total * self.high / 100.0, side = 'left')
+        return lo, hi
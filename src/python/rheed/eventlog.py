@@ -0,0 +1,151 @@
+#---------------------------------------------------------------
+# Leveled event log with an in-memory ring for hot paths
+#---------------------------------------------------------------
+# Register accesses happen at frame rate; formatting and printing a
+# few lines for each costs more than the serial traffic. Events go
+# into a preallocated ring instead and are formatted only when shown:
+#
+#   LOG.debug('reg write', 'addr 0x{:04X} data 0x{:08X}', address, word)
+#
+# An event is (time, level, event name, format, args). The format
+# string and args are stored as given; nothing is formatted unless the
+# event reaches the console or the ring is dumped. Events below
+# ring_level are dropped at the call; console_level (default WARNING)
+# sets what is also printed at once, so verbose output is opt-in.
+#
+# dump() prints the events not shown yet (all with everything = True),
+# oldest first. An ERROR event dumps the ring, so the events leading
+# up to a failure are shown with it. records() gives the events as
+# dicts for saving or filtering.
+#
+# LOG is the process-wide log used by the GUI, the command line and
+# the register client. Only the standard library is used.
+#---------------------------------------------------------------
+import  itertools
+import  sys
+import  time
+
+DEBUG           = 10            # Same values as the logging module
+INFO            = 20
+WARNING         = 30
+ERROR           = 40
+LEVEL_NAMES     = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+RING_EVENTS     = 4096          # Events kept
+
+
+#---------------------------------------------------------------
+# Console level from a -v count: 0 WARNING, 1 INFO, 2 or more DEBUG
+#---------------------------------------------------------------
+def verbosity_level(nVerbose):
+    return max(DEBUG, WARNING - 10 * int(nVerbose or 0))
+
+
+class EventLog:
+
+    #-----------------------------------------------------------
+    # size          : events kept in the ring
+    # ring_level    : lowest level stored
+    # console_level : lowest level also printed at once (None: never)
+    # dump_on_error : dump the ring on an ERROR event
+    #-----------------------------------------------------------
+    def __init__(self, size = RING_EVENTS, ring_level = DEBUG, console_level = WARNING, dump_on_error = True, out = None):
+        self.size           = size
+        self.ring_level     = ring_level
+        self.console_level  = console_level
+        self.dump_on_error  = dump_on_error
+        self.out            = out               # None: sys.stderr at the time of writing
+        self.tOrigin        = time.perf_counter()
+        self._time          = [0.0] * size
+        self._level         = [0] * size
+        self._event         = [None] * size
+        self._format        = [None] * size
+        self._args          = [None] * size
+        self._count         = itertools.count() # next() is atomic, so threads can log
+        self.nEvents        = 0                 # Events logged so far
+        self.nShown         = 0                 # Events up to here have been dumped
+
+    #-----------------------------------------------------------
+    # Store an event; print it if at or above console_level
+    #-----------------------------------------------------------
+    def log(self, level, event, fmt = '', *args):
+        if level < self.ring_level and (self.console_level is None or level < self.console_level):
+            return
+        tNow = time.perf_counter() - self.tOrigin
+        if level >= self.ring_level:
+            n = next(self._count)
+            i = n % self.size
+            self._time[i]   = tNow
+            self._level[i]  = level
+            self._event[i]  = event
+            self._format[i] = fmt
+            self._args[i]   = args
+            self.nEvents    = n + 1
+        if self.console_level is not None and level >= self.console_level:
+            print (self._line(tNow, level, event, fmt, args), file = self.out or sys.stderr)
+        if level >= ERROR and self.dump_on_error:
+            self.dump()
+
+    def debug(self, event, fmt = '', *args):
+        self.log(DEBUG, event, fmt, *args)
+
+    def info(self, event, fmt = '', *args):
+        self.log(INFO, event, fmt, *args)
+
+    def warning(self, event, fmt = '', *args):
+        self.log(WARNING, event, fmt, *args)
+
+    def error(self, event, fmt = '', *args):
+        self.log(ERROR, event, fmt, *args)
+
+    @staticmethod
+    def _message(fmt, args):
+        try:
+            return fmt.format(*args) if args else fmt
+        except (IndexError, KeyError, ValueError) as e:
+            return '{!r} {!r} ({})' .format(fmt, args, e)
+
+    def _line(self, tEvent, level, event, fmt, args):
+        return '{:10.4f} {:<7} {:<14} {}' .format(tEvent, LEVEL_NAMES.get(level, level), event, self._message(fmt, args))
+
+    #-----------------------------------------------------------
+    # Ring indices of the stored events from event number nFirst on
+    #-----------------------------------------------------------
+    def _indices(self, nFirst = 0):
+        nEnd = self.nEvents
+        return [n % self.size for n in range(max(nFirst, nEnd - self.size, 0), nEnd)]
+
+    #-----------------------------------------------------------
+    # Events as dicts, oldest first. event: only events of this name.
+    #-----------------------------------------------------------
+    def records(self, level = DEBUG, event = None):
+        records = []
+        for i in self._indices():
+            if self._level[i] >= level and (event is None or self._event[i] == event):
+                records.append({'time': self._time[i], 'level': LEVEL_NAMES.get(self._level[i], self._level[i]), 'event': self._event[i],
+                                'message': self._message(self._format[i], self._args[i])})
+        return records
+
+    #-----------------------------------------------------------
+    # Print the events not dumped yet (everything: all in the ring)
+    # at or above 'level'. Returns the number printed.
+    #-----------------------------------------------------------
+    def dump(self, out = None, level = DEBUG, everything = False):
+        out     = out or self.out or sys.stderr
+        nEnd    = self.nEvents
+        indices = self._indices(0 if everything else self.nShown)
+        nLost   = max(nEnd - self.size - (0 if everything else self.nShown), 0)
+        print ('--- event log: {} events{} ---' .format(len(indices), ', {} older ones overwritten' .format(nLost) if nLost else ''), file = out)
+        nPrinted = 0
+        for i in indices:
+            if self._level[i] >= level:
+                print (self._line(self._time[i], self._level[i], self._event[i], self._format[i], self._args[i]), file = out)
+                nPrinted += 1
+        self.nShown = nEnd
+        return nPrinted
+
+    def clear(self):
+        self.nShown = self.nEvents
+
+
+LOG = EventLog()
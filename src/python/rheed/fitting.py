@@ -0,0 +1,228 @@
+#---------------------------------------------------------------
+# Batch 2-D Gaussian fitting of crop boxes over frame stacks
+#---------------------------------------------------------------
+# Fits  A * exp(-(x-x0)^2/(2 sx^2) - (y-y0)^2/(2 sy^2)) + B
+# to every crop box of every frame.
+#
+#   - Initial estimates come from image moments, computed for all
+#     crops at once.
+#   - Levenberg-Marquardt runs on the whole batch of crops at once
+#     (batched 6x6 normal equations), with a damping factor per crop.
+#   - fit_h5() splits a run into chunks of frames and fits them in a
+#     process pool. Each worker opens the .h5 file and reads only its
+#     slice, so the run is never loaded whole.
+#
+# Results are FIT_DTYPE arrays of shape (frames, boxes) with the
+# centre in frame pixel co-ordinates.
+#
+# Callers using fit_h5() on Windows must guard their entry point
+# with  if __name__ == '__main__':  (multiprocessing spawn).
+#---------------------------------------------------------------
+import  numpy as np
+
+from    .crop import BOX_COLS, BOX_ROWS, unpack_xy
+from    .golden import crop_boxes
+
+FIT_DTYPE = np.dtype([('amplitude', 'f4'), ('x0', 'f4'), ('y0', 'f4'), ('sigma_x', 'f4'), ('sigma_y', 'f4'),
+                      ('background', 'f4'), ('chi2', 'f4'), ('ok', '?')])
+
+NUM_ITER        = 15        # Levenberg-Marquardt iterations (at most)
+CHUNK_CROPS     = 256       # Crops per batched LM solve
+CHUNK_FRAMES    = 256       # Frames per process pool task
+MIN_SIGMA       = 0.3       # Widths are kept above this (pixels)
+
+
+#---------------------------------------------------------------
+# Moment estimates for crops (N, rows, cols).
+# Returns params (N, 6): A, x0, y0, sx, sy, B in crop pixels.
+#---------------------------------------------------------------
+def moment_estimates(crops):
+    crops  = np.asarray(crops, dtype = np.float64)
+    n, nRows, nCols = crops.shape
+    x      = np.arange(nCols, dtype = np.float64)
+    y      = np.arange(nRows, dtype = np.float64)
+
+    # Background from the crop border
+    border = np.concatenate([crops[:, 0, :], crops[:, -1, :], crops[:, 1:-1, 0], crops[:, 1:-1, -1]], axis = 1)
+    B      = np.median(border, axis = 1)
+    I      = np.clip(crops - B[:, None, None], 0.0, None)
+
+    px     = I.sum(axis = 1)                    # (N, cols) projections
+    py     = I.sum(axis = 2)                    # (N, rows)
+    total  = np.maximum(px.sum(axis = 1), 1e-12)
+    x0     = (px * x).sum(axis = 1) / total
+    y0     = (py * y).sum(axis = 1) / total
+    sx     = np.sqrt((px * (x - x0[:, None]) ** 2).sum(axis = 1) / total)
+    sy     = np.sqrt((py * (y - y0[:, None]) ** 2).sum(axis = 1) / total)
+    A      = I.max(axis = (1, 2))
+
+    empty  = total <= 1e-12
+    x0[empty], y0[empty] = (nCols - 1) / 2, (nRows - 1) / 2
+    sx     = np.clip(np.where(empty, nCols / 4, sx), MIN_SIGMA, nCols)
+    sy     = np.clip(np.where(empty, nRows / 4, sy), MIN_SIGMA, nRows)
+    return np.stack([A, x0, y0, sx, sy, B], axis = 1)
+
+
+#---------------------------------------------------------------
+# Model for a batch of parameter sets. Returns (N, P), P = rows*cols
+#---------------------------------------------------------------
+def _model(p, x, y):
+    A, x0, y0, sx, sy, B = (p[:, i] for i in range(6))
+    gx  = np.exp(-0.5 * ((x[None, :] - x0[:, None]) / sx[:, None]) ** 2)
+    gy  = np.exp(-0.5 * ((y[None, :] - y0[:, None]) / sy[:, None]) ** 2)
+    model = (A[:, None] * gy)[:, :, None] * gx[:, None, :] + B[:, None, None]
+    return model.reshape(p.shape[0], -1)
+
+
+#---------------------------------------------------------------
+# Model and Jacobian for a batch of parameter sets.
+# Returns model (N, P) and J (N, P, 6) with P = rows*cols.
+#---------------------------------------------------------------
+def _model_jacobian(p, x, y):
+    A, x0, y0, sx, sy, B = (p[:, i] for i in range(6))
+    dx  = x[None, :] - x0[:, None]                  # (N, cols)
+    dy  = y[None, :] - y0[:, None]                  # (N, rows)
+    gx  = np.exp(-0.5 * (dx / sx[:, None]) ** 2)
+    gy  = np.exp(-0.5 * (dy / sy[:, None]) ** 2)
+    G   = (gy[:, :, None] * gx[:, None, :])         # (N, rows, cols)
+    AG  = A[:, None, None] * G
+
+    n   = p.shape[0]
+    J   = np.empty((n, G.shape[1], G.shape[2], 6))
+    J[..., 0] = G
+    J[..., 1] = AG * (dx / sx[:, None] ** 2)[:, None, :]
+    J[..., 2] = AG * (dy / sy[:, None] ** 2)[:, :, None]
+    J[..., 3] = AG * (dx ** 2 / sx[:, None] ** 3)[:, None, :]
+    J[..., 4] = AG * (dy ** 2 / sy[:, None] ** 3)[:, :, None]
+    J[..., 5] = 1.0
+    model = AG + B[:, None, None]
+    return model.reshape(n, -1), J.reshape(n, -1, 6)
+
+
+#---------------------------------------------------------------
+# Fit crops (N, rows, cols). Returns FIT_DTYPE (N,) in crop pixels.
+#---------------------------------------------------------------
+def fit_crops(crops, num_iter = NUM_ITER):
+    crops = np.asarray(crops, dtype = np.float64)
+    out   = np.empty(crops.shape[0], dtype = FIT_DTYPE)
+    for i in range(0, crops.shape[0], CHUNK_CROPS):
+        out[i:i + CHUNK_CROPS] = _fit_batch(crops[i:i + CHUNK_CROPS], num_iter)
+    return out
+
+
+def _fit_batch(crops, num_iter):
+    n, nRows, nCols = crops.shape
+    x     = np.arange(nCols, dtype = np.float64)
+    y     = np.arange(nRows, dtype = np.float64)
+    data  = crops.reshape(n, -1)
+    p     = moment_estimates(crops)
+    lam   = np.full(n, 1e-3)
+
+    model, J = _model_jacobian(p, x, y)
+    r     = data - model
+    cost  = (r * r).sum(axis = 1)
+    eye   = np.eye(6)
+    for it in range(num_iter):
+        if it > 0:
+            model, J = _model_jacobian(p, x, y)
+        JT    = J.transpose(0, 2, 1)
+        JTJ   = np.matmul(JT, J)
+        JTr   = np.matmul(JT, r[..., None])[..., 0]
+        diag  = np.diagonal(JTJ, axis1 = 1, axis2 = 2)
+        lhs   = JTJ + lam[:, None, None] * diag[:, None, :] * eye + 1e-12 * eye
+        try:
+            step = np.linalg.solve(lhs, JTr[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.zeros_like(p)
+            for k in range(n):
+                step[k] = np.linalg.lstsq(lhs[k], JTr[k], rcond = None)[0]
+
+        pNew        = p + step
+        pNew[:, 3]  = np.clip(pNew[:, 3], MIN_SIGMA, 4 * nCols)
+        pNew[:, 4]  = np.clip(pNew[:, 4], MIN_SIGMA, 4 * nRows)
+        rNew    = data - _model(pNew, x, y)
+        costNew = (rNew * rNew).sum(axis = 1)
+
+        # Accept per crop where the cost went down
+        better  = costNew < cost
+        gain    = (cost - costNew) / np.maximum(cost, 1e-12)
+        p       = np.where(better[:, None], pNew, p)
+        r       = np.where(better[:, None], rNew, r)
+        cost    = np.where(better, costNew, cost)
+        lam     = np.where(better, lam * 0.3, lam * 10.0)
+
+        # Stop when every crop has converged or its damping has run away
+        if not np.any((better & (gain > 1e-7)) | (~better & (lam < 1e4))):
+            break
+
+    res = np.empty(n, dtype = FIT_DTYPE)
+    res['amplitude']    = p[:, 0]
+    res['x0']           = p[:, 1]
+    res['y0']           = p[:, 2]
+    res['sigma_x']      = p[:, 3]
+    res['sigma_y']      = p[:, 4]
+    res['background']   = p[:, 5]
+    res['chi2']         = cost / max(1, data.shape[1] - 6)
+    res['ok']           = np.isfinite(p).all(axis = 1) & (p[:, 1] >= 0) & (p[:, 1] < nCols) & (p[:, 2] >= 0) & (p[:, 2] < nRows)
+    return res
+
+
+#---------------------------------------------------------------
+# Fit every box of every frame of an in-memory stack.
+# frames : (F, H, W); words : (B,) crop box register words
+#---------------------------------------------------------------
+def fit_stack(frames, words, box_cols = BOX_COLS, box_rows = BOX_ROWS, num_iter = NUM_ITER):
+    crops   = crop_boxes(frames, words, box_cols, box_rows)
+    nF, nB  = crops.shape[:2]
+    res     = fit_crops(crops.reshape(nF * nB, box_rows, box_cols), num_iter).reshape(nF, nB)
+
+    # Crop to frame co-ordinates
+    corners = np.array([unpack_xy(w) for w in words], dtype = np.float32)
+    res['x0'] += corners[:, 0]
+    res['y0'] += corners[:, 1]
+    return res
+
+
+def _fit_h5_chunk(fileNameH5, key, start, stop, words, box_cols, box_rows, num_iter):
+    import h5py
+
+    with h5py.File(fileNameH5, 'r') as f:
+        ds     = f[key]
+        frames = ds[()] if ds.ndim == 2 else ds[start:stop]
+    return start, fit_stack(frames, words, box_cols, box_rows, num_iter)
+
+
+#---------------------------------------------------------------
+# Fit a (frames, rows, cols) dataset of an .h5 file in a process pool.
+# A (rows, cols) dataset is one frame.
+#
+# words        : crop box register words, e.g. CropBoxList.words()
+# key          : dataset name (default first root key)
+# start, stop  : frame range
+# workers      : processes (default os.cpu_count())
+#
+# Returns FIT_DTYPE (stop-start, boxes).
+#---------------------------------------------------------------
+def fit_h5(fileNameH5, words, key = None, start = 0, stop = None, box_cols = BOX_COLS, box_rows = BOX_ROWS,
+           num_iter = NUM_ITER, chunk_frames = CHUNK_FRAMES, workers = None):
+    import h5py
+    from concurrent.futures import ProcessPoolExecutor
+
+    with h5py.File(fileNameH5, 'r') as f:
+        if key is None:
+            key = list(f.keys())[0]
+        ds      = f[key]
+        if ds.ndim not in (2, 3):
+            raise ValueError('{} in {} is not an image or a stack of images: shape {}' .format(key, fileNameH5, ds.shape))
+        nFrames = 1 if ds.ndim == 2 else ds.shape[0]
+    stop  = nFrames if stop is None else min(stop, nFrames)
+    words = [int(w) for w in words]
+    out   = np.empty((max(0, stop - start), len(words)), dtype = FIT_DTYPE)
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(_fit_h5_chunk, fileNameH5, key, i, min(i + chunk_frames, stop), words, box_cols, box_rows, num_iter)
+                   for i in range(start, stop, chunk_frames)]
+        for future in futures:
+            i, res = future.result()
+            out[i - start:i - start + res.shape[0]] = res
+    return out
@@ -0,0 +1,218 @@
+#---------------------------------------------------------------
+# Frame loaders for RHEED images
+#---------------------------------------------------------------
+# Every loader returns a FrameStack: a (frames, rows, cols) view
+# of the file. Single images are treated as a stack of one frame.
+#
+#   .h5   : first root key, 2-D image or 3-D stack (read per frame)
+#   .png  : single image
+#   .npy  : 2-D or 3-D array opened with np.load(mmap_mode='r')
+#   .raw  : headerless camera dump opened with np.memmap, described
+#           by a sidecar .hdr text file, e.g.
+#
+#               rows   = 104
+#               cols   = 160
+#               dtype  = uint16
+#               offset = 0        (optional, bytes to skip)
+#               frames = 1000     (optional, default from file size)
+#
+#   .crops.h5 : crop box archive (rheed.archive), frames rebuilt
+#           with the crops in their original positions
+#
+# Frames from .npy and .raw files are slices of the memory map,
+# so no pixel data is copied or read until it is used.
+#---------------------------------------------------------------
+import  os.path
+import  numpy as np
+
+FRAME_TYPES = ['h5', 'png', 'raw', 'npy', 'crops']
+
+# Keys allowed in a .raw sidecar header and their defaults
+RAW_HEADER_DEFAULTS = {'rows': None, 'cols': None, 'dtype': 'uint16', 'offset': 0, 'frames': None}
+
+
+#---------------------------------------------------------------
+# A stack of frames backed by an ndarray, np.memmap or h5 dataset.
+# Indexing with an int returns one (rows, cols) frame, indexing
+# with a slice returns a (n, rows, cols) block.
+#---------------------------------------------------------------
+class FrameStack:
+
+    def __init__(self, data, fileName, fileType, closer = None):
+        self.data       = data
+        self.fileName   = fileName
+        self.fileType   = fileType
+        self._closer    = closer
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    @property
+    def shape(self):
+        return tuple(self.data.shape[1:])
+
+    @property
+    def dtype(self):
+        return np.dtype(self.data.dtype)
+
+    def close(self):
+        if self._closer is not None:
+            self._closer()
+            self._closer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#---------------------------------------------------------------
+# Presents a 2-D h5 dataset as a stack of one frame without
+# reading it. 3-D datasets are used as they are.
+#---------------------------------------------------------------
+class _SingleFrame:
+
+    def __init__(self, ds):
+        self.ds     = ds
+        self.shape  = (1,) + tuple(ds.shape)
+        self.dtype  = ds.dtype
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(1)
+            return self.ds[()][np.newaxis][start:stop:step]
+        if index not in (0, -1):
+            raise IndexError('frame index {} out of range'.format(index))
+        return self.ds[()]
+
+
+#---------------------------------------------------------------
+# Parse a .raw sidecar header ('key = value' per line, '#' comments)
+#---------------------------------------------------------------
+def read_raw_header(fileNameHdr):
+    header = dict(RAW_HEADER_DEFAULTS)
+    with open(fileNameHdr, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            key, sep, value = line.partition('=')
+            key   = key.strip().lower()
+            value = value.strip()
+            if not sep or key not in RAW_HEADER_DEFAULTS:
+                raise ValueError('{}: bad header line "{}"'.format(fileNameHdr, line))
+            header[key] = value if key == 'dtype' else int(value, 0)
+
+    if header['rows'] is None or header['cols'] is None:
+        raise ValueError('{}: header must set rows and cols'.format(fileNameHdr))
+    return header
+
+
+#---------------------------------------------------------------
+# Write a .raw sidecar header
+#---------------------------------------------------------------
+def write_raw_header(fileNameHdr, rows, cols, dtype, offset = 0, frames = None):
+    with open(fileNameHdr, 'w') as f:
+        f.write('rows   = {}\n'.format(rows))
+        f.write('cols   = {}\n'.format(cols))
+        f.write('dtype  = {}\n'.format(np.dtype(dtype).name))
+        f.write('offset = {}\n'.format(offset))
+        if frames is not None:
+            f.write('frames = {}\n'.format(frames))
+
+
+#---------------------------------------------------------------
+# Number of whole frames currently in a raw file. Used when the
+# header does not give a count, and to follow a file being appended to.
+#---------------------------------------------------------------
+def raw_frame_count(fileNameRaw, header):
+    nFrameBytes = header['rows'] * header['cols'] * np.dtype(header['dtype']).itemsize
+    nFrames     = max(0, os.path.getsize(fileNameRaw) - header['offset']) // nFrameBytes
+    if header['frames'] is not None:
+        nFrames = min(nFrames, header['frames'])
+    return nFrames
+
+
+#---------------------------------------------------------------
+# Memory map a raw frame dump described by a sidecar header
+#---------------------------------------------------------------
+def open_raw(fileNameRaw, fileNameHdr = None):
+    if fileNameHdr is None:
+        fileNameHdr = os.path.splitext(fileNameRaw)[0] + '.hdr'
+    header  = read_raw_header(fileNameHdr)
+    nFrames = raw_frame_count(fileNameRaw, header)
+    shape   = (nFrames, header['rows'], header['cols'])
+    if nFrames == 0:
+        # np.memmap cannot map zero bytes
+        data = np.empty(shape, dtype = header['dtype'])
+    else:
+        data = np.memmap(fileNameRaw, dtype = header['dtype'], mode = 'r', offset = header['offset'], shape = shape)
+    return FrameStack(data, fileNameRaw, 'raw')
+
+
+#---------------------------------------------------------------
+# Memory map a .npy image or stack
+#---------------------------------------------------------------
+def open_npy(fileNameNpy):
+    data = np.load(fileNameNpy, mmap_mode = 'r')
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    elif data.ndim != 3:
+        raise ValueError('{}: expected a 2-D image or 3-D stack, got shape {}'.format(fileNameNpy, data.shape))
+    return FrameStack(data, fileNameNpy, 'npy')
+
+
+#---------------------------------------------------------------
+# Open the first root level dataset of a .h5 file (or the named one).
+# The file stays open until the FrameStack is closed.
+#---------------------------------------------------------------
+def open_h5(fileNameH5, key = None):
+    import h5py
+
+    f = h5py.File(fileNameH5, 'r')
+    try:
+        if key is None:
+            key = list(f.keys())[0]
+        ds = f[key]
+        if ds.ndim == 2:
+            ds = _SingleFrame(ds)
+        elif ds.ndim != 3:
+            raise ValueError('{}: expected a 2-D image or 3-D stack, got shape {}'.format(fileNameH5, ds.shape))
+    except Exception:
+        f.close()
+        raise
+    return FrameStack(ds, fileNameH5, 'h5', closer = f.close)
+
+
+#---------------------------------------------------------------
+# Read a .png as a stack of one frame
+#---------------------------------------------------------------
+def open_png(fileNamePng):
+    from PIL import Image
+
+    with Image.open(fileNamePng) as image:
+        data = np.asarray(image)
+    return FrameStack(data[np.newaxis], fileNamePng, 'png')
+
+
+#---------------------------------------------------------------
+# Open '<fileNameBase>.<fileType>' with the matching loader
+#---------------------------------------------------------------
+def open_frames(fileNameBase, fileType = 'h5'):
+    fileName = fileNameBase + '.' + fileType
+    if fileType == 'h5':
+        return open_h5(fileName)
+    elif fileType == 'png':
+        return open_png(fileName)
+    elif fileType == 'raw':
+        return open_raw(fileName, fileNameBase + '.hdr')
+    elif fileType == 'npy':
+        return open_npy(fileName)
+    elif fileType == 'crops':
+        from .archive import ARCHIVE_SUFFIX, open_crop_archive
+        return open_crop_archive(fileNameBase + ARCHIVE_SUFFIX)
+    raise ValueError('Unknown image file type "{}". Expected one of {}'.format(fileType, FRAME_TYPES))
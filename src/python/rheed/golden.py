@@ -0,0 +1,379 @@
+#---------------------------------------------------------------
+# Bit-exact host model of the FPGA crop + hls4ml result path
+#---------------------------------------------------------------
+# For each frame and each crop box register word the FPGA
+#   1. crops a BOX_COLS x BOX_ROWS window at (x, y) of the word
+#      (bits 31:16 x, bits 15:0 y, rhd_registers_misc.vhdl)
+#   2. streams the 8-bit pixels into the hls4ml network
+#      (myproject_small, ap_fixed<16,15>, rhd_hls4ml_wrapper.vhdl)
+#   3. takes C_NUM_RESULTS outputs of C_BITWIDTH_RESULTS bits each
+#   4. packs them into C_BITS_PER_CROP_RESULT = 40 bits, result0 in
+#      bits 7:0 ... result4 in bits 39:32, read back as two 32-bit
+#      registers per box from ADR_REG_RESULT0 (16) upwards.
+#
+# The network is evaluated on integers holding the raw ap_fixed
+# bits, with the hls4ml defaults: each product is truncated (AP_TRN)
+# to the accumulator type and sums wrap (AP_WRAP). Everything is
+# vectorized over (frames x boxes); large batches are processed in
+# chunks to bound memory.
+#
+# Note: CustomLogic_GJ.vhdl currently wires crop_x0 to bits 15:0,
+# i.e. the y field. swap_xy = True models that wiring.
+#
+# Without network weights the model reproduces the dummy hls4ml
+# block (rhd_hls4ml_dummy.vhdl): box k returns (k << 32) | word_k.
+#
+# Network files are .npz archives holding the weight arrays and a
+# 'spec' JSON string:
+#   {"input_t": [16, 15],
+#    "layers": [{"type": "conv2d", "weight": "w1", "bias": "b1",
+#                "padding": "valid", "stride": 1,
+#                "weight_t": [16, 15], "bias_t": [16, 15],
+#                "accum_t": [16, 15], "result_t": [16, 15]},
+#               {"type": "relu", "result_t": [16, 15]},
+#               {"type": "maxpool2d", "pool": 2},
+#               {"type": "flatten"},
+#               {"type": "dense", "weight": "w2", "bias": "b2", ...}]}
+# Conv weights are (kh, kw, cin, cout), dense weights (nin, nout),
+# float values as exported from Keras; they are quantized on load.
+# Types are [W, I] or [W, I, rounding, overflow] with rounding
+# 'TRN'/'RND' and overflow 'WRAP'/'SAT'.
+#---------------------------------------------------------------
+import  json
+import  numpy as np
+
+from    .crop import BOX_COLS, BOX_ROWS
+
+NUM_RESULTS         = 5             # C_NUM_RESULTS
+BITWIDTH_RESULTS    = 8             # C_BITWIDTH_RESULTS
+BITS_PER_CROP       = NUM_RESULTS * BITWIDTH_RESULTS    # C_BITS_PER_CROP_RESULT
+REGS_PER_CROP       = (BITS_PER_CROP + 31) // 32        # C_REGS_PER_CROP_RESULT
+ADR_REG_RESULT0     = 16
+
+DEFAULT_TYPE        = (16, 15)      # ap_fixed<16,15>
+CHUNK_ELEMENTS      = 1 << 24       # Largest temporary product array
+
+
+#---------------------------------------------------------------
+# ap_fixed<W, I> number format. Values are held as raw integers
+# with F = W - I fractional bits.
+#---------------------------------------------------------------
+class FixedType:
+
+    def __init__(self, W, I, rounding = 'TRN', overflow = 'WRAP', signed = True):
+        if rounding not in ('TRN', 'RND') or overflow not in ('WRAP', 'SAT'):
+            raise ValueError('Unsupported ap_fixed mode {} {}'.format(rounding, overflow))
+        self.W          = W
+        self.I          = I
+        self.F          = W - I
+        self.rounding   = rounding
+        self.overflow   = overflow
+        self.signed     = signed
+
+    @classmethod
+    def from_spec(cls, spec):
+        if spec is None:
+            return cls(*DEFAULT_TYPE)
+        if isinstance(spec, FixedType):
+            return spec
+        return cls(*spec)
+
+    def __repr__(self):
+        return 'ap_fixed<{},{},{},{}>'.format(self.W, self.I, self.rounding, self.overflow)
+
+    #-----------------------------------------------------------
+    # Float values to raw integers
+    #-----------------------------------------------------------
+    def quantize(self, x):
+        scaled = np.asarray(x, dtype = np.float64) * (2.0 ** self.F)
+        raw    = np.floor(scaled + 0.5) if self.rounding == 'RND' else np.floor(scaled)
+        return self.wrap(raw.astype(np.int64))
+
+    def to_float(self, raw):
+        return np.asarray(raw, dtype = np.float64) / (2.0 ** self.F)
+
+    #-----------------------------------------------------------
+    # Raw integers with F_from fractional bits to this type
+    #-----------------------------------------------------------
+    def cast(self, raw, F_from):
+        raw   = np.asarray(raw, dtype = np.int64)
+        shift = F_from - self.F
+        if shift > 0:
+            if self.rounding == 'RND':
+                raw = raw + (np.int64(1) << (shift - 1))
+            raw = raw >> shift
+        elif shift < 0:
+            raw = raw << (-shift)
+        return self.wrap(raw)
+
+    #-----------------------------------------------------------
+    # Apply the overflow mode to raw integers
+    #-----------------------------------------------------------
+    def wrap(self, raw):
+        if self.signed:
+            lo, hi = -(1 << (self.W - 1)), (1 << (self.W - 1)) - 1
+        else:
+            lo, hi = 0, (1 << self.W) - 1
+        if self.overflow == 'SAT':
+            return np.clip(raw, lo, hi)
+        return ((raw - lo) & ((1 << self.W) - 1)) + lo
+
+
+#---------------------------------------------------------------
+# Sum over k of trunc(a[n, k] * w[k, c]) in the accumulator type.
+# Each product is truncated before the sum, as in hls4ml. The sum of
+# truncated products is computed from one integer matmul plus a
+# correction for the dropped low bits when few bits are dropped,
+# otherwise from explicit products in chunks.
+#---------------------------------------------------------------
+def fixed_dot(a, Fa, w, Fw, accum_t):
+    shift = Fa + Fw - accum_t.F
+    if shift <= 0:
+        return accum_t.wrap(np.matmul(a, w) << (-shift))
+
+    if accum_t.rounding == 'TRN' and shift <= 4:
+        # floor(p / 2^s) = (p - (p mod 2^s)) / 2^s, and p mod 2^s only
+        # depends on the low bits of a and w.
+        mask    = (1 << shift) - 1
+        total   = np.matmul(a, w)
+        a_lo    = a & mask
+        w_lo    = w & mask
+        for v in range(1, 1 << shift):
+            total -= np.matmul((a_lo == v).astype(np.int64), (v * w_lo) & mask)
+        return accum_t.wrap(total >> shift)
+
+    n, k   = a.shape
+    c      = w.shape[1]
+    out    = np.empty((n, c), dtype = np.int64)
+    nChunk = max(1, CHUNK_ELEMENTS // max(1, k * c))
+    for i in range(0, n, nChunk):
+        prod = a[i:i + nChunk, :, None] * w[None, :, :]
+        if accum_t.rounding == 'RND':
+            prod += np.int64(1) << (shift - 1)
+        out[i:i + nChunk] = (prod >> shift).sum(axis = 1)
+    return accum_t.wrap(out)
+
+
+#---------------------------------------------------------------
+# Network layers on raw integers. Each layer maps (raw, F) to (raw, F).
+# Activations are channels-last (N, H, W, C) like Keras/hls4ml.
+#---------------------------------------------------------------
+class _Conv2D:
+
+    def __init__(self, spec, arrays):
+        self.weight_t   = FixedType.from_spec(spec.get('weight_t'))
+        self.bias_t     = FixedType.from_spec(spec.get('bias_t'))
+        self.accum_t    = FixedType.from_spec(spec.get('accum_t'))
+        self.result_t   = FixedType.from_spec(spec.get('result_t'))
+        w               = np.asarray(arrays[spec['weight']])
+        self.kernel     = w.shape[:2]
+        self.w          = self.weight_t.quantize(w.reshape(-1, w.shape[3]))
+        self.b          = self.bias_t.quantize(arrays[spec['bias']]) if spec.get('bias') else None
+        self.stride     = int(spec.get('stride', 1))
+        self.padding    = spec.get('padding', 'valid')
+
+    def __call__(self, x, F):
+        kh, kw = self.kernel
+        if self.padding == 'same':
+            ph, pw = kh - 1, kw - 1
+            x = np.pad(x, ((0, 0), (ph // 2, ph - ph // 2), (pw // 2, pw - pw // 2), (0, 0)))
+        win = np.lib.stride_tricks.sliding_window_view(x, (kh, kw), axis = (1, 2))[:, ::self.stride, ::self.stride]
+        n, oh, ow = win.shape[:3]
+        # (N, OH, OW, C, kh, kw) -> (N*OH*OW, kh*kw*C) in weight order
+        cols = np.ascontiguousarray(win.transpose(0, 1, 2, 4, 5, 3)).reshape(n * oh * ow, -1)
+        acc  = fixed_dot(cols, F, self.w, self.weight_t.F, self.accum_t)
+        if self.b is not None:
+            acc = self.accum_t.wrap(acc + self.accum_t.cast(self.b, self.bias_t.F))
+        return self.result_t.cast(acc, self.accum_t.F).reshape(n, oh, ow, -1), self.result_t.F
+
+
+class _Dense:
+
+    def __init__(self, spec, arrays):
+        self.weight_t   = FixedType.from_spec(spec.get('weight_t'))
+        self.bias_t     = FixedType.from_spec(spec.get('bias_t'))
+        self.accum_t    = FixedType.from_spec(spec.get('accum_t'))
+        self.result_t   = FixedType.from_spec(spec.get('result_t'))
+        self.w          = self.weight_t.quantize(arrays[spec['weight']])
+        self.b          = self.bias_t.quantize(arrays[spec['bias']]) if spec.get('bias') else None
+
+    def __call__(self, x, F):
+        acc = fixed_dot(x.reshape(x.shape[0], -1), F, self.w, self.weight_t.F, self.accum_t)
+        if self.b is not None:
+            acc = self.accum_t.wrap(acc + self.accum_t.cast(self.b, self.bias_t.F))
+        return self.result_t.cast(acc, self.accum_t.F), self.result_t.F
+
+
+class _ReLU:
+
+    def __init__(self, spec, arrays):
+        self.result_t = FixedType.from_spec(spec.get('result_t'))
+
+    def __call__(self, x, F):
+        return self.result_t.cast(np.maximum(x, 0), F), self.result_t.F
+
+
+class _MaxPool2D:
+
+    def __init__(self, spec, arrays):
+        self.pool = int(spec.get('pool', 2))
+
+    def __call__(self, x, F):
+        p = self.pool
+        n, h, w, c = x.shape
+        x = x[:, :h - h % p, :w - w % p]
+        return x.reshape(n, h // p, p, w // p, p, c).max(axis = (2, 4)), F
+
+
+class _Flatten:
+
+    def __init__(self, spec, arrays):
+        pass
+
+    def __call__(self, x, F):
+        return x.reshape(x.shape[0], -1), F
+
+
+LAYER_TYPES = {'conv2d': _Conv2D, 'dense': _Dense, 'relu': _ReLU, 'maxpool2d': _MaxPool2D, 'flatten': _Flatten}
+
+
+#---------------------------------------------------------------
+# Fixed point network from a layer spec and weight arrays
+#---------------------------------------------------------------
+class FixedNetwork:
+
+    def __init__(self, spec, arrays):
+        self.input_t = FixedType.from_spec(spec.get('input_t'))
+        self.layers  = []
+        for layer in spec['layers']:
+            if layer['type'] not in LAYER_TYPES:
+                raise ValueError('Unknown layer type "{}"'.format(layer['type']))
+            self.layers.append(LAYER_TYPES[layer['type']](layer, arrays))
+
+    #-----------------------------------------------------------
+    # crops (N, rows, cols) of 8-bit pixels -> (N, outputs) raw
+    # integers of the last layer's result type
+    #-----------------------------------------------------------
+    def predict_raw(self, crops):
+        x = self.input_t.quantize(np.asarray(crops)[..., np.newaxis])
+        F = self.input_t.F
+        for layer in self.layers:
+            x, F = layer(x, F)
+        return x.reshape(x.shape[0], -1)
+
+
+def load_network(fileNameNpz):
+    with np.load(fileNameNpz) as f:
+        arrays = {key: f[key] for key in f.files if key != 'spec'}
+        spec   = json.loads(str(f['spec']))
+    return FixedNetwork(spec, arrays)
+
+
+#---------------------------------------------------------------
+# Crop boxes from a stack of frames.
+# frames : (F, H, W); words : (B,) or (F, B) parameter register words
+# Returns (F, B, box_rows, box_cols). Boxes must lie inside the frame.
+#---------------------------------------------------------------
+def crop_boxes(frames, words, box_cols = BOX_COLS, box_rows = BOX_ROWS, swap_xy = False):
+    frames = np.asarray(frames)
+    if frames.ndim == 2:
+        frames = frames[np.newaxis]
+    nFrames, nRows, nCols = frames.shape
+    words = np.broadcast_to(np.asarray(words, dtype = np.int64), (nFrames, np.shape(words)[-1]))
+    x0    = (words >> 16) & 0xFFFF
+    y0    = words & 0xFFFF
+    if swap_xy:
+        x0, y0 = y0, x0
+    if np.any(x0 + box_cols > nCols) or np.any(y0 + box_rows > nRows):
+        raise ValueError('crop box outside the {}x{} frame'.format(nCols, nRows))
+
+    # All windows are views; only the selected crops are copied
+    win = np.lib.stride_tricks.sliding_window_view(frames, (box_rows, box_cols), axis = (1, 2))
+    return win[np.arange(nFrames)[:, None], y0, x0]
+
+
+#---------------------------------------------------------------
+# Pack (..., NUM_RESULTS) 8-bit results into (..., REGS_PER_CROP)
+# 32-bit register words: result0 in bits 7:0 of the first word,
+# result4 in bits 7:0 of the second.
+#---------------------------------------------------------------
+def pack_results(results):
+    results = np.asarray(results, dtype = np.uint64) & ((1 << BITWIDTH_RESULTS) - 1)
+    value   = np.zeros(results.shape[:-1], dtype = np.uint64)
+    for i in range(NUM_RESULTS):
+        value |= results[..., i] << np.uint64(i * BITWIDTH_RESULTS)
+    return unpack_value(value)
+
+
+#---------------------------------------------------------------
+# 40-bit result values to / from register words
+#---------------------------------------------------------------
+def unpack_value(value):
+    value = np.asarray(value, dtype = np.uint64)
+    regs  = np.empty(value.shape + (REGS_PER_CROP,), dtype = np.uint32)
+    for i in range(REGS_PER_CROP):
+        regs[..., i] = (value >> np.uint64(32 * i)) & np.uint64(0xFFFFFFFF)
+    return regs
+
+
+def regs_to_results(regs):
+    regs  = np.asarray(regs, dtype = np.uint64)
+    value = np.zeros(regs.shape[:-1], dtype = np.uint64)
+    for i in range(REGS_PER_CROP):
+        value |= regs[..., i] << np.uint64(32 * i)
+    shifts = np.arange(NUM_RESULTS, dtype = np.uint64) * np.uint64(BITWIDTH_RESULTS)
+    return ((value[..., None] >> shifts) & np.uint64((1 << BITWIDTH_RESULTS) - 1)).astype(np.uint8)
+
+
+#---------------------------------------------------------------
+# Reference model of the whole result path
+#---------------------------------------------------------------
+class GoldenModel:
+
+    #-----------------------------------------------------------
+    # network : FixedNetwork, path to a network .npz, or None for
+    #           the dummy hls4ml block
+    # chunk   : crops evaluated per network call
+    # swap_xy : crop with x and y fields exchanged (see above)
+    #-----------------------------------------------------------
+    def __init__(self, network = None, box_cols = BOX_COLS, box_rows = BOX_ROWS, chunk = 256, swap_xy = False):
+        if isinstance(network, str):
+            network = load_network(network)
+        self.network    = network
+        self.box_cols   = box_cols
+        self.box_rows   = box_rows
+        self.chunk      = chunk
+        self.swap_xy    = swap_xy
+
+    #-----------------------------------------------------------
+    # frames : (F, H, W) or (H, W) 8-bit frames
+    # words  : (B,) or (F, B) crop box register words
+    # Returns registers (F, B, REGS_PER_CROP) uint32 in read-back
+    # order, i.e. registers.reshape(F, -1)[:, i] is register 16+i.
+    #-----------------------------------------------------------
+    def registers(self, frames, words):
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        words = np.broadcast_to(np.asarray(words, dtype = np.uint64), (frames.shape[0], np.shape(words)[-1]))
+        if self.network is None:
+            # Dummy: result value is box index above the parameter word
+            index = np.arange(words.shape[1], dtype = np.uint64)
+            return unpack_value((index << np.uint64(32)) | words)
+        return pack_results(self.results(frames, words))
+
+    #-----------------------------------------------------------
+    # (F, B, NUM_RESULTS) 8-bit results for each frame and box
+    #-----------------------------------------------------------
+    def results(self, frames, words):
+        if self.network is None:
+            return regs_to_results(self.registers(frames, words))
+        crops   = crop_boxes(frames, words, self.box_cols, self.box_rows, self.swap_xy)
+        nF, nB  = crops.shape[:2]
+        flat    = crops.reshape(nF * nB, self.box_rows, self.box_cols)
+        out     = np.empty((nF * nB, NUM_RESULTS), dtype = np.uint8)
+        for i in range(0, flat.shape[0], self.chunk):
+            raw = self.network.predict_raw(flat[i:i + self.chunk])[:, :NUM_RESULTS]
+            # Result ports are BITWIDTH_RESULTS wide: low bits of the raw output
+            out[i:i + self.chunk] = raw & ((1 << BITWIDTH_RESULTS) - 1)
+        return out.reshape(nF, nB, NUM_RESULTS)
@@ -0,0 +1,171 @@
+#---------------------------------------------------------------
+# Line profiles and kymographs across frame stacks
+#---------------------------------------------------------------
+# A line (or polyline, e.g. along the specular streak or a Laue
+# circle) is sampled at evenly spaced points with bilinear
+# interpolation. The four pixel indices and weights of every sample
+# are computed once; a block of frames is then sampled with one
+# gather and a weighted sum:
+#
+#   profile[f, s] = sum_k  frame_f.flat[index[s, k]] * weight[s, k]
+#
+# With width > 1 each sample is also averaged across the line over
+# 'width' points one pixel apart (more indices per sample, same
+# single gather).
+#
+# A kymograph is the (frames x samples) array of the profiles of
+# every frame of a stack. .h5 stacks are read one chunk of frames
+# at a time.
+#---------------------------------------------------------------
+import  numpy as np
+
+CHUNK_FRAMES    = 256       # Frames read and sampled per block
+
+
+#---------------------------------------------------------------
+# Points along a polyline [(x, y), ...], about one per pixel
+# unless n is given. Returns xs, ys and the unit normal at each
+# point (nx, ny).
+#---------------------------------------------------------------
+def polyline_samples(points, n = None):
+    points  = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+    if points.shape[0] < 2:
+        raise ValueError('A line needs at least two points')
+    seg     = np.diff(points, axis = 0)
+    segLen  = np.hypot(seg[:, 0], seg[:, 1])
+    dist    = np.concatenate([[0.0], np.cumsum(segLen)])
+    length  = dist[-1]
+    if n is None:
+        n = int(np.ceil(length)) + 1
+    s       = np.linspace(0.0, length, max(int(n), 2))
+    xs      = np.interp(s, dist, points[:, 0])
+    ys      = np.interp(s, dist, points[:, 1])
+
+    # Normal of the segment each sample lies on
+    nSeg    = np.clip(np.searchsorted(dist, s, side = 'right') - 1, 0, len(seg) - 1)
+    unit    = seg[nSeg] / np.maximum(segLen[nSeg], 1e-12)[:, None]
+    return xs, ys, -unit[:, 1], unit[:, 0]
+
+
+#---------------------------------------------------------------
+# Points on a circular arc, e.g. a Laue circle. Angles in degrees,
+# measured from +x towards +y (image rows grow downwards).
+#---------------------------------------------------------------
+def arc_points(cx, cy, radius, angle0, angle1, n = None):
+    if n is None:
+        n = int(np.ceil(abs(np.radians(angle1 - angle0)) * radius)) + 1
+    a = np.radians(np.linspace(angle0, angle1, max(int(n), 2)))
+    return np.stack([cx + radius * np.cos(a), cy + radius * np.sin(a)], axis = 1)
+
+
+#---------------------------------------------------------------
+# Bilinear interpolation indices and weights of points (xs, ys)
+# in a rows x cols frame. Points are clamped to the frame.
+# Returns index (n, 4) into the flattened frame and weight (n, 4).
+#---------------------------------------------------------------
+def bilinear_indices(xs, ys, rows, cols):
+    xs  = np.clip(np.asarray(xs, dtype = np.float64), 0, cols - 1)
+    ys  = np.clip(np.asarray(ys, dtype = np.float64), 0, rows - 1)
+    x0  = np.minimum(np.floor(xs).astype(np.intp), max(cols - 2, 0))
+    y0  = np.minimum(np.floor(ys).astype(np.intp), max(rows - 2, 0))
+    x1  = np.minimum(x0 + 1, cols - 1)
+    y1  = np.minimum(y0 + 1, rows - 1)
+    fx  = xs - x0
+    fy  = ys - y0
+    index  = np.stack([y0 * cols + x0, y0 * cols + x1, y1 * cols + x0, y1 * cols + x1], axis = -1)
+    weight = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy], axis = -1)
+    return index, weight
+
+
+#---------------------------------------------------------------
+# Precomputed sampler for one line in frames of a given shape
+#---------------------------------------------------------------
+class LineProfile:
+
+    #-----------------------------------------------------------
+    # points : polyline [(x, y), ...] in image pixels
+    # shape  : (rows, cols) of the frames
+    # n      : number of samples (default about one per pixel)
+    # width  : points averaged across the line per sample
+    #-----------------------------------------------------------
+    def __init__(self, points, shape, n = None, width = 1):
+        rows, cols      = shape
+        self.shape      = (rows, cols)
+        self.points     = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+        xs, ys, nx, ny  = polyline_samples(self.points, n)
+        self.xs         = xs
+        self.ys         = ys
+
+        width           = max(1, int(width))
+        across          = np.arange(width) - (width - 1) / 2           # Offsets across the line
+        px              = xs[:, None] + nx[:, None] * across           # (n, width)
+        py              = ys[:, None] + ny[:, None] * across
+        index, weight   = bilinear_indices(px, py, rows, cols)         # (n, width, 4)
+        self.index      = index.reshape(xs.size, -1)
+        self.weight     = (weight / width).reshape(xs.size, -1).astype(np.float32)
+
+    def __len__(self):
+        return self.xs.size
+
+    @property
+    def length(self):
+        seg = np.diff(self.points, axis = 0)
+        return float(np.hypot(seg[:, 0], seg[:, 1]).sum())
+
+    #-----------------------------------------------------------
+    # Profiles of frames (F, H, W) -> (F, n), or (H, W) -> (n,)
+    #-----------------------------------------------------------
+    def __call__(self, frames, out = None):
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            return self(frames[None])[0]
+        if frames.shape[1:] != self.shape:
+            raise ValueError('Line was set up for {} frames, got {}' .format(self.shape, frames.shape[1:]))
+        flat = frames.reshape(frames.shape[0], -1)
+        if out is None:
+            out = np.empty((frames.shape[0], len(self)), dtype = np.float32)
+        np.einsum('fsk,sk->fs', flat[:, self.index].astype(np.float32, copy = False), self.weight, out = out)
+        return out
+
+
+#---------------------------------------------------------------
+# Kymograph of a stack: (F, H, W) array, FrameStack or h5 dataset.
+# Returns (frames, samples) float32.
+#---------------------------------------------------------------
+def kymograph(frames, profile, start = 0, stop = None, chunk = None):
+    stop  = len(frames) if stop is None else min(stop, len(frames))
+    if chunk is None:
+        chunk = _chunk_frames(frames)
+    out   = np.empty((max(0, stop - start), len(profile)), dtype = np.float32)
+    for i in range(start, stop, chunk):
+        block = np.asarray(frames[i:min(i + chunk, stop)])
+        profile(block, out = out[i - start:i - start + block.shape[0]])
+    return out
+
+
+#---------------------------------------------------------------
+# Kymograph of a line across the frames of an .h5 dataset
+# (default first root key)
+#---------------------------------------------------------------
+def kymograph_h5(fileNameH5, points, key = None, start = 0, stop = None, n = None, width = 1):
+    import h5py
+
+    with h5py.File(fileNameH5, 'r') as f:
+        if key is None:
+            key = list(f.keys())[0]
+        ds = f[key]
+        if ds.ndim == 2:
+            profile = LineProfile(points, ds.shape, n, width)
+            return profile(ds[()])[None]
+        profile = LineProfile(points, ds.shape[1:], n, width)
+        return kymograph(ds, profile, start, stop)
+
+
+#---------------------------------------------------------------
+# Frames per read: a multiple of the h5 chunk size if there is one
+#---------------------------------------------------------------
+def _chunk_frames(frames):
+    chunks = getattr(frames, 'chunks', None)
+    if chunks:
+        return max(1, CHUNK_FRAMES // chunks[0]) * chunks[0]
+    return CHUNK_FRAMES
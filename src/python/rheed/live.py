@@ -0,0 +1,372 @@
+#---------------------------------------------------------------
+# Live frame sources and display
+#---------------------------------------------------------------
+# A frame source has read(timeout) which returns the next
+# (frame_counter, frame) or None if no frame arrived in time,
+# and close(). A source that reuses its frame buffer between
+# reads sets reuses_buffer = True. Sources:
+#
+#   StackReplaySource : replays a FrameStack (.h5/.raw/.npy) at a set rate
+#   RawTailSource     : follows a .raw file that is being appended to
+#   SocketSource      : frames sent over a local TCP socket (send_frame())
+#   SyntheticSource   : generated frames with ground truth (rheed.synthetic)
+#   RingSource        : frames from another process's shared-memory ring (rheed.shmring)
+#
+# FrameGrabber reads a source in a background thread and keeps only
+# the latest frame, so frames are dropped when the display falls
+# behind instead of queueing up. Its on_grab(counter, frame) hook runs
+# in the grabber thread for every frame received (e.g. one batched
+# read of the FPGA result registers); what it returns is kept with
+# the frame.
+#
+# LiveDisplay runs from the Tk event loop. Each tick it maps the
+# latest frame to 8 bits, scales the part around the visible region
+# to the current zoom level (rheed.view.render_window) and pastes it
+# into one reused PhotoImage. Its profiler (rheed.profiling)
+# times the preprocess, conversion, resize and render steps of a tick.
+#---------------------------------------------------------------
+import  os.path
+import  socket
+import  struct
+import  threading
+import  time
+import  numpy as np
+
+from    .frames import read_raw_header, raw_frame_count
+from    .profiling import NULL_PROFILER
+from    .view import render_window, window_covers, resample
+
+LIVE_SOURCES        = ['replay', 'tail', 'socket', 'synthetic', 'ring']
+
+DEFAULT_PORT        = 5025
+FRAME_MAGIC         = b'RHDF'
+# magic, frame counter, rows, cols, dtype string
+FRAME_HEADER        = struct.Struct('<4sQHH8s')
+FRAME_TIMEOUT       = 2.0       # Longest wait for the rest of a frame once its header is in
+
+
+#---------------------------------------------------------------
+# Replay a stack of frames at 'fps' frames per second
+#---------------------------------------------------------------
+class StackReplaySource:
+
+    reuses_buffer = False
+
+    def __init__(self, stack, fps = 30.0, loop = True, start = 0):
+        self.stack      = stack
+        self.period     = 1.0 / fps if fps > 0 else 0.0
+        self.loop       = loop
+        self.index      = start
+        self._tNext     = time.perf_counter()
+
+    def read(self, timeout = None):
+        if self.index >= len(self.stack):
+            if not self.loop or len(self.stack) == 0:
+                if timeout:
+                    time.sleep(timeout)
+                return None
+            self.index = 0
+        tWait = self._tNext - time.perf_counter()
+        if tWait > 0:
+            if timeout is not None and tWait > timeout:
+                time.sleep(timeout)
+                return None
+            time.sleep(tWait)
+        self._tNext = max(self._tNext + self.period, time.perf_counter() - self.period)
+        nFrame = self.index
+        self.index += 1
+        return nFrame, self.stack[nFrame]
+
+    def close(self):
+        self.stack.close()
+
+
+#---------------------------------------------------------------
+# Follow a raw frame file that the acquisition side appends to.
+# Only the newest whole frame is returned; older unread frames
+# are skipped. The file stays open and only that frame is read,
+# so the cost of a read does not grow with the file.
+#---------------------------------------------------------------
+class RawTailSource:
+
+    reuses_buffer = False
+
+    def __init__(self, fileNameRaw, fileNameHdr = None, poll = 0.005):
+        if fileNameHdr is None:
+            fileNameHdr = os.path.splitext(fileNameRaw)[0] + '.hdr'
+        self.fileNameRaw = fileNameRaw
+        self.header      = read_raw_header(fileNameHdr)
+        self.header['frames'] = None        # File grows
+        self.poll        = poll
+        self.dtype       = np.dtype(self.header['dtype'])
+        self.shape       = (self.header['rows'], self.header['cols'])
+        self.nRead       = 0                # Frames in file at last read
+        self._nPixels    = self.shape[0] * self.shape[1]
+        self._file       = open(fileNameRaw, 'rb')
+
+    def read(self, timeout = None):
+        tEnd = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            nFrames = raw_frame_count(self.fileNameRaw, self.header)
+            if nFrames > self.nRead:
+                break
+            if tEnd is not None and time.perf_counter() >= tEnd:
+                return None
+            time.sleep(self.poll)
+
+        self._file.seek(self.header['offset'] + (nFrames - 1) * self._nPixels * self.dtype.itemsize)
+        frame = np.fromfile(self._file, dtype = self.dtype, count = self._nPixels).reshape(self.shape)
+        self.nRead = nFrames
+        return nFrames - 1, frame
+
+    def close(self):
+        self._file.close()
+
+
+#---------------------------------------------------------------
+# Send one frame to a SocketSource
+#---------------------------------------------------------------
+def send_frame(sock, frame_counter, frame):
+    frame = np.ascontiguousarray(frame)
+    sock.sendall(FRAME_HEADER.pack(FRAME_MAGIC, frame_counter, frame.shape[0], frame.shape[1], frame.dtype.str.encode()))
+    sock.sendall(memoryview(frame).cast('B'))
+
+
+#---------------------------------------------------------------
+# Receive frames over a local TCP socket. Listens on 'port' and
+# accepts one sender at a time. Frames are received into a
+# reused buffer; the returned frame is valid until the next read().
+# A header cut off by the read timeout is kept and completed by the
+# next read. A frame not complete 'frame_timeout' s after its header
+# drops the connection, as the stream is then out of step.
+#---------------------------------------------------------------
+class SocketSource:
+
+    reuses_buffer = True
+
+    def __init__(self, host = '127.0.0.1', port = DEFAULT_PORT, frame_timeout = FRAME_TIMEOUT):
+        self.listener       = socket.create_server((host, port))
+        self.frame_timeout  = frame_timeout
+        self.conn           = None
+        self._buf           = None
+        self._header        = bytearray(FRAME_HEADER.size)
+        self._nHeader       = 0         # Header bytes received so far
+
+    def read(self, timeout = None):
+        if self.conn is None:
+            self.listener.settimeout(timeout)
+            try:
+                self.conn, _ = self.listener.accept()
+            except socket.timeout:
+                return None
+            self._nHeader = 0
+        self._nHeader = self._recv_into(memoryview(self._header), self._nHeader, timeout)
+        if (self._nHeader is None) or (self._nHeader < FRAME_HEADER.size):
+            return None
+        self._nHeader = 0
+
+        magic, nCounter, nRows, nCols, strDtype = FRAME_HEADER.unpack(self._header)
+        if magic != FRAME_MAGIC:
+            self._drop_connection()
+            return None
+        dtype = np.dtype(strDtype.rstrip(b'\0').decode())
+        if self._buf is None or self._buf.shape != (nRows, nCols) or self._buf.dtype != dtype:
+            self._buf = np.empty((nRows, nCols), dtype = dtype)
+        nGot = self._recv_into(memoryview(self._buf).cast('B'), 0, self.frame_timeout)
+        if nGot is None:
+            return None
+        if nGot < self._buf.nbytes:
+            self._drop_connection()
+            return None
+        return nCounter, self._buf
+
+    #-----------------------------------------------------------
+    # Receive into view[nGot:] until it is full or 'timeout' s have
+    # passed. Returns the bytes in view so far, or None if the
+    # sender closed the connection.
+    #-----------------------------------------------------------
+    def _recv_into(self, view, nGot, timeout):
+        tEnd = None if timeout is None else time.perf_counter() + timeout
+        while nGot < len(view):
+            if tEnd is not None:
+                tLeft = tEnd - time.perf_counter()
+                if tLeft <= 0:
+                    break
+                self.conn.settimeout(tLeft)
+            else:
+                self.conn.settimeout(None)
+            try:
+                n = self.conn.recv_into(view[nGot:])
+            except socket.timeout:
+                break
+            if n == 0:
+                self._drop_connection()
+                return None
+            nGot += n
+        return nGot
+
+    def _drop_connection(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def close(self):
+        self._drop_connection()
+        self.listener.close()
+
+
+#---------------------------------------------------------------
+# Reads a source in a background thread into a single slot.
+# A frame not taken before the next one arrives is dropped.
+#---------------------------------------------------------------
+class FrameGrabber:
+
+    def __init__(self, source, timeout = 0.1):
+        self.source     = source
+        self.timeout    = timeout
+        self.nReceived  = 0
+        self.nDropped   = 0
+        self._lock      = threading.Lock()
+        self._latest    = None
+        self._stop      = threading.Event()
+        self._thread    = None
+        self.on_grab    = None          # function(counter, frame) -> data kept with the frame, run in the grabber thread
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._run, name = 'FrameGrabber', daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    #-----------------------------------------------------------
+    # Latest (frame_counter, frame, data) or None if nothing new.
+    # data is what on_grab returned for the frame (None without it).
+    #-----------------------------------------------------------
+    def take(self):
+        with self._lock:
+            latest, self._latest = self._latest, None
+        return latest
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self.source.read(self.timeout)
+            if item is None:
+                continue
+            nCounter, frame = item
+            if self.source.reuses_buffer:
+                frame = np.array(frame, copy = True)
+            data = self.on_grab(nCounter, frame) if self.on_grab is not None else None
+            with self._lock:
+                if self._latest is not None:
+                    self.nDropped += 1
+                self._latest = (nCounter, frame, data)
+                self.nReceived += 1
+
+
+#---------------------------------------------------------------
+# Shows the latest grabbed frame on a canvas image item.
+# One PhotoImage is reused while the zoom level and rendered window
+# stay the same; frames are pasted into it. The 8-bit and resized buffers are reused as well.
+#---------------------------------------------------------------
+class LiveDisplay:
+
+    def __init__(self, root, canvas, imageItem, grabber, normalizer, level_size, period_ms = 30, window_every = 10):
+        self.root           = root
+        self.canvas         = canvas
+        self.imageItem      = imageItem
+        self.grabber        = grabber
+        self.normalizer     = normalizer
+        self.level_size     = level_size    # function(level) -> (width, height)
+        self.period_ms      = period_ms
+        self.window_every   = window_every  # Contrast window update interval in frames
+        self.level          = None
+        self.window         = None          # Part of the level shown (x0, y0, x1, y1)
+        self.photo          = None
+        self.frame          = None          # Latest frame shown (after preprocess)
+        self.raw            = None          # The same frame as grabbed, before preprocess
+        self.nCounter       = None
+        self.grabbed        = None          # What grabber.on_grab returned for the latest frame
+        self.nShown         = 0
+        self.fps            = 0.0
+        self.on_frame       = None          # function(counter, frame) called for every frame shown
+        self.preprocess     = None          # function(frame) -> frame, e.g. a FramePreprocessor
+        self.profiler       = NULL_PROFILER # Stage timers (rheed.profiling)
+        self._buf8          = None
+        self._afterId       = None
+        self._tLast         = None
+
+    @property
+    def running(self):
+        return self._afterId is not None
+
+    def start(self):
+        self.grabber.start()
+        self._tLast   = time.perf_counter()
+        self._afterId = self.root.after(self.period_ms, self._tick)
+
+    def stop(self):
+        if self._afterId is not None:
+            self.root.after_cancel(self._afterId)
+            self._afterId = None
+        self.grabber.stop()
+
+    #-----------------------------------------------------------
+    # PhotoImage showing at least the visible region (x0, y0, x1, y1)
+    # of a zoom level, as ImagePyramid.photo(). Renders a new window
+    # only when the level changes or the region leaves the window,
+    # and repaints the last frame into it.
+    # Returns (x0, y0), photo.
+    #-----------------------------------------------------------
+    def photo_for(self, level, region = None):
+        size = self.level_size(level)
+        if (level != self.level) or (self.window is None) or not window_covers(self.window, size, region):
+            from PIL import ImageTk
+            window      = render_window(size, region)
+            if (self.photo is None) or (self.photo.width(), self.photo.height()) != (window[2] - window[0], window[3] - window[1]):
+                self.photo = ImageTk.PhotoImage('L', (window[2] - window[0], window[3] - window[1]))
+            self.level  = level
+            self.window = window
+            if self.frame is not None:
+                self._paste(self.frame)
+        return self.window[:2], self.photo
+
+    def _tick(self):
+        self._afterId = self.root.after(self.period_ms, self._tick)
+        item = self.grabber.take()
+        if item is None or self.photo is None:
+            return
+        self.nCounter, self.raw, self.grabbed = item
+        self.frame = self.raw
+        if self.preprocess is not None:
+            with self.profiler.stage('preprocess'):
+                self.frame = self.preprocess(self.raw)
+        if self.nShown % self.window_every == 0:
+            with self.profiler.stage('conversion'):
+                self.normalizer.update(self.frame)
+        self._paste(self.frame)
+        self.nShown += 1
+        if self.on_frame is not None:
+            self.on_frame(self.nCounter, self.frame)
+
+        tNow = time.perf_counter()
+        self.fps = 0.9 * self.fps + 0.1 / max(tNow - self._tLast, 1e-6)
+        self._tLast = tNow
+
+    def _paste(self, frame):
+        from PIL import Image
+
+        if self._buf8 is None or self._buf8.shape != frame.shape:
+            self._buf8 = np.empty(frame.shape, dtype = np.uint8)
+        with self.profiler.stage('conversion'):
+            image = Image.fromarray(self.normalizer(frame, out = self._buf8))
+        size  = self.level_size(self.level)
+        if (image.size != size) or (self.window != (0, 0) + size):
+            with self.profiler.stage('resize'):
+                image = resample(image, size, self.window)
+        with self.profiler.stage('render'):
+            self.photo.paste(image)
@@ -0,0 +1,205 @@
+#---------------------------------------------------------------
+# Streaming RHEED oscillation analysis
+#---------------------------------------------------------------
+# Each channel (a crop box intensity, or one hls4ml result of a
+# box) is a sample stream, one sample per frame. A sliding DFT over
+# the last 'window' samples is updated per sample:
+#   X_k(n) = (X_k(n-1) + x(n) - x(n-window)) * exp(2 pi i k / window)
+# so a new sample costs O(bins x channels), not an FFT. The bins are
+# recomputed exactly with an FFT once per window to stop rounding
+# errors from building up.
+#
+# The intensity of a box usually drifts as well as oscillating. The
+# analyzer feeds the sliding DFT with first differences, which turns
+# a linear trend into a constant (bin 0, not used), and divides the
+# bins by the difference response 1 - exp(-2 pi i k / window).
+#
+# estimate() reports per channel:
+#   period     : oscillation period (s), from the strongest bin
+#                refined between bins (Jacobsen estimator)
+#   phase      : phase (rad) of  A cos(2 pi t / period + phase)  at
+#                the newest sample
+#   amplitude  : oscillation amplitude
+#   damping    : amplitude decay rate (1/s) from the older and newer
+#                halves of the window; 0 for a steady oscillation
+#   snr        : power in the peak bins / power in the other bins
+#
+# One RHEED oscillation is one monolayer, so the growth rate is
+# 1/period monolayers per second.
+#---------------------------------------------------------------
+import  numpy as np
+
+OSC_DTYPE       = np.dtype([('period', 'f8'), ('phase', 'f8'), ('amplitude', 'f8'), ('damping', 'f8'), ('snr', 'f8')])
+
+WINDOW          = 256       # Samples in the sliding window
+MIN_CYCLES      = 2         # Fewest oscillations in the window that count as a peak
+
+
+#---------------------------------------------------------------
+# Sliding-window DFT of several channels
+#---------------------------------------------------------------
+class SlidingDFT:
+
+    #-----------------------------------------------------------
+    # num_channels : samples per update (e.g. crop boxes)
+    # window       : window length in samples
+    # bins         : DFT bins kept, default 1 .. window // 2
+    #-----------------------------------------------------------
+    def __init__(self, num_channels, window = WINDOW, bins = None):
+        self.num_channels = num_channels
+        self.window       = window
+        self.bins         = np.arange(1, window // 2 + 1) if bins is None else np.asarray(bins, dtype = np.intp)
+        self._twiddle     = np.exp(2j * np.pi * self.bins / window)[:, None]       # (K, 1)
+        self.reset()
+
+    def reset(self):
+        self.ring   = np.zeros((self.window, self.num_channels))    # Last 'window' samples
+        self.X      = np.zeros((self.bins.size, self.num_channels), dtype = np.complex128)
+        self.nCount = 0                                             # Samples received
+        self._nSlot = 0                                             # Ring slot of the oldest sample
+
+    @property
+    def full(self):
+        return self.nCount >= self.window
+
+    #-----------------------------------------------------------
+    # Add one sample per channel, shape (C,)
+    #-----------------------------------------------------------
+    def push(self, sample):
+        sample           = np.asarray(sample, dtype = np.float64)
+        old              = self.ring[self._nSlot]
+        self.X          += sample - old
+        self.X          *= self._twiddle
+        self.ring[self._nSlot] = sample
+        self._nSlot      = (self._nSlot + 1) % self.window
+        self.nCount     += 1
+        if self._nSlot == 0:
+            self.resync()
+
+    #-----------------------------------------------------------
+    # Add a block of samples, shape (n, C)
+    #-----------------------------------------------------------
+    def extend(self, samples):
+        for sample in np.asarray(samples, dtype = np.float64):
+            self.push(sample)
+
+    #-----------------------------------------------------------
+    # Samples in time order, oldest first, shape (window, C)
+    #-----------------------------------------------------------
+    def samples(self):
+        return np.roll(self.ring, -self._nSlot, axis = 0)
+
+    def resync(self):
+        self.X = np.fft.fft(self.samples(), axis = 0)[self.bins]
+
+
+#---------------------------------------------------------------
+# Oscillation period, phase and damping for several channels
+#---------------------------------------------------------------
+class OscillationAnalyzer:
+
+    #-----------------------------------------------------------
+    # dt          : sample interval (s), e.g. 1 / frame rate
+    # min_period  : shortest period looked for (s), default 4 samples
+    #-----------------------------------------------------------
+    def __init__(self, num_channels, window = WINDOW, dt = 1.0, min_period = None):
+        self.dt         = dt
+        self.sdft       = SlidingDFT(num_channels, window)      # Of the first differences
+        kMax            = window // 2 if min_period is None else int(window * dt / min_period)
+        self._kLo       = MIN_CYCLES
+        self._kHi       = max(self._kLo + 1, min(kMax, window // 2 - 1))
+        self._response  = (1 - np.exp(-2j * np.pi * self.sdft.bins / window))[:, None]
+        self.reset()
+
+    def reset(self):
+        self.sdft.reset()
+        self.ring       = np.zeros((self.sdft.window, self.sdft.num_channels))     # Raw samples
+        self._last      = None
+
+    @property
+    def ready(self):
+        return self.sdft.full
+
+    def push(self, sample):
+        sample = np.asarray(sample, dtype = np.float64)
+        nSlot  = self.sdft._nSlot
+        self.sdft.push(sample - (sample if self._last is None else self._last))
+        self.ring[nSlot] = sample
+        self._last       = self.ring[nSlot]
+
+    def extend(self, samples):
+        for sample in np.asarray(samples, dtype = np.float64):
+            self.push(sample)
+
+    #-----------------------------------------------------------
+    # Raw samples in time order, oldest first, shape (window, C)
+    #-----------------------------------------------------------
+    def samples(self):
+        return np.roll(self.ring, -self.sdft._nSlot, axis = 0)
+
+    #-----------------------------------------------------------
+    # Current estimates, OSC_DTYPE (C,). NaN until the window is full.
+    #-----------------------------------------------------------
+    def estimate(self):
+        nCh    = self.sdft.num_channels
+        out    = np.full(nCh, np.nan, dtype = OSC_DTYPE)
+        if not self.ready:
+            return out
+        N      = self.sdft.window
+        X      = self.sdft.X / self._response            # Row j is bin j + 1
+        power  = np.abs(X) ** 2
+        ch     = np.arange(nCh)
+
+        # Strongest bin in the searched range
+        k      = self._kLo + np.argmax(power[self._kLo - 1:self._kHi], axis = 0)
+        Xm, X0, Xp = X[k - 2, ch], X[k - 1, ch], X[k, ch]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            delta  = np.real((Xm - Xp) / (2 * X0 - Xm - Xp))
+        delta  = np.clip(np.nan_to_num(delta), -0.5, 0.5)
+        f      = (k + delta) / N                         # Cycles per sample
+
+        # Phase and amplitude at the newest sample from a direct fit at f,
+        # after removing a straight line from each channel
+        m      = np.arange(N)[:, None]
+        x      = self.samples()
+        slope  = ((m - (N - 1) / 2) * x).sum(axis = 0) / ((m - (N - 1) / 2) ** 2).sum()
+        x      = x - x.mean(axis = 0) - slope * (m - (N - 1) / 2)
+        basis  = np.exp(-2j * np.pi * f[None, :] * m)   # (N, C)
+        c      = (x * basis).sum(axis = 0) * 2 / N
+        out['amplitude'] = np.abs(c)
+        out['phase']     = np.angle(np.exp(1j * (np.angle(c) + 2 * np.pi * f * (N - 1))))
+        out['period']    = self.dt / f
+
+        # Damping from the amplitude at f in the older and newer halves
+        h      = N // 2
+        aOld   = np.abs((x[:h] * basis[:h]).sum(axis = 0))
+        aNew   = np.abs((x[N - h:] * basis[N - h:]).sum(axis = 0))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            out['damping'] = np.log(aOld / aNew) / (h * self.dt)
+
+        peak   = power[k - 2, ch] + power[k - 1, ch] + power[k, ch]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            out['snr'] = peak / np.maximum(power.sum(axis = 0) - peak, 1e-300)
+        return out
+
+
+#---------------------------------------------------------------
+# Run the analyzer over recorded samples (n, C), e.g. RoiStats
+# traces or hls4ml results. Returns OSC_DTYPE (n_estimates, C),
+# one estimate every 'step' samples once the window is full, and
+# the sample index of each estimate.
+#---------------------------------------------------------------
+def analyze_series(samples, window = WINDOW, dt = 1.0, step = None, min_period = None):
+    samples  = np.asarray(samples, dtype = np.float64)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    step     = window // 4 if step is None else step
+    analyzer = OscillationAnalyzer(samples.shape[1], window, dt, min_period)
+    index    = list(range(window - 1, samples.shape[0], step))
+    out      = np.empty((len(index), samples.shape[1]), dtype = OSC_DTYPE)
+    nDone    = 0
+    for i, nEnd in enumerate(index):
+        analyzer.extend(samples[nDone:nEnd + 1])
+        nDone  = nEnd + 1
+        out[i] = analyzer.estimate()
+    return out, np.array(index, dtype = np.intp)
@@ -0,0 +1,106 @@
+#---------------------------------------------------------------
+# Crop box overlay on the GUI canvas
+#---------------------------------------------------------------
+# All canvas items are created once and then only moved with
+# coords() or hidden, so the number of items on the canvas does
+# not grow however long the GUI runs.
+#
+#   Box layer     : one box outline and one centre cross per crop
+#                   box register (fixed pool of NUM_BOXES).
+#   History layer : crosses of boxes pushed off the list. A ring
+#                   of at most 'history_cap' crosses; the oldest
+#                   cross is reused for the newest.
+#---------------------------------------------------------------
+
+HISTORY_CAP     = 100       # Default number of history crosses kept
+CROSS_SIZE      = 5         # Half length of a cross in canvas units
+
+
+#---------------------------------------------------------------
+# Fixed pool of canvas items for the crop boxes and click history
+#---------------------------------------------------------------
+class CropOverlay:
+
+    def __init__(self, canvas, view, num_boxes, box_cols, box_rows, history_cap = HISTORY_CAP, cross_size = CROSS_SIZE):
+        self.canvas         = canvas
+        self.view           = view
+        self.box_cols       = box_cols
+        self.box_rows       = box_rows
+        self.history_cap    = max(0, int(history_cap))
+        self.cross_size     = cross_size
+
+        self.boxes          = []    # (x0, y0) in image pixels, per pool slot
+        self.markers        = []    # (x, y) in image pixels, per pool slot
+        self.history        = []    # (x, y) in image pixels, ring
+        self._nHistoryNext  = 0     # Ring slot for the next history cross
+
+        self._itemBox       = [self._line('red', 2) for i in range(num_boxes)]
+        self._itemMarker    = [(self._line('green', 2), self._line('green', 2)) for i in range(num_boxes)]
+        self._itemHistory   = []    # Created as the ring fills, never more than history_cap
+
+    def _line(self, colour, width):
+        return self.canvas.create_line(0, 0, 0, 0, fill = colour, width = width, state = 'hidden', tags = ('overlay',))
+
+    @property
+    def item_count(self):
+        return len(self._itemBox) + 2 * len(self._itemMarker) + 2 * len(self._itemHistory)
+
+    #-----------------------------------------------------------
+    # Show the current box list. boxes and markers are parallel
+    # lists of upper left corners and centre crosses.
+    #-----------------------------------------------------------
+    def set_boxes(self, boxes, markers):
+        self.boxes   = list(boxes)[:len(self._itemBox)]
+        self.markers = list(markers)[:len(self._itemBox)]
+        self.draw_boxes()
+
+    #-----------------------------------------------------------
+    # Add a cross to the history ring
+    #-----------------------------------------------------------
+    def add_history(self, pixel_x, pixel_y):
+        if self.history_cap == 0:
+            return
+        nSlot = self._nHistoryNext
+        if nSlot == len(self._itemHistory):
+            self._itemHistory.append((self._line('dark green', 1), self._line('dark green', 1)))
+            self.history.append((pixel_x, pixel_y))
+        else:
+            self.history[nSlot] = (pixel_x, pixel_y)
+        self._nHistoryNext = (nSlot + 1) % self.history_cap
+        self._draw_cross(self._itemHistory[nSlot], pixel_x, pixel_y)
+
+    def clear_history(self):
+        for items in self._itemHistory:
+            for item in items:
+                self.canvas.itemconfig(item, state = 'hidden')
+        self.history        = [None] * len(self._itemHistory)
+        self._nHistoryNext  = 0
+
+    #-----------------------------------------------------------
+    # Move every item to the current view (after zoom/pan/resize)
+    #-----------------------------------------------------------
+    def draw(self):
+        self.draw_boxes()
+        for items, location in zip(self._itemHistory, self.history):
+            if location is not None:
+                self._draw_cross(items, *location)
+
+    def draw_boxes(self):
+        for nSlot, itemBox in enumerate(self._itemBox):
+            if nSlot < len(self.boxes):
+                x0, y0, x1, y1 = self.view.box_to_canvas(self.boxes[nSlot][0], self.boxes[nSlot][1], self.box_cols, self.box_rows)
+                self.canvas.coords(itemBox, x0, y0, x1, y0, x1, y1, x0, y1, x0, y0)
+                self.canvas.itemconfig(itemBox, state = 'normal')
+                self._draw_cross(self._itemMarker[nSlot], *self.markers[nSlot])
+            else:
+                self.canvas.itemconfig(itemBox, state = 'hidden')
+                for item in self._itemMarker[nSlot]:
+                    self.canvas.itemconfig(item, state = 'hidden')
+
+    def _draw_cross(self, items, pixel_x, pixel_y):
+        x, y = self.view.pixel_to_canvas(pixel_x, pixel_y)
+        n    = self.cross_size
+        self.canvas.coords(items[0], x - n, y, x + n, y)
+        self.canvas.coords(items[1], x, y - n, x, y + n)
+        for item in items:
+            self.canvas.itemconfig(item, state = 'normal')
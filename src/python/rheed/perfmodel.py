@@ -0,0 +1,229 @@
+#---------------------------------------------------------------
+# Transaction-level performance model of the CustomLogic crop chain
+#---------------------------------------------------------------
+# Models the chain in CustomLogic_GJ.vhdl at the clock cycle level,
+# one pixel or camera beat per transaction:
+#
+#   camera  --beat-->  sequentializer  --pixel-->  crop filter  --box pixels-->  hls4ml  --> result registers
+#   8 px / beat        1 px / clock out            one FIFO per box              box by box
+#
+# Camera    : a beat of PIXELS_PER_BURST pixels per clock along a
+#             line, line_gap clocks between lines, one frame every
+#             clock / camera_fps clocks (camera_fps = None: as fast as
+#             the chain accepts). A beat not accepted waits (the frame
+#             grabber buffers it); those clocks are camera stalls.
+# Sequentializer : holds seq_beats beats and sends one pixel per clock.
+# Crop filter : drops pixels outside every box and copies box pixels
+#             into the FIFO of each box they lie in (overlapping boxes
+#             get a copy each). Boxes go to hls4ml one after the other
+#             (box 0 .. boxes-1 of a frame, SOF/EOF per box), so a box
+#             arriving while an earlier one is being sent waits in its
+#             FIFO. A pixel whose FIFO is full stalls the crop filter.
+# hls4ml    : takes one pixel per pixel_ii clocks while its input is
+#             ready (backpressure = chance per clock that it is not),
+#             starts a box no sooner than crop_ii clocks after the last
+#             start, and has the result latency clocks after the last
+#             pixel. Results go straight to the registers (tready = '1').
+#
+# Clocks where nothing can move are skipped, so slow camera rates
+# cost no more to run than fast ones. If nothing can ever move again
+# (e.g. box 0 lies below box 1 and box 1 does not fit in its FIFO)
+# the run stops and the report says 'deadlock'.
+#---------------------------------------------------------------
+import  numpy as np
+
+from    .crop import IN_COLS, IN_ROWS, BOX_COLS, BOX_ROWS, unpack_xy
+
+CLOCK_HZ            = 250e6     # clk250
+PIXELS_PER_BURST    = 8         # Sequentializer input beat
+SEQ_BEATS           = 1         # Beats held by the sequentializer
+HLS_LATENCY         = 100       # Clocks from a box's last pixel to its result (from the hls4ml report)
+
+
+#---------------------------------------------------------------
+# Per raster pixel, the tuple of boxes it lies in
+#---------------------------------------------------------------
+def box_membership(boxes, image_cols, image_rows, box_cols, box_rows):
+    mask = np.zeros((image_rows, image_cols), dtype = np.int64)
+    for nBox, (x0, y0) in enumerate(boxes):
+        if x0 < 0 or y0 < 0 or x0 + box_cols > image_cols or y0 + box_rows > image_rows:
+            raise ValueError('crop box {} at ({}, {}) is outside the {}x{} frame' .format(nBox, x0, y0, image_cols, image_rows))
+        mask[y0:y0 + box_rows, x0:x0 + box_cols] |= 1 << nBox
+    tuples = {0: ()}
+    for value in np.unique(mask):
+        tuples[int(value)] = tuple(nBox for nBox in range(len(boxes)) if value >> nBox & 1)
+    return [tuples[value] for value in mask.ravel().tolist()]
+
+
+#---------------------------------------------------------------
+# Simulate 'frames' frames through the chain. boxes are upper left
+# corners [(x0, y0), ...] or crop box words.
+# Returns a report dict (see format_report()).
+#---------------------------------------------------------------
+def simulate(boxes, frames = 4, image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS,
+             camera_fps = None, line_gap = 0, pixels_per_burst = PIXELS_PER_BURST, seq_beats = SEQ_BEATS,
+             fifo_depth = None, pixel_ii = 1, crop_ii = 0, latency = HLS_LATENCY, backpressure = 0.0,
+             clock_hz = CLOCK_HZ, seed = None):
+    boxes = [unpack_xy(int(b)) if np.isscalar(b) else (int(b[0]), int(b[1])) for b in boxes]
+    if image_cols % pixels_per_burst:
+        raise ValueError('Frame width {} is not a multiple of {} pixels per burst' .format(image_cols, pixels_per_burst))
+    nBoxes      = len(boxes)
+    nBoxPixels  = box_cols * box_rows
+    nFrame      = image_cols * image_rows
+    nDepth      = nBoxPixels if fifo_depth is None else int(fifo_depth)
+    membership  = box_membership(boxes, image_cols, image_rows, box_cols, box_rows)
+    rng         = np.random.default_rng(seed)
+
+    # Camera beat timing
+    nBeatsLine  = image_cols // pixels_per_burst
+    nBeatsFrame = nBeatsLine * image_rows
+    nBeats      = nBeatsFrame * frames
+    tFrame      = None if camera_fps is None else int(round(clock_hz / camera_fps))
+    def beat_time(j):
+        if tFrame is None:
+            return 0
+        jj = j % nBeatsFrame
+        return (j // nBeatsFrame) * tFrame + (jj // nBeatsLine) * (nBeatsLine + line_gap) + jj % nBeatsLine
+
+    nSeqCap     = seq_beats * pixels_per_burst
+    nCrops      = nBoxes * frames
+    fifo        = [0] * nBoxes
+    fifoPeak    = [0] * nBoxes
+    fifoArea    = [0] * nBoxes          # Sum of occupancy over clocks
+    tFirstBeat  = [None] * frames       # Clock the first beat of each frame was accepted
+    tResult     = np.zeros((frames, nBoxes), dtype = np.int64)
+
+    t           = 0
+    nBeat       = 0                     # Next camera beat
+    nSeq        = 0                     # Pixels held by the sequentializer
+    nSeqPeak    = 0
+    nPixel      = 0                     # Next pixel out of the sequentializer
+    nCrop       = 0                     # Box being fed to hls4ml (frame * boxes + box)
+    nFed        = 0                     # Its pixels taken so far
+    tHlsNext    = 0                     # Earliest clock hls4ml takes the next pixel
+    tCropStart  = 0
+    stalls      = {'camera': 0, 'crop_filter': 0, 'hls_starved': 0, 'hls_backpressure': 0}
+    deadlock    = False
+    tBeat       = beat_time(0) if nBeats else 0
+
+    while nCrop < nCrops:
+        bMoved = False
+
+        # hls4ml takes a pixel of the current box
+        nBox = nCrop % nBoxes
+        if t >= tHlsNext:
+            if fifo[nBox] == 0:
+                stalls['hls_starved'] += 1
+            elif backpressure and rng.random() < backpressure:
+                stalls['hls_backpressure'] += 1
+                bMoved = True           # Ready may come back next clock
+            else:
+                fifo[nBox] -= 1
+                if nFed == 0:
+                    tCropStart = t
+                nFed    += 1
+                tHlsNext = t + pixel_ii
+                bMoved   = True
+                if nFed == nBoxPixels:
+                    tResult[nCrop // nBoxes, nBox] = t + latency
+                    nCrop   += 1
+                    nFed     = 0
+                    tHlsNext = max(tHlsNext, tCropStart + crop_ii)
+
+        # Crop filter takes a pixel from the sequentializer
+        if nSeq:
+            inBoxes = membership[nPixel % nFrame]
+            if all(fifo[b] < nDepth for b in inBoxes):
+                for b in inBoxes:
+                    fifo[b] += 1
+                    if fifo[b] > fifoPeak[b]:
+                        fifoPeak[b] = fifo[b]
+                nSeq   -= 1
+                nPixel += 1
+                bMoved  = True
+            else:
+                stalls['crop_filter'] += 1
+
+        # Sequentializer takes a camera beat
+        if nBeat < nBeats and t >= tBeat:
+            if nSeq + pixels_per_burst <= nSeqCap:
+                if nBeat % nBeatsFrame == 0:
+                    tFirstBeat[nBeat // nBeatsFrame] = t
+                nSeq    += pixels_per_burst
+                nSeqPeak = max(nSeqPeak, nSeq)
+                nBeat   += 1
+                tBeat    = beat_time(nBeat) if nBeat < nBeats else 0
+                bMoved   = True
+            else:
+                stalls['camera'] += 1
+
+        for b in range(nBoxes):
+            fifoArea[b] += fifo[b]
+        if bMoved:
+            t += 1
+            continue
+
+        # Nothing moved: jump to the next clock something can
+        tNext = []
+        if nBeat < nBeats and tBeat > t and nSeq + pixels_per_burst <= nSeqCap:
+            tNext.append(tBeat)
+        if tHlsNext > t and fifo[nCrop % nBoxes]:
+            tNext.append(tHlsNext)
+        if not tNext:
+            deadlock = True
+            break
+        dt = min(tNext) - t
+        # The clock just counted plus the skipped ones
+        nSkip = dt - 1
+        if nSeq:
+            stalls['crop_filter'] += nSkip if not all(fifo[b] < nDepth for b in membership[nPixel % nFrame]) else 0
+        if tHlsNext <= t and fifo[nCrop % nBoxes] == 0:
+            stalls['hls_starved'] += nSkip
+        if nBeat < nBeats and tBeat <= t:
+            stalls['camera'] += nSkip
+        for b in range(nBoxes):
+            fifoArea[b] += fifo[b] * nSkip
+        t += dt
+
+    nDone  = nCrop // nBoxes
+    tEnd   = t
+    tDone  = [int(tResult[f].max()) for f in range(nDone)]
+    if nDone >= 2:
+        fps = (nDone - 1) * clock_hz / max(tDone[-1] - tDone[0], 1)
+    elif nDone == 1:
+        fps = clock_hz / max(tDone[0] - tFirstBeat[0], 1)
+    else:
+        fps = 0.0
+    return {'frames'            : nDone,
+            'boxes'             : nBoxes,
+            'cycles'            : tEnd,
+            'fps'               : fps,
+            'camera_fps'        : camera_fps,
+            'keeps_up'          : (not deadlock) and (camera_fps is None or fps >= camera_fps * 0.999),
+            'deadlock'          : deadlock,
+            'frame_latency'     : [tDone[f] - tFirstBeat[f] for f in range(nDone)],
+            'stalls'            : stalls,
+            'seq_peak'          : nSeqPeak,
+            'fifo_depth'        : nDepth,
+            'fifo_peak'         : fifoPeak,
+            'fifo_mean'         : [area / max(tEnd, 1) for area in fifoArea],
+            'hls_busy'          : nCrop * nBoxPixels * pixel_ii / max(tEnd, 1),
+            'clock_hz'          : clock_hz}
+
+
+#---------------------------------------------------------------
+# Text report of simulate()
+#---------------------------------------------------------------
+def format_report(report):
+    us = 1e6 / report['clock_hz']
+    lines = ['frames {}  boxes {}  cycles {}{}' .format(report['frames'], report['boxes'], report['cycles'],
+                                                     '  DEADLOCK' if report['deadlock'] else ''),
+             'frames/s {:.1f}{}' .format(report['fps'], '' if report['camera_fps'] is None else
+                                          '  (camera {:.1f}, {})' .format(report['camera_fps'], 'keeps up' if report['keeps_up'] else 'falls behind')),
+             'frame latency (us) ' + ' '.join('{:.1f}' .format(c * us) for c in report['frame_latency']),
+             'stall cycles       ' + '  '.join('{} {}' .format(name, n) for name, n in report['stalls'].items()),
+             'hls4ml busy        {:.1%}' .format(report['hls_busy']),
+             'sequentializer     peak {} pixels' .format(report['seq_peak']),
+             'box FIFO (depth {}) peak {}  mean {}' .format(report['fifo_depth'], report['fifo_peak'],
+                                                          [round(m, 1) for m in report['fifo_mean']])]
+    return '\n'.join(lines)
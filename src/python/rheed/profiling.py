@@ -0,0 +1,229 @@
+#---------------------------------------------------------------
+# Per-stage timers for the GUI and the command line (--profile)
+#---------------------------------------------------------------
+# A Profiler keeps, per stage name, the number of calls and the
+# total and longest time, and a timeline of spans (up to MAX_EVENTS)
+# with the thread each ran in. Stages are timed with
+#
+#   with profiler.stage('load'):        ...
+#   t = profiler.begin() ... profiler.end('startup', t)
+#   fn = profiler.timed('serial read', fn)
+#   profiler.instrument(obj, 'method', 'render')
+#
+# A disabled profiler returns a shared no-op stage and leaves
+# functions unwrapped, so the hooks can stay in place for normal runs
+# (NULL_PROFILER is the default of library objects).
+#
+# report() prints the summary table and writes the timeline as a
+# Chrome trace event file (.json: chrome://tracing, ui.perfetto.dev).
+# Optional: cProfile of the whole run (stats to <trace>.prof, top
+# functions printed) and tracemalloc (traced memory at the end of
+# each stage as a counter track, top allocation sites printed).
+# tracemalloc slows allocation-heavy code noticeably; the timers do not.
+#---------------------------------------------------------------
+import  os
+import  sys
+import  threading
+import  time
+
+MAX_EVENTS      = 200000        # Timeline spans kept; later ones only go into the summary
+TOP_FUNCTIONS   = 25            # cProfile and tracemalloc lines printed by report()
+TRACE_FILE      = 'rheed_profile.json'
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+    __slots__ = ('profiler', 'name', 'tStart')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name     = name
+
+    def __enter__(self):
+        self.tStart = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.end(self.name, self.tStart)
+        return False
+
+
+#---------------------------------------------------------------
+# Stage timers with optional cProfile / tracemalloc capture
+#---------------------------------------------------------------
+class Profiler:
+
+    #-----------------------------------------------------------
+    # enabled  : False makes every hook a no-op
+    # cprofile : also run cProfile from start() to stop()
+    # memory   : also trace allocations with tracemalloc
+    # t0       : time.perf_counter() of the process start, if taken
+    #            earlier (the startup span then includes imports)
+    #-----------------------------------------------------------
+    def __init__(self, enabled = True, cprofile = False, memory = False, max_events = MAX_EVENTS, t0 = None):
+        self.enabled    = enabled
+        self.cprofile   = cprofile and enabled
+        self.memory     = memory and enabled
+        self.max_events = max_events
+        self.tOrigin    = int(t0 * 1e9) if t0 is not None else time.perf_counter_ns()
+        self.stats      = {}            # name -> [calls, total ns, longest ns]
+        self.events     = []            # (name, start ns, duration ns, thread id, traced bytes)
+        self.nDropped   = 0
+        self._profile   = None
+        self._tStop     = None
+
+    def start(self):
+        if self.cprofile and self._profile is None:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        return self
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+        self._tStop = time.perf_counter_ns()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stage(self, name):
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def begin(self):
+        return time.perf_counter_ns() if self.enabled else 0
+
+    #-----------------------------------------------------------
+    # Close a span started at tStart (from begin())
+    #-----------------------------------------------------------
+    def end(self, name, tStart):
+        if not self.enabled:
+            return
+        tNow  = time.perf_counter_ns()
+        tSpan = tNow - tStart
+        stat  = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = [0, 0, 0]
+        stat[0] += 1
+        stat[1] += tSpan
+        if tSpan > stat[2]:
+            stat[2] = tSpan
+        if len(self.events) < self.max_events:
+            nBytes = None
+            if self.memory:
+                import tracemalloc
+                nBytes = tracemalloc.get_traced_memory()[0]
+            self.events.append((name, tStart, tSpan, threading.get_ident(), nBytes))
+        else:
+            self.nDropped += 1
+
+    #-----------------------------------------------------------
+    # fn wrapped in a stage (fn itself when disabled)
+    #-----------------------------------------------------------
+    def timed(self, name, fn):
+        if not self.enabled:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            tStart = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.end(name, tStart)
+        wrapper.__name__ = getattr(fn, '__name__', name)
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    #-----------------------------------------------------------
+    # Replace obj.attr (a method of an instance or a function of a
+    # module) with a timed one
+    #-----------------------------------------------------------
+    def instrument(self, obj, attr, name):
+        if self.enabled:
+            setattr(obj, attr, self.timed(name, getattr(obj, attr)))
+
+    #-----------------------------------------------------------
+    # Table of stages by total time: calls, total, mean, longest and
+    # share of the run (spans of nested stages overlap)
+    #-----------------------------------------------------------
+    def summary(self):
+        tRun   = ((self._tStop or time.perf_counter_ns()) - self.tOrigin) / 1e6
+        lines  = ['{:<20} {:>8} {:>11} {:>10} {:>10} {:>7}' .format('stage', 'calls', 'total ms', 'mean ms', 'max ms', '% run')]
+        for name, (nCalls, tTotal, tMax) in sorted(self.stats.items(), key = lambda item: -item[1][1]):
+            lines.append('{:<20} {:>8} {:>11.1f} {:>10.3f} {:>10.3f} {:>6.1f}%' .format(
+                name[:20], nCalls, tTotal / 1e6, tTotal / 1e6 / nCalls, tMax / 1e6, 100.0 * tTotal / 1e6 / max(tRun, 1e-9)))
+        lines.append('run {:.1f} ms' .format(tRun) + ('  ({} spans not in the timeline)' .format(self.nDropped) if self.nDropped else ''))
+        return '\n'.join(lines)
+
+    #-----------------------------------------------------------
+    # Chrome trace events: one complete event ('X') per span in
+    # microseconds from the origin, and a memory counter track
+    #-----------------------------------------------------------
+    def trace(self):
+        nPid   = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': nPid, 'args': {'name': os.path.basename(sys.argv[0]) or 'python'}}]
+        for name, tStart, tSpan, nThread, nBytes in self.events:
+            tUs = (tStart - self.tOrigin) / 1e3
+            events.append({'name': name, 'ph': 'X', 'ts': tUs, 'dur': tSpan / 1e3, 'pid': nPid, 'tid': nThread})
+            if nBytes is not None:
+                events.append({'name': 'traced memory', 'ph': 'C', 'ts': tUs + tSpan / 1e3, 'pid': nPid,
+                               'args': {'MB': nBytes / 2**20}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, fileName):
+        import json
+
+        with open(fileName, 'w') as f:
+            json.dump(self.trace(), f)
+
+    #-----------------------------------------------------------
+    # Print the summary (and cProfile / tracemalloc tops) to 'out'
+    # and write the timeline to fileTrace (None: no file)
+    #-----------------------------------------------------------
+    def report(self, fileTrace = TRACE_FILE, out = None):
+        if not self.enabled:
+            return
+        if self._tStop is None:
+            self.stop()
+        out = sys.stderr if out is None else out
+        print (self.summary(), file = out)
+        if fileTrace is not None:
+            self.write_trace(fileTrace)
+            print ('Timeline written to {} (chrome://tracing or ui.perfetto.dev)' .format(fileTrace), file = out)
+        if self._profile is not None:
+            import pstats
+
+            if fileTrace is not None:
+                self._profile.dump_stats(os.path.splitext(fileTrace)[0] + '.prof')
+            pstats.Stats(self._profile, stream = out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        if self.memory:
+            import tracemalloc
+
+            if tracemalloc.is_tracing():
+                nCurrent, nPeak = tracemalloc.get_traced_memory()
+                print ('traced memory {:.1f} MB, peak {:.1f} MB' .format(nCurrent / 2**20, nPeak / 2**20), file = out)
+                for stat in tracemalloc.take_snapshot().statistics('lineno')[:TOP_FUNCTIONS]:
+                    print (stat, file = out)
+                tracemalloc.stop()
+
+
+NULL_PROFILER = Profiler(enabled = False)
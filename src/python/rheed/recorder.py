@@ -0,0 +1,197 @@
+#---------------------------------------------------------------
+# Append-only .h5 recorder of hls4ml result sets
+#---------------------------------------------------------------
+# Each result set (one read of the result registers, or one set
+# drained from the FPGA) is stored with its timestamp, frame counter
+# and the crop box parameter words active at the time:
+#
+#   timestamp  (N,)                     float64  s since the epoch
+#   frame      (N,)                     int64    frame counter
+#   params     (N, boxes)               uint32   crop box words
+#   results    (N, boxes, NUM_RESULTS)  uint8    hls4ml results
+#
+# Datasets are chunked, compressed and grow along N. Sets are
+# collected in fixed buffers and written one batch at a time, so
+# memory stays flat however long the run is. The file is in SWMR
+# mode: ResultsReader (or any h5py reader with swmr = True) can read
+# it while it is being written. Every batch is flushed, so at most
+# one batch is lost if the program is killed.
+#---------------------------------------------------------------
+import  time
+
+import  numpy as np
+
+from    .crop import NUM_BOXES
+from    .golden import NUM_RESULTS, REGS_PER_CROP, regs_to_results
+
+BATCH_SETS      = 256       # Result sets per write
+CHUNK_SETS      = 4096      # Result sets per h5 chunk
+COMPRESSION     = 'gzip'
+COMPRESSION_OPT = 4
+FLUSH_SECONDS   = 1.0       # Write a part batch after this long
+
+DATASETS        = ['timestamp', 'frame', 'params', 'results']
+
+
+#---------------------------------------------------------------
+# Writer. Use as a context manager or call close().
+#---------------------------------------------------------------
+class ResultsRecorder:
+
+    def __init__(self, fileNameH5, num_boxes = NUM_BOXES, batch = BATCH_SETS, chunk = CHUNK_SETS,
+                 compression = COMPRESSION, compression_opts = COMPRESSION_OPT, flush_seconds = FLUSH_SECONDS, attrs = None):
+        import h5py
+
+        self.fileName       = fileNameH5
+        self.num_boxes      = num_boxes
+        self.batch          = batch
+        self.flush_seconds  = flush_seconds
+        self.nWritten       = 0
+        self.nBuffered      = 0
+        self._tFlush        = time.time()
+
+        nB = num_boxes
+        self._buffers = {'timestamp'    : np.zeros(batch, dtype = np.float64),
+                         'frame'        : np.zeros(batch, dtype = np.int64),
+                         'params'       : np.zeros((batch, nB), dtype = np.uint32),
+                         'results'      : np.zeros((batch, nB, NUM_RESULTS), dtype = np.uint8)}
+
+        # SWMR needs the latest file format; all datasets are created before SWMR starts
+        self.file = h5py.File(fileNameH5, 'w', libver = 'latest')
+        self.file.attrs['num_boxes']    = nB
+        self.file.attrs['num_results']  = NUM_RESULTS
+        self.file.attrs['start_time']   = time.time()
+        for key, value in (attrs or {}).items():
+            self.file.attrs[key] = value
+        self._datasets = {}
+        for name, buf in self._buffers.items():
+            self._datasets[name] = self.file.create_dataset(name, shape = (0,) + buf.shape[1:], maxshape = (None,) + buf.shape[1:],
+                                                            dtype = buf.dtype, chunks = (chunk,) + buf.shape[1:],
+                                                            compression = compression, compression_opts = compression_opts, shuffle = True)
+        self.file.swmr_mode = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.nWritten + self.nBuffered
+
+    #-----------------------------------------------------------
+    # Add one result set.
+    # results   : (boxes, NUM_RESULTS) results
+    # frame     : frame counter
+    # params    : (boxes,) crop box words
+    # timestamp : default now
+    #-----------------------------------------------------------
+    def append(self, results, frame, params, timestamp = None):
+        i = self.nBuffered
+        self._buffers['timestamp'][i]  = time.time() if timestamp is None else timestamp
+        self._buffers['frame'][i]      = frame
+        self._buffers['params'][i]     = params
+        self._buffers['results'][i]    = results
+        self.nBuffered += 1
+        if self.nBuffered == self.batch or time.time() - self._tFlush >= self.flush_seconds:
+            self.flush()
+
+    #-----------------------------------------------------------
+    # Add one set of result registers (boxes, REGS_PER_CROP)
+    #-----------------------------------------------------------
+    def append_registers(self, regs, frame, params, timestamp = None):
+        regs = np.asarray(regs, dtype = np.uint32).reshape(self.num_boxes, REGS_PER_CROP)
+        self.append(regs_to_results(regs), frame, params, timestamp)
+
+    #-----------------------------------------------------------
+    # Add n sets at once: results (n, boxes, NUM_RESULTS),
+    # frames (n,), params (boxes,) or (n, boxes), timestamps (n,)
+    #-----------------------------------------------------------
+    def extend(self, results, frames, params, timestamps = None):
+        results = np.asarray(results)
+        n       = results.shape[0]
+        params  = np.broadcast_to(np.asarray(params, dtype = np.uint32), (n, self.num_boxes))
+        if timestamps is None:
+            timestamps = np.full(n, time.time())
+        i = 0
+        while i < n:
+            nTake = min(n - i, self.batch - self.nBuffered)
+            j     = self.nBuffered
+            self._buffers['timestamp'][j:j + nTake] = timestamps[i:i + nTake]
+            self._buffers['frame'][j:j + nTake]     = frames[i:i + nTake]
+            self._buffers['params'][j:j + nTake]    = params[i:i + nTake]
+            self._buffers['results'][j:j + nTake]   = results[i:i + nTake]
+            self.nBuffered += nTake
+            i += nTake
+            if self.nBuffered == self.batch:
+                self.flush()
+
+    #-----------------------------------------------------------
+    # Write the buffered sets and make them visible to readers
+    #-----------------------------------------------------------
+    def flush(self):
+        self._tFlush = time.time()
+        n = self.nBuffered
+        if n == 0:
+            return
+        for name, ds in self._datasets.items():
+            ds.resize(self.nWritten + n, axis = 0)
+            ds[self.nWritten:self.nWritten + n] = self._buffers[name][:n]
+        for ds in self._datasets.values():
+            ds.flush()
+        self.nWritten  += n
+        self.nBuffered  = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+#---------------------------------------------------------------
+# SWMR reader of a file being recorded. refresh() picks up sets
+# written since the last call.
+#---------------------------------------------------------------
+class ResultsReader:
+
+    def __init__(self, fileNameH5):
+        import h5py
+
+        self.file       = h5py.File(fileNameH5, 'r', libver = 'latest', swmr = True)
+        self.num_boxes  = int(self.file.attrs['num_boxes'])
+        self._datasets  = {name: self.file[name] for name in DATASETS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        # The writer grows the datasets one after the other
+        return min(ds.shape[0] for ds in self._datasets.values())
+
+    def refresh(self):
+        for ds in self._datasets.values():
+            ds.refresh()
+        return len(self)
+
+    #-----------------------------------------------------------
+    # Sets start .. stop-1 as a dict of arrays (DATASETS), cut to
+    # the length all datasets have reached.
+    #-----------------------------------------------------------
+    def read(self, start = 0, stop = None):
+        n    = len(self)
+        stop = n if stop is None else min(stop, n)
+        return {name: ds[start:stop] for name, ds in self._datasets.items()}
+
+    #-----------------------------------------------------------
+    # Sets added since set 'start' (after a refresh), and the new end
+    #-----------------------------------------------------------
+    def read_new(self, start):
+        n = self.refresh()
+        return self.read(start, n), n
+
+    def close(self):
+        self.file.close()
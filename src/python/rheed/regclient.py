@@ -0,0 +1,205 @@
+#---------------------------------------------------------------
+# FPGA register client over the serial line
+#---------------------------------------------------------------
+# Protocol (rhd_cpuint_serial.vhdl), big endian:
+#
+#   write : 'W' address16 data32
+#   read  : 'R' address16 data32 (dummy)  ->  'A' data32
+#
+# Several commands can go in one serial write. read_many() sends all
+# its read commands at once and then collects the replies, so a set
+# of registers costs one round trip instead of one per register.
+#
+# A lock keeps the commands and replies of one call together, so the
+# GUI can read results in its frame grabber thread while it writes
+# boxes from the Tk thread.
+#
+# Only the standard library is used here; pyserial is imported when
+# a port is opened, so recipe scripts pay for neither numpy nor a GUI.
+# Every transaction is a DEBUG event in the event log (rheed.eventlog);
+# a failed read is an ERROR, which dumps the log.
+#---------------------------------------------------------------
+import  threading
+
+from    .crop import NUM_BOXES, pack_xy
+from    .eventlog import LOG
+
+BAUD_RATE           = 115200
+TIMEOUT             = 1.0
+
+# Register map (rhd_fpga_pkg.vhdl)
+ADR_REG_PARAM0      = 0
+ADR_REG_RESULT0     = 16
+ADR_REG_VERSION     = 32
+ADR_REG_LEDS        = 33
+ADR_REG_STATUS      = 34
+NUM_RESULTS         = 5
+BITWIDTH_RESULTS    = 8
+REGS_PER_CROP       = (NUM_RESULTS * BITWIDTH_RESULTS + 31) // 32
+
+READ_DUMMY          = 0xFFFFFFFE    # Data field of a read command
+REPLY_BYTES         = 5             # 'A' + data32
+
+
+#---------------------------------------------------------------
+# One serial message for a list of register writes [(address, word)]
+#---------------------------------------------------------------
+def pack_writes(writes):
+    return b''.join(b'W' + int(address).to_bytes(2, 'big') + int(word).to_bytes(4, 'big') for address, word in writes)
+
+
+def pack_reads(addresses):
+    return b''.join(b'R' + int(address).to_bytes(2, 'big') + READ_DUMMY.to_bytes(4, 'big') for address in addresses)
+
+
+#---------------------------------------------------------------
+# Result register words of one box -> NUM_RESULTS 8-bit results
+# (result0 in bits 7:0 of the first word)
+#---------------------------------------------------------------
+def unpack_results(words):
+    value = 0
+    for i, word in enumerate(words):
+        value |= (int(word) & 0xFFFFFFFF) << (32 * i)
+    mask  = (1 << BITWIDTH_RESULTS) - 1
+    return [(value >> (i * BITWIDTH_RESULTS)) & mask for i in range(NUM_RESULTS)]
+
+
+#---------------------------------------------------------------
+# Names of the serial ports on this machine
+#---------------------------------------------------------------
+def list_ports():
+    import serial.tools.list_ports
+
+    return [port.device for port in serial.tools.list_ports.comports()]
+
+
+#---------------------------------------------------------------
+# Register access to the FPGA. Use as a context manager or call
+# close(). An already open serial object can be passed as 'ser'.
+#---------------------------------------------------------------
+class RegisterClient:
+
+    #-----------------------------------------------------------
+    # port : serial port name, default the first one found
+    #-----------------------------------------------------------
+    def __init__(self, port = None, baud = BAUD_RATE, timeout = TIMEOUT, ser = None):
+        if ser is None:
+            import serial
+
+            if port is None:
+                ports = list_ports()
+                if not ports:
+                    raise OSError('No serial ports found')
+                port = ports[0]
+            ser = serial.Serial(port = port, baudrate = baud, parity = serial.PARITY_NONE, stopbits = serial.STOPBITS_ONE,
+                                bytesize = serial.EIGHTBITS, timeout = timeout)
+        self.ser   = ser
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def name(self):
+        return self.ser.name
+
+    def write(self, address, word):
+        with self._lock:
+            self.ser.write(pack_writes([(address, word)]))
+        LOG.debug('reg write', 'addr 0x{:04X} data 0x{:08X}', address, word)
+
+    #-----------------------------------------------------------
+    # Several writes [(address, word)] in one serial message
+    #-----------------------------------------------------------
+    def write_many(self, writes):
+        writes  = list(writes)
+        message = pack_writes(writes)
+        if message:
+            with self._lock:
+                self.ser.write(message)
+            LOG.debug('reg write', '{} registers from 0x{:04X}: {}', len(writes), writes[0][0], writes)
+
+    def read(self, address):
+        return self.read_many([address])[0]
+
+    #-----------------------------------------------------------
+    # Read registers with all commands sent at once. Returns ints.
+    #-----------------------------------------------------------
+    def read_many(self, addresses):
+        addresses = list(addresses)
+        if not addresses:
+            return []
+        nBytes = REPLY_BYTES * len(addresses)
+        with self._lock:
+            self.ser.write(pack_reads(addresses))
+            reply = self.ser.read(nBytes)
+        if len(reply) != nBytes:
+            LOG.error('reg read', '{} registers from 0x{:04X}: {} of {} bytes', len(addresses), addresses[0], len(reply), nBytes)
+            raise OSError('Register read timed out: {} of {} bytes' .format(len(reply), nBytes))
+        values = []
+        for i in range(0, nBytes, REPLY_BYTES):
+            if reply[i:i + 1] != b'A':
+                LOG.error('reg read', 'bad reply {!r} for 0x{:04X}', reply[i:i + REPLY_BYTES], addresses[i // REPLY_BYTES])
+                raise OSError('Bad register read reply {!r}' .format(reply[i:i + REPLY_BYTES]))
+            values.append(int.from_bytes(reply[i + 1:i + REPLY_BYTES], 'big'))
+        LOG.debug('reg read', '{} registers from 0x{:04X}: {}', len(addresses), addresses[0], values)
+        return values
+
+    #-----------------------------------------------------------
+    # Download crop box words. The parameter registers are written
+    # in order, so the last one (which sets parameters_dv) comes last.
+    #-----------------------------------------------------------
+    def write_boxes(self, words):
+        self.write_many([(ADR_REG_PARAM0 + i, word) for i, word in enumerate(words)])
+
+    #-----------------------------------------------------------
+    # Download boxes by upper left corner [(x0, y0), ...]. Missing
+    # boxes are set to (0, 0).
+    #-----------------------------------------------------------
+    def write_corners(self, corners, num_boxes = NUM_BOXES):
+        words = [pack_xy(x0, y0) for x0, y0 in corners]
+        self.write_boxes(words + [0] * (num_boxes - len(words)))
+
+    def read_boxes(self, num_boxes = NUM_BOXES):
+        return self.read_many(range(ADR_REG_PARAM0, ADR_REG_PARAM0 + num_boxes))
+
+    #-----------------------------------------------------------
+    # Result register words of all boxes [[word, ...], ...]
+    #-----------------------------------------------------------
+    def read_result_registers(self, num_boxes = NUM_BOXES):
+        words = self.read_many(range(ADR_REG_RESULT0, ADR_REG_RESULT0 + num_boxes * REGS_PER_CROP))
+        return [words[i:i + REGS_PER_CROP] for i in range(0, len(words), REGS_PER_CROP)]
+
+    #-----------------------------------------------------------
+    # Decoded results [[r0 .. r4], ...] of all boxes
+    #-----------------------------------------------------------
+    def read_results(self, num_boxes = NUM_BOXES):
+        return [unpack_results(words) for words in self.read_result_registers(num_boxes)]
+
+    #-----------------------------------------------------------
+    # Crop box words and result register words of all boxes in one
+    # round trip, so the results come with the boxes they were
+    # computed for: ([word, ...], [[word, ...], ...])
+    #-----------------------------------------------------------
+    def read_snapshot(self, num_boxes = NUM_BOXES):
+        nResultRegs = num_boxes * REGS_PER_CROP
+        words = self.read_many(list(range(ADR_REG_PARAM0, ADR_REG_PARAM0 + num_boxes)) +
+                               list(range(ADR_REG_RESULT0, ADR_REG_RESULT0 + nResultRegs)))
+        return words[:num_boxes], [words[num_boxes + i:num_boxes + i + REGS_PER_CROP] for i in range(0, nResultRegs, REGS_PER_CROP)]
+
+    def version(self):
+        return self.read(ADR_REG_VERSION)
+
+    def status(self):
+        return self.read(ADR_REG_STATUS)
+
+    def set_leds(self, value):
+        self.write(ADR_REG_LEDS, value)
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
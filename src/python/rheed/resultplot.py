@@ -0,0 +1,210 @@
+#---------------------------------------------------------------
+# Live plot of the result channels of every crop box
+#---------------------------------------------------------------
+# ResultHistory takes the results of each frame into a preallocated
+# ring (one row copy per frame). At each plot refresh the new rows
+# are folded into a min/max decimation of the whole run:
+#
+#   - The run is kept as 'columns' min/max columns of 'span' frames
+#     each (plus the column being filled). When all columns are used,
+#     neighbouring columns are merged and span doubles, so hours of
+#     results take the same memory and the same number of points.
+#   - Each column is drawn as a vertical segment from its min to its
+#     max, so short spikes stay visible however far it is decimated.
+#
+# ResultPlot draws one strip per box with one line per result channel
+# on a Tk canvas. Its items are created once; an update only moves
+# their points (canvas.coords), and only when new frames came in.
+# The cost of an update depends on the number of columns, not on the
+# length of the run.
+#---------------------------------------------------------------
+import  numpy as np
+
+from    .crop import NUM_BOXES
+from    .golden import NUM_RESULTS
+
+RING_FRAMES     = 4096          # Results kept between plot refreshes
+PLOT_COLUMNS    = 300           # Min/max columns across the plot
+REFRESH_MS      = 250           # Plot refresh period
+STRIP_HEIGHT    = 80            # Canvas pixels per box
+CHANNEL_COLOURS = ['red', 'green', 'blue', 'orange', 'magenta']
+
+
+#---------------------------------------------------------------
+# Results ring and min/max decimation of the whole run
+#---------------------------------------------------------------
+class ResultHistory:
+
+    def __init__(self, num_boxes = NUM_BOXES, num_results = NUM_RESULTS, ring = RING_FRAMES, columns = PLOT_COLUMNS, dtype = np.uint8):
+        self.num_boxes  = num_boxes
+        self.num_results = num_results
+        self.columns    = columns - columns % 2                 # Even, so columns merge in pairs
+        self.values     = np.zeros((ring, num_boxes, num_results), dtype = dtype)
+        self.frames     = np.zeros(ring, dtype = np.int64)
+        self.lo         = np.zeros((self.columns, num_boxes, num_results), dtype = dtype)
+        self.hi         = np.zeros((self.columns, num_boxes, num_results), dtype = dtype)
+        self._partLo    = np.zeros((num_boxes, num_results), dtype = dtype)
+        self._partHi    = np.zeros((num_boxes, num_results), dtype = dtype)
+        self.reset()
+
+    def reset(self):
+        self.nPushed    = 0             # Frames pushed into the ring
+        self.nFolded    = 0             # Frames folded into the decimation
+        self.nLost      = 0             # Frames overwritten before they were folded
+        self.nColumns   = 0             # Complete columns
+        self.span       = 1             # Frames per column
+        self._nPart     = 0             # Frames in the column being filled
+        self.firstFrame = None
+        self.lastFrame  = None
+
+    #-----------------------------------------------------------
+    # Results (num_boxes, num_results) of frame nFrame. Rows of
+    # boxes not given (fewer boxes) are left at 0.
+    #-----------------------------------------------------------
+    def push(self, nFrame, results):
+        i = self.nPushed % self.values.shape[0]
+        results = np.asarray(results)
+        self.values[i, :results.shape[0]] = results
+        self.values[i, results.shape[0]:] = 0
+        self.frames[i] = nFrame
+        self.nPushed  += 1
+
+    #-----------------------------------------------------------
+    # Fold the frames pushed since the last call into the columns.
+    # Returns the number of frames folded.
+    #-----------------------------------------------------------
+    def fold(self):
+        nRing  = self.values.shape[0]
+        nStart = max(self.nFolded, self.nPushed - nRing)
+        self.nLost += nStart - self.nFolded
+        nNew   = self.nPushed - nStart
+        if nNew <= 0:
+            return 0
+        if self.firstFrame is None:
+            self.firstFrame = int(self.frames[nStart % nRing])
+        index  = np.arange(nStart, self.nPushed) % nRing
+        block  = self.values[index]
+        i      = 0
+        while i < nNew:
+            nTake = min(self.span - self._nPart, nNew - i)
+            chunk = block[i:i + nTake]
+            if self._nPart == 0:
+                chunk.min(axis = 0, out = self._partLo)
+                chunk.max(axis = 0, out = self._partHi)
+            else:
+                np.minimum(self._partLo, chunk.min(axis = 0), out = self._partLo)
+                np.maximum(self._partHi, chunk.max(axis = 0), out = self._partHi)
+            self._nPart += nTake
+            i           += nTake
+            if self._nPart == self.span:
+                self._commit()
+        self.lastFrame = int(self.frames[(self.nPushed - 1) % nRing])
+        self.nFolded   = self.nPushed
+        return nNew
+
+    def _commit(self):
+        self.lo[self.nColumns] = self._partLo
+        self.hi[self.nColumns] = self._partHi
+        self.nColumns += 1
+        self._nPart    = 0
+        if self.nColumns == self.columns:
+            nHalf = self.columns // 2
+            self.lo[:nHalf] = np.minimum(self.lo[0::2], self.lo[1::2])
+            self.hi[:nHalf] = np.maximum(self.hi[0::2], self.hi[1::2])
+            self.nColumns   = nHalf
+            self.span      *= 2
+
+    #-----------------------------------------------------------
+    # (lo, hi) arrays (n, num_boxes, num_results) of the complete
+    # columns and the one being filled, oldest first
+    #-----------------------------------------------------------
+    def decimated(self):
+        if self._nPart == 0:
+            return self.lo[:self.nColumns], self.hi[:self.nColumns]
+        return (np.concatenate([self.lo[:self.nColumns], self._partLo[None]]),
+                np.concatenate([self.hi[:self.nColumns], self._partHi[None]]))
+
+    #-----------------------------------------------------------
+    # Results of the latest frame in the ring, or None
+    #-----------------------------------------------------------
+    def latest(self):
+        if self.nPushed == 0:
+            return None
+        return self.values[(self.nPushed - 1) % self.values.shape[0]]
+
+
+#---------------------------------------------------------------
+# Strips of result traces on a Tk canvas
+#---------------------------------------------------------------
+class ResultPlot:
+
+    #-----------------------------------------------------------
+    # canvas  : Tk canvas; the plot fills its width
+    # history : ResultHistory
+    # vmax    : value at the top of a strip (8-bit results: 255)
+    #-----------------------------------------------------------
+    def __init__(self, canvas, history, strip_height = STRIP_HEIGHT, vmax = 255, colours = CHANNEL_COLOURS, margin = 60):
+        self.canvas     = canvas
+        self.history    = history
+        self.strip_height = strip_height
+        self.vmax       = vmax
+        self.margin     = margin                        # Left margin for the box labels
+        self.nDrawn     = -1                            # history.nFolded at the last redraw
+        self.width      = None
+        nB, nR          = history.num_boxes, history.num_results
+        self.strips     = []
+        self.lines      = []
+        self.labels     = []
+        for nBox in range(nB):
+            top = nBox * strip_height
+            self.strips.append(canvas.create_rectangle(0, 0, 0, 0, outline = 'grey'))
+            canvas.create_text(4, top + 4, text = 'box {}' .format(nBox), anchor = 'nw')
+            self.labels.append(canvas.create_text(4, top + 20, text = '', anchor = 'nw', font = ('TkFixedFont', 7)))
+            self.lines.append([canvas.create_line(0, 0, 0, 0, fill = colours[nRes % len(colours)], state = 'hidden')
+                               for nRes in range(nR)])
+        self.axis = canvas.create_text(0, nB * strip_height + 2, text = '', anchor = 'n')
+        canvas.config(height = nB * strip_height + 20)
+
+    #-----------------------------------------------------------
+    # Fold new results and move the line points. Nothing is redrawn
+    # if no frame came in and the canvas size did not change.
+    #-----------------------------------------------------------
+    def update(self):
+        self.history.fold()
+        width = max(self.canvas.winfo_width(), self.margin + 10)
+        if self.history.nFolded == self.nDrawn and width == self.width:
+            return False
+        if width != self.width:
+            self.width = width
+            for nBox, strip in enumerate(self.strips):
+                top = nBox * self.strip_height
+                self.canvas.coords(strip, self.margin, top + 2, width - 2, top + self.strip_height - 2)
+            self.canvas.coords(self.axis, (self.margin + width) / 2, len(self.strips) * self.strip_height + 2)
+        self.nDrawn = self.history.nFolded
+
+        lo, hi = self.history.decimated()
+        nCols  = lo.shape[0]
+        if nCols == 0:
+            return True
+        # Column c is drawn from (x, max) to (x, min): 2 points per column
+        x      = self.margin + 2 + (width - self.margin - 6) * (np.arange(nCols) + 0.5) / nCols
+        xy     = np.empty((nCols, 2, 2))
+        xy[:, :, 0] = x[:, None]
+        scale  = (self.strip_height - 6) / float(self.vmax)
+        for nBox, lines in enumerate(self.lines):
+            bottom = (nBox + 1) * self.strip_height - 3
+            for nRes, item in enumerate(lines):
+                xy[:, 0, 1] = bottom - hi[:, nBox, nRes] * scale
+                xy[:, 1, 1] = bottom - lo[:, nBox, nRes] * scale
+                points = xy.ravel().tolist()
+                if nCols == 1:
+                    points += points[-2:]
+                self.canvas.coords(item, points)
+                self.canvas.itemconfig(item, state = 'normal')
+        latest = self.history.latest()
+        for nBox, label in enumerate(self.labels):
+            self.canvas.itemconfig(label, text = '\n'.join(str(int(v)) for v in latest[nBox]))
+        self.canvas.itemconfig(self.axis, text = 'frames {} .. {}   {} per column{}' .format(
+            self.history.firstFrame, self.history.lastFrame, self.history.span,
+            '   {} not plotted' .format(self.history.nLost) if self.history.nLost else ''))
+        return True
@@ -0,0 +1,186 @@
+#---------------------------------------------------------------
+# Multi-ROI statistics from integral images (summed-area tables)
+#---------------------------------------------------------------
+# The integral image S of a frame I has one extra row and column
+# of zeros at the top and left:
+#   S[y, x] = sum of I[0:y, 0:x]
+# so the sum over any box [x0, x0+w) x [y0, y0+h) is four lookups:
+#   S[y0+h, x0+w] - S[y0, x0+w] - S[y0+h, x0] + S[y0, x0]
+# An integral image of I*I gives the variance the same way.
+#
+# Boxes are given either as crop box register words (x << 16 | y,
+# as written by set_xy) with a common box size, or as arrays of
+# x0, y0, width, height. Thousands of boxes over a stack of frames
+# are a single fancy-indexing gather per corner, no Python loop.
+#
+# Integer frames are summed in int64, so sums are exact.
+#---------------------------------------------------------------
+import  numpy as np
+
+from    .crop import BOX_COLS, BOX_ROWS
+
+ROI_DTYPE       = np.dtype([('sum', 'f8'), ('mean', 'f8'), ('var', 'f8')])
+
+CHUNK_FRAMES    = 256       # Frames per integral image batch
+
+
+#---------------------------------------------------------------
+# Split an array of parameter register words into x0 and y0 arrays
+#---------------------------------------------------------------
+def unpack_words(words):
+    words = np.asarray(words, dtype = np.int64)
+    return (words >> 16) & 0xFFFF, words & 0xFFFF
+
+
+#---------------------------------------------------------------
+# Integral images of frames (F, H, W) or one frame (H, W).
+# Returns (F, H+1, W+1) [or (H+1, W+1)]. With squares = True the
+# integral image of the squared frames is returned as well.
+# 'out' / 'out_sq' may be passed to reuse buffers.
+#---------------------------------------------------------------
+def integral_images(frames, squares = False, out = None, out_sq = None):
+    frames = np.asarray(frames)
+    acc    = _acc_dtype(frames.dtype)
+    sat    = _integral(frames, acc, out)
+    if not squares:
+        return sat
+    sq     = frames.astype(acc)
+    sq    *= sq
+    return sat, _integral(sq, acc, out_sq)
+
+
+def _acc_dtype(dtype):
+    return np.int64 if np.issubdtype(dtype, np.integer) or dtype == bool else np.float64
+
+
+def _integral(frames, acc, out):
+    shape = frames.shape[:-2] + (frames.shape[-2] + 1, frames.shape[-1] + 1)
+    if out is None:
+        out = np.empty(shape, dtype = acc)
+    out[..., 0, :] = 0
+    out[..., :, 0] = 0
+    np.cumsum(frames, axis = -2, dtype = acc, out = out[..., 1:, 1:])
+    np.cumsum(out[..., 1:, 1:], axis = -1, out = out[..., 1:, 1:])
+    return out
+
+
+#---------------------------------------------------------------
+# Box sums from integral images.
+# sat : (F, H+1, W+1) or (H+1, W+1)
+# x0, y0, width, height : arrays of N boxes (broadcast)
+# Returns (F, N) [or (N,)].
+#---------------------------------------------------------------
+def box_sums(sat, x0, y0, width, height):
+    x0 = np.asarray(x0, dtype = np.intp)
+    y0 = np.asarray(y0, dtype = np.intp)
+    x1 = x0 + np.asarray(width, dtype = np.intp)
+    y1 = y0 + np.asarray(height, dtype = np.intp)
+    return sat[..., y1, x1] - sat[..., y0, x1] - sat[..., y1, x0] + sat[..., y0, x0]
+
+
+#---------------------------------------------------------------
+# Sum of every w x h box placement in each frame.
+# Returns (F, H-h+1, W-w+1): element [f, y, x] is the sum of the box
+# with upper left corner (x, y). Used for best placement searches.
+#---------------------------------------------------------------
+def box_sum_map(sat, width = BOX_COLS, height = BOX_ROWS):
+    return sat[..., height:, width:] - sat[..., :-height, width:] - sat[..., height:, :-width] + sat[..., :-height, :-width]
+
+
+#---------------------------------------------------------------
+# Sum, mean and variance of a fixed set of boxes over frame stacks
+#---------------------------------------------------------------
+class RoiStats:
+
+    #-----------------------------------------------------------
+    # Boxes from register words with a common size, or from arrays
+    # x0, y0 with width/height scalars or arrays.
+    #-----------------------------------------------------------
+    def __init__(self, x0, y0, width = BOX_COLS, height = BOX_ROWS):
+        self.x0     = np.atleast_1d(np.asarray(x0, dtype = np.intp))
+        self.y0     = np.atleast_1d(np.asarray(y0, dtype = np.intp))
+        self.width  = np.broadcast_to(np.asarray(width, dtype = np.intp), self.x0.shape)
+        self.height = np.broadcast_to(np.asarray(height, dtype = np.intp), self.x0.shape)
+        self.area   = (self.width * self.height).astype(np.float64)
+        self._sat   = None
+        self._sq    = None
+
+    @classmethod
+    def from_words(cls, words, box_cols = BOX_COLS, box_rows = BOX_ROWS):
+        x0, y0 = unpack_words(words)
+        return cls(x0, y0, box_cols, box_rows)
+
+    def __len__(self):
+        return self.x0.size
+
+    #-----------------------------------------------------------
+    # Raise ValueError if a box does not fit in a rows x cols frame
+    #-----------------------------------------------------------
+    def check(self, rows, cols):
+        bad = (self.x0 < 0) | (self.y0 < 0) | (self.x0 + self.width > cols) | (self.y0 + self.height > rows)
+        if np.any(bad):
+            i = int(np.argmax(bad))
+            raise ValueError('Box %d (%d, %d, %dx%d) is outside the %dx%d frame' %
+                             (i, self.x0[i], self.y0[i], self.width[i], self.height[i], cols, rows))
+
+    #-----------------------------------------------------------
+    # Statistics of every box in every frame.
+    # frames : (F, H, W) array, FrameStack or h5 dataset, or (H, W)
+    # Returns ROI_DTYPE (F, N) [or (N,)].
+    #-----------------------------------------------------------
+    def compute(self, frames, chunk = CHUNK_FRAMES):
+        if not hasattr(frames, 'shape'):
+            frames = np.asarray(frames)
+        # FrameStack has no ndim and its shape is the frame shape
+        if getattr(frames, 'ndim', None) == 2:
+            return self.compute(np.asarray(frames)[None], chunk)[0]
+        nFrames = len(frames)
+        self.check(*frames.shape[-2:])
+        out = np.empty((nFrames, len(self)), dtype = ROI_DTYPE)
+        for i in range(0, nFrames, chunk):
+            block = np.asarray(frames[i:i + chunk])
+            self._compute_block(block, out[i:i + block.shape[0]])
+        return out
+
+    def _compute_block(self, block, out):
+        # Integral image buffers are kept and reused while the block shape stays the same
+        shape = (block.shape[0], block.shape[1] + 1, block.shape[2] + 1)
+        acc   = _acc_dtype(block.dtype)
+        if self._sat is None or self._sat.shape != shape or self._sat.dtype != acc:
+            self._sat = np.empty(shape, dtype = acc)
+            self._sq  = np.empty(shape, dtype = acc)
+        sat, sq = integral_images(block, True, self._sat, self._sq)
+
+        s  = box_sums(sat, self.x0, self.y0, self.width, self.height).astype(np.float64)
+        s2 = box_sums(sq, self.x0, self.y0, self.width, self.height).astype(np.float64)
+        out['sum']  = s
+        out['mean'] = s / self.area
+        out['var']  = np.maximum(s2 / self.area - out['mean'] ** 2, 0.0)
+
+    #-----------------------------------------------------------
+    # Intensity traces: mean of each box over the frames, (F, N)
+    #-----------------------------------------------------------
+    def traces(self, frames, chunk = CHUNK_FRAMES):
+        return self.compute(frames, chunk)['mean']
+
+
+#---------------------------------------------------------------
+# Best placement of a box_cols x box_rows box: the corner with the
+# largest total intensity over the frames, optionally searched only
+# within 'radius' pixels of (x0, y0).
+# Returns (x0, y0, sum).
+#---------------------------------------------------------------
+def best_box(frames, box_cols = BOX_COLS, box_rows = BOX_ROWS, near = None, radius = None):
+    frames = np.asarray(frames)
+    if frames.ndim == 2:
+        frames = frames[None]
+    total  = box_sum_map(integral_images(frames), box_cols, box_rows).sum(axis = 0)
+    yLo, xLo = 0, 0
+    if near is not None and radius is not None:
+        xLo = max(0, int(near[0]) - radius)
+        yLo = max(0, int(near[1]) - radius)
+        total = total[yLo:int(near[1]) + radius + 1, xLo:int(near[0]) + radius + 1]
+    if total.size == 0:
+        raise ValueError('No %dx%d box placement in the search area' % (box_cols, box_rows))
+    y, x = np.unravel_index(np.argmax(total), total.shape)
+    return xLo + int(x), yLo + int(y), total[y, x].item()
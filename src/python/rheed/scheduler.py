@@ -0,0 +1,187 @@
+#---------------------------------------------------------------
+# Time-multiplexed crop box scheduler
+#---------------------------------------------------------------
+# The FPGA crops NUM_BOXES boxes per frame. To watch more regions
+# than that (a full tiling of the frame, dozens of spots) the
+# scheduler rotates the regions through the box slots frame by
+# frame, trading time resolution for coverage.
+#
+#   - Each region has a priority and optionally a revisit limit
+#     (frames). Regions past their revisit limit go first, most
+#     overdue first; the other slots go by stride scheduling: a
+#     region's pass value grows by 1 / priority each visit and the
+#     smallest pass values are taken, so visit rates follow the
+#     priorities.
+#   - A region that stays scheduled keeps its slot, and free slots
+#     keep their old word, so only the slots that change are
+#     written. next_frame() returns these writes (changed registers
+#     plus the last one, tracking.changed_writes); the caller sends
+#     them in one serial message (RegisterClient.write_many).
+#   - Parameters written for frame n are taken by the FPGA 'latency'
+#     frames later. tag() pairs the results of a frame with the
+#     regions that were in the slots for that frame and keeps the
+#     latest results and frame of every region.
+#   - tag_words() does the same from the crop box words read back
+#     with the results (RegisterClient.read_snapshot): each slot goes
+#     to the region whose word it holds, so it needs no frame count.
+#---------------------------------------------------------------
+import  numpy as np
+
+from    .crop import NUM_BOXES, IN_COLS, IN_ROWS, BOX_COLS, BOX_ROWS, pack_xy, box_at, clamp_box
+from    .golden import NUM_RESULTS
+from    .tracking import changed_writes
+
+LATENCY_FRAMES  = 1         # Frames from a parameter write to results with the new boxes
+HISTORY_FRAMES  = 64        # Slot assignments kept for tag()
+
+
+#---------------------------------------------------------------
+# Upper left corners of boxes tiling a frame. Tiles overlap so the
+# last row and column end at the frame edge.
+#---------------------------------------------------------------
+def tile_regions(image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS, overlap = 0):
+    def starts(size, box):
+        step = max(1, box - overlap)
+        n    = max(1, int(np.ceil((size - box) / step)) + 1)
+        return np.unique(np.clip(np.arange(n) * step, 0, max(size - box, 0)))
+    return [(int(x0), int(y0)) for y0 in starts(image_rows, box_rows) for x0 in starts(image_cols, box_cols)]
+
+
+#---------------------------------------------------------------
+# Boxes centred on spots (structured array with 'x', 'y' or (N, 2))
+#---------------------------------------------------------------
+def spot_regions(spots, image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS):
+    if getattr(spots, 'dtype', None) is not None and spots.dtype.names:
+        xy = zip(spots['x'], spots['y'])
+    else:
+        xy = np.asarray(spots, dtype = np.float64).reshape(-1, 2)
+    return [box_at(x, y, image_cols, image_rows, box_cols, box_rows) for x, y in xy]
+
+
+#---------------------------------------------------------------
+# Rotates regions through the crop box slots
+#---------------------------------------------------------------
+class CropScheduler:
+
+    #-----------------------------------------------------------
+    # regions  : upper left corners [(x0, y0), ...]
+    # priority : per region weight (default 1); visit rate follows it
+    # revisit  : per region largest gap between visits in frames
+    #            (None or 0: no limit)
+    # words    : crop box words now in the FPGA (default all 0)
+    #-----------------------------------------------------------
+    def __init__(self, regions, priority = None, revisit = None, num_slots = NUM_BOXES, words = None, latency = LATENCY_FRAMES,
+                 image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS):
+        self.num_slots  = num_slots
+        self.latency    = latency
+        self.regions    = [clamp_box(int(x0), int(y0), image_cols, image_rows, box_cols, box_rows) for x0, y0 in regions]
+        nRegions        = len(self.regions)
+        if nRegions == 0:
+            raise ValueError('No regions to schedule')
+        self.region_words = np.array([pack_xy(x0, y0) for x0, y0 in self.regions], dtype = np.uint32)
+        self._wordRegions = {}                                  # Word -> regions with that box
+        for r, word in enumerate(self.region_words):
+            self._wordRegions.setdefault(int(word), []).append(r)
+        self.priority   = np.broadcast_to(np.asarray(1.0 if priority is None else priority, dtype = np.float64), (nRegions,)).copy()
+        if np.any(self.priority <= 0):
+            raise ValueError('Region priorities must be > 0')
+        revisit         = np.broadcast_to(np.asarray(0 if revisit is None else revisit, dtype = np.float64), (nRegions,))
+        self.revisit    = np.where(revisit > 0, revisit, np.inf)
+        self.reset(words)
+
+    def reset(self, words = None):
+        nRegions        = len(self.regions)
+        self.words      = [0] * self.num_slots if words is None else [int(w) for w in words]
+        self.slots      = [-1] * self.num_slots                 # Region in each slot, -1 if none
+        self.nFrame     = 0                                     # Frames scheduled
+        self.passes     = np.zeros(nRegions)
+        self.lastVisit  = np.full(nRegions, -np.inf)            # Frame a region was last scheduled
+        self.nVisits    = np.zeros(nRegions, dtype = np.int64)
+        self.latest     = np.zeros((nRegions, NUM_RESULTS), dtype = np.uint8)
+        self.latestFrame = np.full(nRegions, -1, dtype = np.int64)
+        self.nWrites    = 0
+        self._history   = {}
+
+    #-----------------------------------------------------------
+    # Regions for the next frame, in no particular slot order
+    #-----------------------------------------------------------
+    def _choose(self):
+        nRegions = len(self.regions)
+        if nRegions <= self.num_slots:
+            return list(range(nRegions))
+        age      = self.nFrame - self.lastVisit
+        overdue  = age >= self.revisit
+        current  = np.zeros(nRegions, dtype = bool)
+        current[[r for r in self.slots if r >= 0]] = True
+        # Overdue first (oldest first), then lowest pass, then already in a slot, then index
+        order    = np.lexsort((np.arange(nRegions), ~current, self.passes, np.where(overdue, -age, 0), ~overdue))
+        return order[:self.num_slots].tolist()
+
+    #-----------------------------------------------------------
+    # Schedule the next frame. Returns the register writes
+    # [(address, word)] that set it up (empty if nothing changes).
+    #-----------------------------------------------------------
+    def next_frame(self):
+        chosen  = self._choose()
+        keep    = set(chosen)
+        slots   = [r if r in keep else -1 for r in self.slots]
+        free    = [nSlot for nSlot, r in enumerate(slots) if r < 0]
+        for r in chosen:
+            if r not in slots:
+                slots[free.pop(0)] = r
+
+        words   = [int(self.region_words[r]) if r >= 0 else self.words[nSlot] for nSlot, r in enumerate(slots)]
+        writes  = changed_writes(self.words, words)
+        self.words   = words
+        self.slots   = slots
+        self.passes[chosen]    += 1.0 / self.priority[chosen]
+        self.lastVisit[chosen]  = self.nFrame
+        self.nVisits[chosen]   += 1
+        self._history[self.nFrame + self.latency] = list(slots)
+        self._history.pop(self.nFrame + self.latency - HISTORY_FRAMES, None)
+        self.nFrame  += 1
+        self.nWrites += len(writes)
+        return writes
+
+    #-----------------------------------------------------------
+    # Region in each slot for frame nFrame (counted in next_frame()
+    # calls), or None if not known
+    #-----------------------------------------------------------
+    def slots_for(self, nFrame):
+        return self._history.get(nFrame)
+
+    #-----------------------------------------------------------
+    # Results (slots, NUM_RESULTS) of frame nFrame. Returns
+    # [(region, results), ...] for the slots holding a region.
+    #-----------------------------------------------------------
+    def tag(self, nFrame, results):
+        slots = self.slots_for(nFrame)
+        if slots is None:
+            return []
+        tagged = [(r, results[nSlot]) for nSlot, r in enumerate(slots) if r >= 0]
+        for r, res in tagged:
+            if nFrame >= self.latestFrame[r]:
+                self.latest[r]      = res
+                self.latestFrame[r] = nFrame
+        return tagged
+
+    #-----------------------------------------------------------
+    # Results (slots, NUM_RESULTS) computed with the crop box words
+    # 'words' in the slots. Slots holding no region's box are
+    # skipped. nFrame orders the latest results of each region.
+    # Returns [(region, results), ...].
+    #-----------------------------------------------------------
+    def tag_words(self, words, results, nFrame):
+        tagged = [(r, results[nSlot]) for nSlot, word in enumerate(words) for r in self._wordRegions.get(int(word), [])]
+        for r, res in tagged:
+            if nFrame >= self.latestFrame[r]:
+                self.latest[r]      = res
+                self.latestFrame[r] = nFrame
+        return tagged
+
+    #-----------------------------------------------------------
+    # Frames between visits of each region so far
+    #-----------------------------------------------------------
+    @property
+    def visit_period(self):
+        return self.nFrame / np.maximum(self.nVisits, 1)
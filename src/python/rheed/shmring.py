@@ -0,0 +1,333 @@
+#---------------------------------------------------------------
+# Shared-memory frame ring between processes
+#---------------------------------------------------------------
+# One process acquires (or replays) frames into a ring of fixed
+# size frame slots in a multiprocessing SharedMemory block. Any
+# number of other processes (detection, tracking, recording,
+# display) attach by name and read the frames in place, without
+# copying pixels and without the GIL of the acquiring process.
+#
+# Block layout, all little endian:
+#
+#   header  HEADER_WORDS int64   magic, slots, rows, cols, num_boxes,
+#                                write sequence, closed flag, dtype
+#   meta    (slots,) META_DTYPE  seq, frame counter, time, box words
+#   frames  (slots, rows, cols)  frame dtype, 64-byte aligned
+#
+# There is one producer, so no locks are needed. Frame n goes to
+# slot n % slots. The producer marks the slot's meta seq -1, fills
+# the slot, sets meta seq = n and then bumps the header write
+# sequence to n + 1. A reader that took frame n from a slot calls
+# valid(n) when it is done with it: if the slot seq is no longer n
+# the producer has lapped the reader and the data may be torn. This
+# relies on aligned 8-byte stores being seen in program order by
+# other cores, as on x86.
+#
+# Readers keep their own position. A reader that falls more than
+# 'slots' frames behind skips to the oldest frame still in the
+# ring and counts the frames it lost (nDropped).
+#---------------------------------------------------------------
+import  time
+
+import  numpy as np
+
+from    .crop import NUM_BOXES
+
+SLOTS           = 64        # Frames in the ring
+POLL_SECONDS    = 0.0005    # Reader wait between checks for a new frame
+MAGIC           = 0x52484545_44524e47   # 'RHEEDRNG'
+HEADER_WORDS    = 8
+ALIGN           = 64
+
+# Header words
+H_MAGIC, H_SLOTS, H_ROWS, H_COLS, H_BOXES, H_WRITE, H_CLOSED, H_DTYPE = range(HEADER_WORDS)
+
+
+#---------------------------------------------------------------
+# Per slot metadata
+#---------------------------------------------------------------
+def meta_dtype(num_boxes = NUM_BOXES):
+    return np.dtype([('seq', '<i8'), ('counter', '<i8'), ('timestamp', '<f8'), ('params', '<u4', (num_boxes,))], align = True)
+
+
+def _aligned(nBytes):
+    return (nBytes + ALIGN - 1) // ALIGN * ALIGN
+
+
+#---------------------------------------------------------------
+# Attach to an existing block without registering it with the
+# resource tracker, which would unlink it when this process exits.
+# Unregistering afterwards is not enough: a spawned child shares
+# its parent's tracker and would drop the creator's registration.
+#---------------------------------------------------------------
+def _attach(name):
+    from multiprocessing import shared_memory, resource_tracker
+
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)   # Python 3.13+
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name = name)
+    finally:
+        resource_tracker.register = register
+
+
+#---------------------------------------------------------------
+# The ring. Create it in the producer (FrameRing.create) and attach
+# to it by name in the readers (FrameRing.attach).
+#---------------------------------------------------------------
+class FrameRing:
+
+    def __init__(self, shm, owner):
+        self.shm        = shm
+        self.owner      = owner
+        self.header     = np.ndarray(HEADER_WORDS, dtype = '<i8', buffer = shm.buf)
+        if self.header[H_MAGIC] != MAGIC:
+            raise ValueError('Shared memory "{}" is not a frame ring' .format(shm.name))
+        self.slots      = int(self.header[H_SLOTS])
+        self.num_boxes  = int(self.header[H_BOXES])
+        self.shape      = (int(self.header[H_ROWS]), int(self.header[H_COLS]))
+        self.dtype      = np.dtype(self.header[H_DTYPE:H_DTYPE + 1].tobytes().rstrip(b'\0').decode())
+        nMetaOffset     = _aligned(self.header.nbytes)
+        metaType        = meta_dtype(self.num_boxes)
+        self.meta       = np.ndarray(self.slots, dtype = metaType, buffer = shm.buf, offset = nMetaOffset)
+        self.frames     = np.ndarray((self.slots,) + self.shape, dtype = self.dtype, buffer = shm.buf,
+                                     offset = nMetaOffset + _aligned(self.meta.nbytes))
+
+    #-----------------------------------------------------------
+    # New ring. name = None lets the system pick one (ring.name).
+    #-----------------------------------------------------------
+    @classmethod
+    def create(cls, shape, dtype = np.uint16, slots = SLOTS, num_boxes = NUM_BOXES, name = None):
+        from multiprocessing import shared_memory
+
+        dtype = np.dtype(dtype)
+        if len(dtype.str) > 8:
+            raise ValueError('Unsupported frame dtype {}' .format(dtype))
+        rows, cols  = shape
+        nBytes      = _aligned(HEADER_WORDS * 8) + _aligned(slots * meta_dtype(num_boxes).itemsize) + slots * rows * cols * dtype.itemsize
+        shm         = shared_memory.SharedMemory(name = name, create = True, size = nBytes)
+        header      = np.ndarray(HEADER_WORDS, dtype = '<i8', buffer = shm.buf)
+        header[:]   = 0
+        header[H_SLOTS], header[H_ROWS], header[H_COLS], header[H_BOXES] = slots, rows, cols, num_boxes
+        header[H_DTYPE:H_DTYPE + 1].view('S8')[0] = dtype.str.encode()
+        header[H_MAGIC] = MAGIC
+        ring = cls(shm, owner = True)
+        ring.meta['seq'] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name), owner = False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_seq(self):
+        return int(self.header[H_WRITE])
+
+    @property
+    def closed(self):
+        return bool(self.header[H_CLOSED])
+
+    #-----------------------------------------------------------
+    # Producer: the slot for the next frame, to be filled in place
+    # (e.g. by a camera driver) and then published
+    #-----------------------------------------------------------
+    def claim(self):
+        nSeq  = self.write_seq
+        nSlot = nSeq % self.slots
+        self.meta['seq'][nSlot] = -1
+        return nSeq, self.frames[nSlot]
+
+    def publish(self, counter = None, params = None, timestamp = None):
+        nSeq  = self.write_seq
+        nSlot = nSeq % self.slots
+        meta  = self.meta[nSlot:nSlot + 1]
+        meta['counter']   = nSeq if counter is None else counter
+        meta['timestamp'] = time.time() if timestamp is None else timestamp
+        if params is not None:
+            meta['params'] = params
+        meta['seq']       = nSeq
+        self.header[H_WRITE] = nSeq + 1
+        return nSeq
+
+    #-----------------------------------------------------------
+    # Producer: copy a frame into the ring. Returns its sequence.
+    #-----------------------------------------------------------
+    def write(self, frame, counter = None, params = None, timestamp = None):
+        _, slot = self.claim()
+        slot[...] = frame
+        return self.publish(counter, params, timestamp)
+
+    #-----------------------------------------------------------
+    # True while frame nSeq is still in its slot
+    #-----------------------------------------------------------
+    def valid(self, nSeq):
+        return nSeq >= 0 and self.meta['seq'][nSeq % self.slots] == nSeq
+
+    #-----------------------------------------------------------
+    # Producer: tell readers no more frames will come
+    #-----------------------------------------------------------
+    def finish(self):
+        self.header[H_CLOSED] = 1
+
+    #-----------------------------------------------------------
+    # Drop this process's mapping; the creator also removes the block.
+    # Views taken from the ring must be released first.
+    #-----------------------------------------------------------
+    def close(self):
+        if self.shm is None:
+            return
+        if self.owner:
+            self.finish()
+        del self.header, self.meta, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+
+#---------------------------------------------------------------
+# One consumer's position in a ring
+#---------------------------------------------------------------
+class RingReader:
+
+    #-----------------------------------------------------------
+    # ring  : FrameRing or the name of one
+    # start : 'latest' (next frame written) or 'oldest' in the ring
+    #-----------------------------------------------------------
+    def __init__(self, ring, start = 'latest', poll = POLL_SECONDS):
+        self._attached  = isinstance(ring, str)
+        if self._attached:
+            ring = FrameRing.attach(ring)
+        self.ring       = ring
+        self.poll       = poll
+        self.nDropped   = 0
+        self.nRead      = 0
+        nWrite          = ring.write_seq
+        self.nNext      = nWrite if start == 'latest' else max(0, nWrite - ring.slots + 1)
+
+    #-----------------------------------------------------------
+    # Next frame: (seq, frame view, meta record), or None if no
+    # frame came within 'timeout' seconds (None = wait forever) or
+    # the producer has finished. Check ring.valid(seq) after using
+    # the view if the reader may have been lapped.
+    #-----------------------------------------------------------
+    def read(self, timeout = None):
+        ring   = self.ring
+        tEnd   = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            nWrite = ring.write_seq
+            if nWrite > self.nNext:
+                break
+            if ring.closed or (tEnd is not None and time.perf_counter() >= tEnd):
+                return None
+            time.sleep(self.poll)
+
+        if nWrite - self.nNext > ring.slots - 1:
+            # Lapped: skip to the oldest frame the producer cannot be writing
+            nOldest         = nWrite - ring.slots + 1
+            self.nDropped  += nOldest - self.nNext
+            self.nNext      = nOldest
+        nSeq = self.nNext
+        self.nNext += 1
+        self.nRead += 1
+        nSlot = nSeq % ring.slots
+        return nSeq, ring.frames[nSlot], ring.meta[nSlot]
+
+    #-----------------------------------------------------------
+    # Skip to the newest frame and return it (display, tracking),
+    # or None if there is none yet
+    #-----------------------------------------------------------
+    def latest(self):
+        nWrite = self.ring.write_seq
+        if nWrite == 0:
+            return None
+        if nWrite - 1 > self.nNext:
+            self.nDropped += nWrite - 1 - self.nNext
+            self.nNext     = nWrite - 1
+        return self.read(0)
+
+    def close(self):
+        if self._attached:
+            self.ring.close()
+
+
+#---------------------------------------------------------------
+# Live frame source (rheed.live) reading from a ring
+#---------------------------------------------------------------
+class RingSource:
+
+    reuses_buffer = True
+
+    def __init__(self, ring, start = 'latest'):
+        self.reader = ring if isinstance(ring, RingReader) else RingReader(ring, start)
+        self.meta   = None
+
+    def read(self, timeout = None):
+        item = self.reader.read(timeout)
+        if item is None:
+            return None
+        nSeq, frame, self.meta = item
+        return int(self.meta['counter']), frame
+
+    def close(self):
+        self.reader.close()
+
+
+#---------------------------------------------------------------
+# Copy frames from a frame source (rheed.live) into a ring until
+# 'stop' (a multiprocessing Event) is set, the source runs dry
+# (with loop = False) or max_frames were written
+#---------------------------------------------------------------
+def feed_ring(ring, source, stop = None, max_frames = None, timeout = 0.1):
+    nFrames = 0
+    while (stop is None or not stop.is_set()) and (max_frames is None or nFrames < max_frames):
+        item = source.read(timeout)
+        if item is None:
+            if getattr(source, 'loop', True) is False:
+                break
+            continue
+        nCounter, frame = item
+        ring.write(frame, nCounter)
+        nFrames += 1
+    return nFrames
+
+
+def _feed_process(name, make_source, args, stop, max_frames):
+    ring   = FrameRing.attach(name)
+    source = make_source(*args)
+    try:
+        feed_ring(ring, source, stop, max_frames)
+    finally:
+        source.close()
+        ring.finish()
+        ring.close()
+
+
+#---------------------------------------------------------------
+# Run feed_ring in its own (spawned) process. make_source(*args)
+# is called in that process and must be a module level function.
+# Returns (process, stop event).
+#---------------------------------------------------------------
+def start_feeder(ring, make_source, args = (), max_frames = None):
+    import multiprocessing as mp
+
+    ctx     = mp.get_context('spawn')
+    stop    = ctx.Event()
+    process = ctx.Process(target = _feed_process, args = (ring.name, make_source, args, stop, max_frames),
+                          name = 'RingFeeder', daemon = True)
+    process.start()
+    return process, stop
@@ -0,0 +1,122 @@
+#---------------------------------------------------------------
+# Diffraction spot detection and crop box proposal
+#---------------------------------------------------------------
+# Finds the brightest Gaussian-like spots in a frame:
+#   1. Gaussian smoothing (sigma about the spot width)
+#   2. Local maxima of the smoothed frame above a threshold
+#   3. Greedy non-maximum suppression: brightest spots first,
+#      anything closer than min_distance to a kept spot is dropped
+#   4. Sub-pixel centre from a parabola through the 3x3 neighbourhood
+#
+# propose_boxes() turns spot centres into crop box upper left
+# corners clamped to the FPGA frame (IN_COLS x IN_ROWS), ready for
+# the parameter registers.
+# A 160x104 frame takes about a millisecond.
+#---------------------------------------------------------------
+import  numpy as np
+
+from    .crop import NUM_BOXES, IN_COLS, IN_ROWS, BOX_COLS, BOX_ROWS, pack_xy
+
+SPOT_DTYPE      = np.dtype([('x', 'f4'), ('y', 'f4'), ('amplitude', 'f4')])
+
+MAX_CANDIDATES  = 256       # Local maxima kept for suppression
+
+
+#---------------------------------------------------------------
+# Detect up to n spots in a frame.
+#
+# sigma        : smoothing in pixels
+# min_distance : minimum spacing of spots in pixels (default: half a box)
+# threshold    : minimum peak height above background. Default is
+#                5 robust standard deviations of the smoothed frame.
+#
+# Returns a SPOT_DTYPE array, brightest first. Amplitude is the
+# smoothed peak height above the background (median).
+#---------------------------------------------------------------
+def detect_spots(frame, n = NUM_BOXES, sigma = 2.0, min_distance = None, threshold = None):
+    from scipy import ndimage
+
+    if min_distance is None:
+        min_distance = min(BOX_COLS, BOX_ROWS) / 2
+    smooth = ndimage.gaussian_filter(np.asarray(frame, dtype = np.float32), sigma, mode = 'nearest')
+
+    background = np.median(smooth)
+    if threshold is None:
+        mad       = np.median(np.abs(smooth - background))
+        threshold = 5.0 * 1.4826 * mad
+    smooth -= background
+
+    # Local maxima over a 3x3 neighbourhood, away from the border
+    peaks = (smooth == ndimage.maximum_filter(smooth, size = 3, mode = 'nearest')) & (smooth > threshold)
+    peaks[0, :] = peaks[-1, :] = peaks[:, 0] = peaks[:, -1] = False
+    rows, cols = np.nonzero(peaks)
+    if rows.size == 0:
+        return np.zeros(0, dtype = SPOT_DTYPE)
+
+    values = smooth[rows, cols]
+    order  = np.argsort(values)[::-1][:MAX_CANDIDATES]
+    rows, cols, values = rows[order], cols[order], values[order]
+
+    keep = _suppress(rows, cols, min_distance, n)
+    rows, cols, values = rows[keep], cols[keep], values[keep]
+
+    # Sub-pixel offsets from a parabola through each peak and its neighbours
+    c  = values
+    dx = _parabola_offset(smooth[rows, cols - 1], c, smooth[rows, cols + 1])
+    dy = _parabola_offset(smooth[rows - 1, cols], c, smooth[rows + 1, cols])
+
+    spots = np.empty(rows.size, dtype = SPOT_DTYPE)
+    spots['x']          = cols + dx
+    spots['y']          = rows + dy
+    spots['amplitude']  = values
+    return spots
+
+
+#---------------------------------------------------------------
+# Greedy non-maximum suppression on candidates sorted brightest
+# first. Returns the indices of at most n kept candidates.
+#---------------------------------------------------------------
+def _suppress(rows, cols, min_distance, n):
+    d2     = (rows[:, None] - rows[None, :]) ** 2 + (cols[:, None] - cols[None, :]) ** 2
+    close  = d2 < min_distance * min_distance
+    alive  = np.ones(rows.size, dtype = bool)
+    keep   = []
+    for i in range(rows.size):
+        if not alive[i]:
+            continue
+        keep.append(i)
+        if len(keep) == n:
+            break
+        alive &= ~close[i]
+    return np.array(keep, dtype = np.intp)
+
+
+def _parabola_offset(left, centre, right):
+    denom = left - 2.0 * centre + right
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        offset = np.where(denom < 0, 0.5 * (left - right) / denom, 0.0)
+    return np.clip(offset, -0.5, 0.5)
+
+
+#---------------------------------------------------------------
+# Upper left corners of boxes centred on the spots, clamped so each
+# box lies inside the frame. Returns an (n, 2) int array of (x0, y0).
+#---------------------------------------------------------------
+def propose_boxes(spots, image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS):
+    x0 = np.floor(spots['x'] - box_cols / 2).astype(np.int64)
+    y0 = np.floor(spots['y'] - box_rows / 2).astype(np.int64)
+    x0 = np.clip(x0, 0, max(image_cols - box_cols, 0))
+    y0 = np.clip(y0, 0, max(image_rows - box_rows, 0))
+    return np.stack([x0, y0], axis = 1)
+
+
+#---------------------------------------------------------------
+# Detect spots and return (spots, boxes, register words). The boxes
+# are clamped to the frame the FPGA crops (IN_COLS x IN_ROWS), not
+# to the shape of the frame given, so the words are always valid
+# parameter register values.
+#---------------------------------------------------------------
+def propose_crop(frame, n = NUM_BOXES, box_cols = BOX_COLS, box_rows = BOX_ROWS, **kwargs):
+    spots = detect_spots(frame, n, **kwargs)
+    boxes = propose_boxes(spots, IN_COLS, IN_ROWS, box_cols, box_rows)
+    return spots, boxes, [pack_xy(x, y) for (x, y) in boxes]
@@ -0,0 +1,284 @@
+#---------------------------------------------------------------
+# Synthetic RHEED frames with ground truth
+#---------------------------------------------------------------
+# Frames are generated in batches, fully vectorized:
+#
+#   background : level + linear gradient + broad diffuse glow
+#   spots      : 2-D Gaussians. Every component is separable, so a
+#                batch is one einsum of (F, S, rows) x (F, S, cols)
+#   streaks    : Gaussians long in y and narrow in x (same einsum)
+#   drift      : spot and streak centres move by 'drift' pixels per
+#                frame, plus an optional random walk
+#   oscillation: spot intensity  A * (1 + depth * exp(-t / decay)
+#                * cos(2 pi t / period + phase))
+#   noise      : shot noise (Poisson on signal / gain photons) and
+#                Gaussian read noise, then rounded and clipped
+#
+# The ground truth of every frame (spot centres, widths and
+# amplitudes) is returned with the frames and saved next to them by
+# the writers (.h5 dataset 'truth', or <base>.truth.npy).
+#
+# SyntheticSource is a live frame source (rheed.live) for the GUI
+# and for load tests.
+#---------------------------------------------------------------
+import  json
+import  time
+
+import  numpy as np
+
+from    .crop import IN_COLS, IN_ROWS, NUM_BOXES
+
+TRUTH_DTYPE     = np.dtype([('x', 'f4'), ('y', 'f4'), ('amplitude', 'f4'), ('sigma_x', 'f4'), ('sigma_y', 'f4')])
+BATCH_FRAMES    = 256       # Frames generated per batch by the writers
+
+
+#---------------------------------------------------------------
+# Generator settings and batch generation
+#---------------------------------------------------------------
+class SyntheticRheed:
+
+    #-----------------------------------------------------------
+    # spots      : (S, 5) rows of x, y, amplitude, sigma_x, sigma_y,
+    #              or None for num_spots random spots
+    # streaks    : (K, 5) rows of x, y, amplitude, width, length
+    # background : level, (gx, gy) gradient per pixel, glow amplitude
+    # drift      : (vx, vy) pixels per frame; walk: random walk step
+    # period     : oscillation period in frames (0 for none)
+    # gain       : ADU per photon (shot noise); read_noise in ADU
+    #-----------------------------------------------------------
+    def __init__(self, rows = IN_ROWS, cols = IN_COLS, spots = None, num_spots = NUM_BOXES, streaks = None,
+                 background = 20.0, gradient = (0.0, 0.05), glow = 30.0,
+                 drift = (0.0, 0.0), walk = 0.0, period = 0.0, depth = 0.3, decay = 0.0, phase = 0.0,
+                 gain = 1.0, read_noise = 2.0, dtype = np.uint16, seed = None):
+        self.rows       = rows
+        self.cols       = cols
+        self.dtype      = np.dtype(dtype)
+        self.seed       = seed
+        self._rng       = np.random.default_rng(seed)
+
+        if spots is None:
+            spots = np.stack([self._rng.uniform(0.15 * cols, 0.85 * cols, num_spots),
+                              self._rng.uniform(0.15 * rows, 0.85 * rows, num_spots),
+                              self._rng.uniform(100, 400, num_spots),
+                              self._rng.uniform(1.5, 4.0, num_spots),
+                              self._rng.uniform(1.5, 4.0, num_spots)], axis = 1)
+        self.spots      = np.asarray(spots, dtype = np.float64).reshape(-1, 5)
+        self.streaks    = np.zeros((0, 5)) if streaks is None else np.asarray(streaks, dtype = np.float64).reshape(-1, 5)
+        self.background = background
+        self.gradient   = tuple(gradient)
+        self.glow       = glow
+        self.drift      = tuple(drift)
+        self.walk       = walk
+        self.period     = period
+        self.depth      = depth
+        self.decay      = decay
+        self.phase      = phase
+        self.gain       = gain
+        self.read_noise = read_noise
+
+        # Random walk offsets are generated as frames are asked for.
+        # Only those of the last range asked for are kept: frames
+        # _walkBase .. _walkBase+len-1.
+        self._walk      = np.zeros((0, 2))
+        self._walkBase  = 0
+
+        y               = np.arange(rows, dtype = np.float64)
+        x               = np.arange(cols, dtype = np.float64)
+        glowMap         = np.exp(-0.5 * (((x[None, :] - cols / 2) / (0.4 * cols)) ** 2 + (y[:, None] / (0.6 * rows)) ** 2))
+        self._static    = (background + gradient[0] * x[None, :] + gradient[1] * y[:, None] + glow * glowMap).astype(np.float32)
+
+    #-----------------------------------------------------------
+    # Settings as a JSON string, saved with the frames
+    #-----------------------------------------------------------
+    def config(self):
+        return json.dumps({'rows': self.rows, 'cols': self.cols, 'dtype': self.dtype.name, 'seed': self.seed,
+                           'spots': self.spots.tolist(), 'streaks': self.streaks.tolist(),
+                           'background': self.background, 'gradient': self.gradient, 'glow': self.glow,
+                           'drift': self.drift, 'walk': self.walk, 'period': self.period, 'depth': self.depth,
+                           'decay': self.decay, 'phase': self.phase, 'gain': self.gain, 'read_noise': self.read_noise})
+
+    #-----------------------------------------------------------
+    # Offsets (F, 2) of frames start .. start+count-1 from drift and
+    # walk. With a walk, frames are asked for in order: a range may
+    # repeat the last one but not start before it.
+    #-----------------------------------------------------------
+    def offsets(self, start, count):
+        t   = np.arange(start, start + count, dtype = np.float64)
+        off = np.stack([t * self.drift[0], t * self.drift[1]], axis = 1)
+        if self.walk > 0:
+            if start < self._walkBase:
+                raise ValueError('Random walk before frame {} is no longer kept' .format(self._walkBase))
+            nEnd = self._walkBase + self._walk.shape[0]
+            if start + count > nEnd:
+                last  = self._walk[-1] if self._walk.shape[0] else np.zeros(2)
+                steps = self._rng.normal(0.0, self.walk, (start + count - nEnd, 2))
+                walk  = np.concatenate([self._walk, last + np.cumsum(steps, axis = 0)])
+                self._walk     = walk[start - self._walkBase:]
+                self._walkBase = start
+            off += self._walk[start - self._walkBase:start - self._walkBase + count]
+        return off
+
+    #-----------------------------------------------------------
+    # Spot intensity factor (F,) from the oscillation
+    #-----------------------------------------------------------
+    def oscillation(self, start, count):
+        t = np.arange(start, start + count, dtype = np.float64)
+        if self.period <= 0:
+            return np.ones(count)
+        envelope = np.exp(-t / self.decay) if self.decay > 0 else 1.0
+        return 1.0 + self.depth * envelope * np.cos(2 * np.pi * t / self.period + self.phase)
+
+    #-----------------------------------------------------------
+    # Ground truth (count, S) of frames start .. start+count-1
+    #-----------------------------------------------------------
+    def truth(self, start, count):
+        off   = self.offsets(start, count)
+        truth = np.empty((count, self.spots.shape[0]), dtype = TRUTH_DTYPE)
+        truth['x']          = self.spots[None, :, 0] + off[:, 0:1]
+        truth['y']          = self.spots[None, :, 1] + off[:, 1:2]
+        truth['amplitude']  = self.spots[None, :, 2] * self.oscillation(start, count)[:, None]
+        truth['sigma_x']    = self.spots[None, :, 3]
+        truth['sigma_y']    = self.spots[None, :, 4]
+        return truth
+
+    #-----------------------------------------------------------
+    # Noise-free expected frames (count, rows, cols) float32
+    #-----------------------------------------------------------
+    def expected(self, start, count, truth = None):
+        if truth is None:
+            truth = self.truth(start, count)
+        off   = self.offsets(start, count)
+
+        # Spots and streaks as separable components (F, S + K)
+        nK    = self.streaks.shape[0]
+        cx    = np.concatenate([truth['x'], self.streaks[None, :, 0] + off[:, 0:1]], axis = 1)
+        cy    = np.concatenate([truth['y'], np.broadcast_to(self.streaks[None, :, 1] + off[:, 1:2], (count, nK))], axis = 1)
+        amp   = np.concatenate([truth['amplitude'], np.broadcast_to(self.streaks[None, :, 2], (count, nK))], axis = 1)
+        sx    = np.concatenate([truth['sigma_x'], np.broadcast_to(self.streaks[None, :, 3], (count, nK))], axis = 1)
+        sy    = np.concatenate([truth['sigma_y'], np.broadcast_to(self.streaks[None, :, 4], (count, nK))], axis = 1)
+
+        x     = np.arange(self.cols, dtype = np.float32)
+        y     = np.arange(self.rows, dtype = np.float32)
+        gx    = np.exp(-0.5 * ((x[None, None, :] - cx[..., None]) / sx[..., None]) ** 2).astype(np.float32)
+        gy    = np.exp(-0.5 * ((y[None, None, :] - cy[..., None]) / sy[..., None]) ** 2).astype(np.float32)
+        gy   *= amp[..., None].astype(np.float32)
+        image = np.matmul(gy.transpose(0, 2, 1), gx)                # (F, rows, cols)
+        image += self._static
+        return image
+
+    #-----------------------------------------------------------
+    # Frames start .. start+count-1 with noise.
+    # Returns frames (count, rows, cols) and truth (count, S).
+    #-----------------------------------------------------------
+    def frames(self, start, count):
+        truth = self.truth(start, count)
+        image = self.expected(start, count, truth)
+        if self.gain > 0:
+            image = self._rng.poisson(np.maximum(image, 0) / self.gain).astype(np.float32) * self.gain
+        if self.read_noise > 0:
+            image += self._rng.normal(0.0, self.read_noise, image.shape).astype(np.float32)
+        if np.issubdtype(self.dtype, np.integer):
+            info = np.iinfo(self.dtype)
+            np.rint(image, out = image)
+            np.clip(image, info.min, info.max, out = image)
+        return image.astype(self.dtype), truth
+
+
+#---------------------------------------------------------------
+# Write nFrames to an .h5 file: dataset 'frames' (chunked, one
+# chunk per batch), 'truth' and the settings in attribute 'config'
+#---------------------------------------------------------------
+def write_h5(fileNameH5, generator, nFrames, batch = BATCH_FRAMES, compression = None):
+    import h5py
+
+    g = generator
+    with h5py.File(fileNameH5, 'w') as f:
+        ds = f.create_dataset('frames', (nFrames, g.rows, g.cols), dtype = g.dtype,
+                              chunks = (min(batch, max(nFrames, 1)), g.rows, g.cols), compression = compression)
+        dt = f.create_dataset('truth', (nFrames, g.spots.shape[0]), dtype = TRUTH_DTYPE)
+        ds.attrs['config'] = g.config()
+        for i in range(0, nFrames, batch):
+            frames, truth = g.frames(i, min(batch, nFrames - i))
+            ds[i:i + frames.shape[0]] = frames
+            dt[i:i + frames.shape[0]] = truth
+
+
+#---------------------------------------------------------------
+# Write nFrames to <base>.raw with a <base>.hdr header (readable
+# with rheed.frames.open_raw), truth to <base>.truth.npy and the
+# settings to <base>.json
+#---------------------------------------------------------------
+def write_raw(fileNameBase, generator, nFrames, batch = BATCH_FRAMES):
+    from .frames import write_raw_header
+
+    g = generator
+    write_raw_header(fileNameBase + '.hdr', g.rows, g.cols, g.dtype, frames = nFrames)
+    truth = np.lib.format.open_memmap(fileNameBase + '.truth.npy', mode = 'w+', dtype = TRUTH_DTYPE,
+                                      shape = (nFrames, g.spots.shape[0]))
+    with open(fileNameBase + '.raw', 'wb') as f:
+        for i in range(0, nFrames, batch):
+            frames, t = g.frames(i, min(batch, nFrames - i))
+            f.write(frames.tobytes())
+            truth[i:i + frames.shape[0]] = t
+    truth.flush()
+    with open(fileNameBase + '.json', 'w') as f:
+        f.write(g.config())
+
+
+#---------------------------------------------------------------
+# Write nFrames to a memory-mapped <base>.npy (open_npy) with truth
+# in <base>.truth.npy
+#---------------------------------------------------------------
+def write_npy(fileNameBase, generator, nFrames, batch = BATCH_FRAMES):
+    g      = generator
+    frames = np.lib.format.open_memmap(fileNameBase + '.npy', mode = 'w+', dtype = g.dtype, shape = (nFrames, g.rows, g.cols))
+    truth  = np.lib.format.open_memmap(fileNameBase + '.truth.npy', mode = 'w+', dtype = TRUTH_DTYPE,
+                                       shape = (nFrames, g.spots.shape[0]))
+    for i in range(0, nFrames, batch):
+        frames[i:i + batch], truth[i:i + batch] = g.frames(i, min(batch, nFrames - i))
+    frames.flush()
+    truth.flush()
+    with open(fileNameBase + '.json', 'w') as f:
+        f.write(g.config())
+
+
+#---------------------------------------------------------------
+# Live frame source (see rheed.live) of synthetic frames at 'fps'
+# frames per second (0: as fast as asked for). truth is the ground
+# truth of the last frame read.
+#---------------------------------------------------------------
+class SyntheticSource:
+
+    reuses_buffer = False
+
+    def __init__(self, generator, fps = 30.0, batch = 32):
+        self.generator  = generator
+        self.period     = 1.0 / fps if fps > 0 else 0.0
+        self.batch      = batch
+        self.nCounter   = 0
+        self.truth      = None
+        self._frames    = None
+        self._truth     = None
+        self._nFirst    = 0
+        self._tNext     = time.perf_counter()
+
+    def read(self, timeout = None):
+        tWait = self._tNext - time.perf_counter()
+        if tWait > 0:
+            if timeout is not None and tWait > timeout:
+                time.sleep(timeout)
+                return None
+            time.sleep(tWait)
+        self._tNext = max(self._tNext + self.period, time.perf_counter() - self.period)
+
+        i = self.nCounter - self._nFirst
+        if self._frames is None or i >= self._frames.shape[0]:
+            self._nFirst               = self.nCounter
+            self._frames, self._truth  = self.generator.frames(self.nCounter, self.batch)
+            i = 0
+        self.truth     = self._truth[i]
+        self.nCounter += 1
+        return self.nCounter - 1, self._frames[i]
+
+    def close(self):
+        pass
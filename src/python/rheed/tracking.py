@@ -0,0 +1,208 @@
+#---------------------------------------------------------------
+# Closed-loop spot drift tracking for the crop boxes
+#---------------------------------------------------------------
+# Spots drift during growth (sample rotation, beam shift). The
+# tracker follows the spot in each crop box frame to frame and
+# moves a box only when its spot has drifted more than 'threshold'
+# pixels from the box centre.
+#
+#   - Estimator: intensity centroid in a small window around the
+#     last spot position, above the window minimum. All boxes are
+#     done at once with one gather; about 0.2 ms per frame.
+#   - Only parameter registers whose word changed are written.
+#     The FPGA sets parameters_dv when the last parameter register
+#     is written and clears it on a write to any other one
+#     (rhd_registers_misc.vhdl), so the last register is always
+#     written (again) after a change to complete the update.
+#   - Serial traffic is bounded by a byte budget (token bucket).
+#     Each write is 7 bytes ('W', address16, data32). Updates that
+#     do not fit are kept and sent, largest drift first, when the
+#     budget allows.
+#---------------------------------------------------------------
+import  time
+
+import  numpy as np
+
+from    .crop import NUM_BOXES, IN_COLS, IN_ROWS, BOX_COLS, BOX_ROWS, pack_xy, unpack_xy, box_at
+
+ADR_REG_PARAM0      = 0                 # First crop box parameter register
+ADR_REG_PARAM_LAST  = NUM_BOXES - 1     # Write sets parameters_dv
+REG_WRITE_BYTES     = 7                 # 'W' + address16 + data32
+BAUD_RATE           = 115200
+SERIAL_SHARE        = 0.25              # Part of the serial line the tracker may use
+
+DRIFT_THRESHOLD     = 4.0               # Re-centre when the spot is this far off (pixels)
+WINDOW_RADIUS       = 8                 # Centroid window half size (pixels)
+SMOOTHING           = 0.5               # Weight of the new centroid in the position estimate
+MIN_SIGNAL          = 1e-6              # Window sum below which a box keeps its estimate
+
+
+#---------------------------------------------------------------
+# Intensity centroids of windows around (x, y) positions.
+# frame  : (H, W)
+# xy     : (B, 2) float positions
+# Returns (B, 2) centroids and (B,) signal (sum above window minimum).
+# Windows are clamped to the frame.
+#---------------------------------------------------------------
+def local_centroids(frame, xy, radius = WINDOW_RADIUS):
+    frame  = np.asarray(frame)
+    nRows, nCols = frame.shape
+    xy     = np.asarray(xy, dtype = np.float64)
+    size   = 2 * radius + 1
+    off    = np.arange(size) - radius
+
+    # Window origins clamped so the whole window lies in the frame
+    cx     = np.clip(np.rint(xy[:, 0]).astype(np.intp), radius, max(radius, nCols - 1 - radius))
+    cy     = np.clip(np.rint(xy[:, 1]).astype(np.intp), radius, max(radius, nRows - 1 - radius))
+    cols   = np.clip(cx[:, None] + off, 0, nCols - 1)          # (B, size)
+    rows   = np.clip(cy[:, None] + off, 0, nRows - 1)
+    win    = frame[rows[:, :, None], cols[:, None, :]].astype(np.float32)
+
+    win   -= win.min(axis = (1, 2), keepdims = True)
+    px     = win.sum(axis = 1)                                  # (B, size) column sums
+    py     = win.sum(axis = 2)                                  # (B, size) row sums
+    signal = px.sum(axis = 1)
+    total  = np.maximum(signal, MIN_SIGNAL)
+    x      = (px * cols).sum(axis = 1) / total
+    y      = (py * rows).sum(axis = 1) / total
+    return np.stack([x, y], axis = 1), signal
+
+
+#---------------------------------------------------------------
+# Register writes to change the crop box words from 'old' to 'new':
+# the changed registers, then the last parameter register so the
+# FPGA sees a complete parameter set.
+# Returns a list of (address, word).
+#---------------------------------------------------------------
+def changed_writes(old, new):
+    writes = [(ADR_REG_PARAM0 + i, int(w)) for i, (v, w) in enumerate(zip(old, new)) if int(v) != int(w)]
+    if writes and writes[-1][0] != ADR_REG_PARAM0 + len(new) - 1:
+        writes.append((ADR_REG_PARAM0 + len(new) - 1, int(new[-1])))
+    return writes
+
+
+#---------------------------------------------------------------
+# Token bucket limiting the serial bytes spent per second
+#---------------------------------------------------------------
+class SerialBudget:
+
+    def __init__(self, bytes_per_s = SERIAL_SHARE * BAUD_RATE / 10, burst = None, clock = time.perf_counter):
+        self.rate   = float(bytes_per_s)
+        self.burst  = float(burst if burst is not None else (NUM_BOXES + 1) * REG_WRITE_BYTES)
+        self.clock  = clock
+        self.tokens = self.burst
+        self._tLast = clock()
+
+    def available(self):
+        tNow         = self.clock()
+        self.tokens  = min(self.burst, self.tokens + (tNow - self._tLast) * self.rate)
+        self._tLast  = tNow
+        return self.tokens
+
+    def spend(self, nBytes):
+        self.tokens -= nBytes
+
+
+#---------------------------------------------------------------
+# Follows the spot in each crop box and proposes register writes
+#---------------------------------------------------------------
+class SpotTracker:
+
+    #-----------------------------------------------------------
+    # words      : current parameter register words (as on the FPGA)
+    # centres    : starting spot positions, default the box centres
+    # active     : boxes to track, default all
+    # budget     : SerialBudget, or None for no limit
+    #-----------------------------------------------------------
+    def __init__(self, words, centres = None, image_cols = IN_COLS, image_rows = IN_ROWS, box_cols = BOX_COLS, box_rows = BOX_ROWS,
+                 threshold = DRIFT_THRESHOLD, radius = WINDOW_RADIUS, smoothing = SMOOTHING, budget = None, active = None):
+        self.image_cols = image_cols
+        self.image_rows = image_rows
+        self.box_cols   = box_cols
+        self.box_rows   = box_rows
+        self.threshold  = threshold
+        self.radius     = radius
+        self.smoothing  = smoothing
+        self.budget     = budget
+        self.nWrites    = 0         # Register writes proposed so far
+        self.nDeferred  = 0         # Updates held back by the budget
+        self.reset(words, centres, active)
+
+    #-----------------------------------------------------------
+    # Restart from a new set of boxes (e.g. after clicks or Detect).
+    # Only boxes flagged in 'active' (default all) are moved.
+    #-----------------------------------------------------------
+    def reset(self, words, centres = None, active = None):
+        self.words   = np.array([int(w) for w in words], dtype = np.int64)   # Words written to the FPGA
+        self.target  = self.words.copy()                                     # Words wanted
+        corners      = np.array([unpack_xy(w) for w in self.words], dtype = np.float64).reshape(-1, 2)
+        if centres is None:
+            centres  = corners + (self.box_cols / 2, self.box_rows / 2)
+        self.centres = np.array(centres, dtype = np.float64).reshape(-1, 2)
+        self.signal  = np.zeros(len(self.words), dtype = np.float32)
+        self.active  = np.ones(len(self.words), dtype = bool) if active is None else np.array(active, dtype = bool)
+
+    #-----------------------------------------------------------
+    # New boxes wanted (e.g. re-detection while tracking). The words
+    # on the FPGA are kept; returns the writes of the boxes that
+    # changed, within the budget, as update() does.
+    #-----------------------------------------------------------
+    def retarget(self, words, centres = None, active = None):
+        self.target  = np.array([int(w) for w in words], dtype = np.int64)
+        if centres is None:
+            centres  = self.box_centres(self.target)
+        self.centres = np.array(centres, dtype = np.float64).reshape(-1, 2)
+        if active is not None:
+            self.active = np.array(active, dtype = bool)
+        return self._flush()
+
+    def box_centres(self, words = None):
+        corners = np.array([unpack_xy(w) for w in (self.words if words is None else words)], dtype = np.float64).reshape(-1, 2)
+        return corners + (self.box_cols / 2, self.box_rows / 2)
+
+    #-----------------------------------------------------------
+    # Track one frame. Returns the register writes [(address, word)]
+    # to send now; an empty list if nothing needs to change.
+    #-----------------------------------------------------------
+    def update(self, frame):
+        xy, signal    = local_centroids(frame, self.centres, self.radius)
+        valid         = signal > MIN_SIGNAL
+        self.signal   = signal
+        a             = self.smoothing
+        self.centres[valid] = (1 - a) * self.centres[valid] + a * xy[valid]
+
+        # Re-centre boxes whose spot drifted past the threshold
+        drift = np.hypot(*(self.centres - self.box_centres(self.target)).T)
+        for i in np.nonzero((drift > self.threshold) & self.active)[0]:
+            x0, y0 = box_at(self.centres[i, 0], self.centres[i, 1], self.image_cols, self.image_rows, self.box_cols, self.box_rows)
+            self.target[i] = pack_xy(x0, y0)
+        return self._flush()
+
+    #-----------------------------------------------------------
+    # Writes for the target words that fit in the budget, largest
+    # move first. The remaining ones stay pending.
+    #-----------------------------------------------------------
+    def _flush(self):
+        pending = np.nonzero(self.target != self.words)[0]
+        if pending.size == 0:
+            return []
+
+        move    = np.hypot(*(self.box_centres(self.target[pending]) - self.box_centres(self.words[pending])).T)
+        pending = pending[np.argsort(-move, kind = 'stable')]
+        if self.budget is not None:
+            # One write per box plus the final parameter register write
+            nFit    = int(self.budget.available() // REG_WRITE_BYTES) - 1
+            if nFit < len(pending):
+                self.nDeferred += len(pending) - max(nFit, 0)
+            pending = pending[:max(nFit, 0)]
+            if pending.size == 0:
+                return []
+
+        new          = self.words.copy()
+        new[pending] = self.target[pending]
+        writes       = changed_writes(self.words, new)
+        self.words   = new
+        self.nWrites += len(writes)
+        if self.budget is not None:
+            self.budget.spend(len(writes) * REG_WRITE_BYTES)
+        return writes
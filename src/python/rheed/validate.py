@@ -0,0 +1,183 @@
+#---------------------------------------------------------------
+# Sampled on-line validation of the FPGA result registers
+#---------------------------------------------------------------
+# Now and then a frame is taken together with the crop box words
+# it was cropped with and the result registers read back from the
+# FPGA (ADR_REG_RESULT0 .. +NUM_BOXES*REGS_PER_CROP-1, 16..25), both
+# in one batched read with RegisterClient.read_snapshot(). The
+# GoldenModel recomputes the expected registers on the host and the
+# two are compared result by result.
+#
+# Per box the validator keeps
+#   - frames checked and frames with any result wrong
+#   - frames where the box was outside the frame, so the host model
+#     could not crop it (also counted as wrong)
+#   - a histogram of the signed error (FPGA - host) per result
+#   - how often a wrong box matched a named alternative model,
+#     e.g. GoldenModel(swap_xy = True) for an x/y wiring swap
+#
+# Sampling is adaptive. The sample rate rises towards max_rate while
+# mismatches are being seen and falls back to min_rate when results
+# agree, and it is always capped so that validation (register reads
+# included) takes at most 'budget' of the wall-clock time.
+#
+# The caller is responsible for pairing a frame with the registers
+# the FPGA computed for that frame.
+#---------------------------------------------------------------
+import  time
+
+import  numpy as np
+
+from    .crop import NUM_BOXES
+from    .golden import GoldenModel, NUM_RESULTS, BITWIDTH_RESULTS, REGS_PER_CROP, regs_to_results
+
+ERROR_BINS      = 2 * (1 << BITWIDTH_RESULTS) - 1   # Signed errors -255 .. 255
+MIN_RATE        = 0.01      # Fraction of frames checked when all is well
+MAX_RATE        = 0.5       # Fraction of frames checked while mismatches are seen
+BUDGET          = 0.05      # Largest fraction of time spent validating
+RATE_UP         = 2.0       # Rate multiplier after a mismatch
+RATE_DOWN       = 0.9       # Rate multiplier after a clean check
+
+
+#---------------------------------------------------------------
+# Compares FPGA results with the host model on sampled frames
+#---------------------------------------------------------------
+class ResultValidator:
+
+    #-----------------------------------------------------------
+    # model        : GoldenModel (default: dummy hls4ml block)
+    # alternatives : {name: GoldenModel} checked for wrong boxes
+    # seed         : random seed of the sampling decisions
+    #-----------------------------------------------------------
+    def __init__(self, model = None, num_boxes = NUM_BOXES, alternatives = None, min_rate = MIN_RATE, max_rate = MAX_RATE,
+                 budget = BUDGET, seed = None, clock = time.perf_counter):
+        self.model          = GoldenModel() if model is None else model
+        self.num_boxes      = num_boxes
+        self.alternatives   = dict(alternatives or {})
+        self.min_rate       = min_rate
+        self.max_rate       = max_rate
+        self.budget         = budget
+        self.clock          = clock
+        self._rng           = np.random.default_rng(seed)
+        self.rate           = min_rate
+        self.reset()
+
+    def reset(self):
+        nB = self.num_boxes
+        self.nOffered       = 0                                             # Frames offered to sample()
+        self.nChecked       = np.zeros(nB, dtype = np.int64)
+        self.nMismatch      = np.zeros(nB, dtype = np.int64)
+        self.nInvalid       = np.zeros(nB, dtype = np.int64)            # Box outside the frame
+        self.histogram      = np.zeros((nB, NUM_RESULTS, ERROR_BINS), dtype = np.int64)
+        self.nAlternative   = {name: np.zeros(nB, dtype = np.int64) for name in self.alternatives}
+        self.tBusy          = 0.0                                           # Time spent in check()
+        self.tCost          = 0.0                                           # Average time of a check
+        self._tStart        = self.clock()
+
+    #-----------------------------------------------------------
+    # Fraction of frames checked, given the current state and the
+    # time budget
+    #-----------------------------------------------------------
+    def sample_rate(self):
+        rate = self.rate
+        if self.tCost > 0 and self.nOffered > 0:
+            tFrame = max(self.clock() - self._tStart, 1e-9) / self.nOffered
+            rate   = min(rate, self.budget * tFrame / self.tCost)
+        return rate
+
+    #-----------------------------------------------------------
+    # Called once per frame. True if this frame should be checked.
+    #-----------------------------------------------------------
+    def sample(self):
+        self.nOffered += 1
+        return self._rng.random() < self.sample_rate()
+
+    #-----------------------------------------------------------
+    # Check one frame.
+    # frame     : (H, W) frame as the FPGA saw it (not calibrated
+    #             or filtered on the host)
+    # words     : (num_boxes,) crop box words it was cropped with
+    # regs      : (num_boxes, REGS_PER_CROP) result registers, or a
+    #             function returning them (timed as part of the check)
+    # Returns a (num_boxes,) bool array, True where a box is wrong.
+    #-----------------------------------------------------------
+    def check(self, frame, words, regs):
+        tStart   = self.clock()
+        if callable(regs):
+            regs = regs()
+        regs     = np.asarray(regs, dtype = np.uint32).reshape(self.num_boxes, REGS_PER_CROP)
+        got      = regs_to_results(regs).astype(np.int16)
+        expected = self.model.results(frame, words)[0].astype(np.int16)
+        error    = got - expected                                           # (B, NUM_RESULTS)
+        wrong    = np.any(error != 0, axis = 1)
+
+        self.nChecked  += 1
+        self.nMismatch += wrong
+        index = (np.arange(self.num_boxes)[:, None] * NUM_RESULTS + np.arange(NUM_RESULTS)) * ERROR_BINS + error + (ERROR_BINS // 2)
+        self.histogram += np.bincount(index.ravel(), minlength = self.histogram.size).reshape(self.histogram.shape)
+
+        if np.any(wrong):
+            for name, model in self.alternatives.items():
+                try:
+                    alt = model.results(frame, words)[0].astype(np.int16)
+                except ValueError:
+                    continue                                                # Boxes outside the frame for this model
+                self.nAlternative[name] += wrong & np.all(alt == got, axis = 1)
+            self.rate = min(self.max_rate, max(self.rate, self.min_rate) * RATE_UP)
+        else:
+            self.rate = max(self.min_rate, self.rate * RATE_DOWN)
+
+        tCheck      = self.clock() - tStart
+        self.tBusy += tCheck
+        self.tCost  = tCheck if self.tCost == 0 else 0.9 * self.tCost + 0.1 * tCheck
+        return wrong
+
+    #-----------------------------------------------------------
+    # sample() and check() in one call. Returns the check result,
+    # or None if the frame was not sampled. Boxes outside the frame
+    # cannot be checked; they are counted as invalid and wrong.
+    #-----------------------------------------------------------
+    def offer(self, frame, words, regs):
+        if not self.sample():
+            return None
+        try:
+            return self.check(frame, words, regs)
+        except ValueError:
+            return self._invalid(frame, words)
+
+    def _invalid(self, frame, words):
+        model  = self.model
+        words  = np.asarray(words, dtype = np.int64)
+        x0, y0 = (words >> 16) & 0xFFFF, words & 0xFFFF
+        if model.swap_xy:
+            x0, y0 = y0, x0
+        nRows, nCols    = np.shape(frame)[-2:]
+        wrong           = (x0 + model.box_cols > nCols) | (y0 + model.box_rows > nRows)
+        self.nChecked  += 1
+        self.nMismatch += wrong
+        self.nInvalid  += wrong
+        self.rate       = min(self.max_rate, max(self.rate, self.min_rate) * RATE_UP)
+        return wrong
+
+    @property
+    def mismatch_rate(self):
+        return self.nMismatch / np.maximum(self.nChecked, 1)
+
+    @property
+    def busy_fraction(self):
+        return self.tBusy / max(self.clock() - self._tStart, 1e-9)
+
+    #-----------------------------------------------------------
+    # Text summary, one line per box
+    #-----------------------------------------------------------
+    def summary(self):
+        lines = ['box  checked  wrong   rate     max|err|  invalid' + ''.join('  {:>8}' .format(name) for name in self.alternatives)]
+        errors = np.arange(ERROR_BINS) - ERROR_BINS // 2
+        for nBox in range(self.num_boxes):
+            hist   = self.histogram[nBox].sum(axis = 0)
+            maxErr = int(np.abs(errors[hist > 0]).max()) if np.any(hist) else 0
+            line   = '{:3}  {:7}  {:5}  {:6.3f}   {:8}  {:7}' .format(nBox, self.nChecked[nBox], self.nMismatch[nBox], self.mismatch_rate[nBox],
+                                                                 maxErr, self.nInvalid[nBox])
+            line  += ''.join('  {:8}' .format(self.nAlternative[name][nBox]) for name in self.alternatives)
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,222 @@
+#---------------------------------------------------------------
+# Zoomable, pannable image view for the GUI canvas
+#---------------------------------------------------------------
+# ImagePyramid shows the displayed image at a fixed set of scales
+# (ZOOM_STEP apart). A level is resampled the first time it is
+# shown. Only the part of a level around the visible region is
+# rendered (render_window), so no PhotoImage is much larger than
+# the canvas however far the view is zoomed in. Levels that fit are
+# rendered whole and cached, so zooming out and window resizing
+# only switch between cached images.
+#
+# CanvasView holds the current level and pan offset and does all
+# canvas <-> image pixel transforms:
+#   canvas = offset + pixel * scale
+#---------------------------------------------------------------
+
+ZOOM_STEP       = 2 ** 0.5          # Scale ratio between pyramid levels
+MIN_SCALE       = 1.0 / 16          # Smallest level
+MAX_SCALE       = 32.0              # Largest level
+WINDOW_MARGIN   = 0.5               # Rendered beyond the visible region, as a fraction of its size
+
+
+#---------------------------------------------------------------
+# Scales of the pyramid levels, the same for any image size: only
+# the part of a level around the visible region is rendered
+#---------------------------------------------------------------
+def pyramid_scales(image_width, image_height, zoom_step = ZOOM_STEP, min_scale = MIN_SCALE, max_scale = MAX_SCALE):
+    scales = []
+    k = 0
+    while zoom_step ** (k - 1) >= min_scale:
+        k -= 1
+    while True:
+        scale = zoom_step ** k
+        if scale > max_scale * (1 + 1e-9):
+            break
+        scales.append(scale)
+        k += 1
+    return scales or [min_scale]
+
+
+#---------------------------------------------------------------
+# Part (x0, y0, x1, y1) of a level of size (width, height) to render
+# for a visible region in level pixels: the region plus a margin,
+# so small pans need no new rendering, clipped to the level. The
+# whole level when region is None or the level fits.
+#---------------------------------------------------------------
+def render_window(level_size, region = None, margin = WINDOW_MARGIN):
+    width, height = level_size
+    if region is None:
+        return 0, 0, width, height
+    x0, y0, x1, y1 = region
+    mx = int((x1 - x0) * margin)
+    my = int((y1 - y0) * margin)
+    x0 = min(max(x0 - mx, 0), width - 1)
+    y0 = min(max(y0 - my, 0), height - 1)
+    x1 = max(min(x1 + mx, width), x0 + 1)
+    y1 = max(min(y1 + my, height), y0 + 1)
+    return x0, y0, x1, y1
+
+
+#---------------------------------------------------------------
+# True if a rendered window holds all of a level's visible region
+#---------------------------------------------------------------
+def window_covers(window, level_size, region = None):
+    if region is None:
+        return window == (0, 0) + tuple(level_size)
+    width, height = level_size
+    return (window[0] <= max(region[0], 0) and window[1] <= max(region[1], 0) and
+            window[2] >= min(region[2], width) and window[3] >= min(region[3], height))
+
+
+#---------------------------------------------------------------
+# One image at every zoom level, rendered on first use
+#---------------------------------------------------------------
+class ImagePyramid:
+
+    def __init__(self, image, scales = None):
+        self.scales  = scales or pyramid_scales(*image.size)
+        self.set_image(image)
+
+    #-----------------------------------------------------------
+    # Replace the image. Rendered levels are dropped.
+    #-----------------------------------------------------------
+    def set_image(self, image):
+        self.image   = image
+        self._photos = {}               # Whole levels: level -> PhotoImage
+        self._window = None             # Part of a larger level: (level, window, PhotoImage)
+
+    def level_size(self, level):
+        scale = self.scales[level]
+        return max(1, int(round(self.image.width * scale))), max(1, int(round(self.image.height * scale)))
+
+    #-----------------------------------------------------------
+    # Resampled PIL image of a window (x0, y0, x1, y1) of a level,
+    # default the whole level
+    #-----------------------------------------------------------
+    def level_image(self, level, window = None):
+        size = self.level_size(level)
+        return resample(self.image, size, window or (0, 0) + size)
+
+    #-----------------------------------------------------------
+    # Tk PhotoImage (needs a Tk root) showing at least the visible
+    # region (x0, y0, x1, y1) of a level, in level pixels (default
+    # all of it). Returns (x0, y0), photo: the level pixel at the
+    # upper left of the photo.
+    #-----------------------------------------------------------
+    def photo(self, level, region = None):
+        from PIL import ImageTk
+
+        size   = self.level_size(level)
+        window = render_window(size, region)
+        if window == (0, 0) + size:
+            if level not in self._photos:
+                self._photos[level] = ImageTk.PhotoImage(self.level_image(level))
+            return (0, 0), self._photos[level]
+        if (self._window is None) or (self._window[0] != level) or not window_covers(self._window[1], size, region):
+            self._window = (level, window, ImageTk.PhotoImage(self.level_image(level, window)))
+        return self._window[1][:2], self._window[2]
+
+
+#---------------------------------------------------------------
+# Resample a window (x0, y0, x1, y1) of the image scaled to 'size';
+# nearest neighbour when magnifying, so that single pixels stay
+# visible for box placement, box filter when reducing
+#---------------------------------------------------------------
+def resample(image, size, window = None):
+    from PIL import Image
+
+    if window is None:
+        window = (0, 0) + tuple(size)
+    if (tuple(size) == image.size) and (tuple(window) == (0, 0) + image.size):
+        return image.copy()
+    x0, y0, x1, y1 = window
+    sx   = image.width / size[0]
+    sy   = image.height / size[1]
+    box  = (x0 * sx, y0 * sy, x1 * sx, y1 * sy)
+    if size[0] >= image.width:
+        return image.resize((x1 - x0, y1 - y0), Image.NEAREST, box = box)
+    return image.resize((x1 - x0, y1 - y0), Image.BOX, box = box, reducing_gap = 2.0)
+
+
+#---------------------------------------------------------------
+# Current zoom level and pan of the image on the canvas
+#---------------------------------------------------------------
+class CanvasView:
+
+    def __init__(self, image_width, image_height, canvas_width, canvas_height, scales = None):
+        self.image_width    = image_width
+        self.image_height   = image_height
+        self.canvas_width   = canvas_width
+        self.canvas_height  = canvas_height
+        self.scales         = scales or pyramid_scales(image_width, image_height)
+        self.level          = 0
+        self.offset_x       = 0     # Canvas location of image pixel (0, 0)
+        self.offset_y       = 0
+        self.fitted         = True  # Follow the canvas size until the user zooms
+        self.fit()
+
+    @property
+    def scale(self):
+        return self.scales[self.level]
+
+    #-----------------------------------------------------------
+    # Canvas area in pixels of the current level (x0, y0, x1, y1)
+    #-----------------------------------------------------------
+    def visible_region(self):
+        return -self.offset_x, -self.offset_y, self.canvas_width - self.offset_x, self.canvas_height - self.offset_y
+
+    #-----------------------------------------------------------
+    # Largest level that fits the whole image in the canvas
+    #-----------------------------------------------------------
+    def fit(self):
+        fit_scale = min(self.canvas_width / self.image_width, self.canvas_height / self.image_height)
+        self.level = 0
+        for level, scale in enumerate(self.scales):
+            if scale <= fit_scale * (1 + 1e-9):
+                self.level = level
+        self.offset_x = 0
+        self.offset_y = 0
+        self.fitted   = True
+
+    #-----------------------------------------------------------
+    # Canvas widget was resized
+    #-----------------------------------------------------------
+    def resize(self, canvas_width, canvas_height):
+        self.canvas_width  = max(1, canvas_width)
+        self.canvas_height = max(1, canvas_height)
+        if self.fitted:
+            self.fit()
+
+    #-----------------------------------------------------------
+    # Zoom by 'steps' levels keeping canvas point (cx, cy) over
+    # the same image pixel. Returns True if the level changed.
+    #-----------------------------------------------------------
+    def zoom_at(self, cx, cy, steps):
+        level = min(max(self.level + steps, 0), len(self.scales) - 1)
+        if level == self.level:
+            return False
+        px, py          = self.canvas_to_pixel(cx, cy)
+        self.level      = level
+        self.offset_x   = int(round(cx - px * self.scale))
+        self.offset_y   = int(round(cy - py * self.scale))
+        self.fitted     = False
+        return True
+
+    def pan(self, dx, dy):
+        self.offset_x  += int(dx)
+        self.offset_y  += int(dy)
+        self.fitted     = False
+
+    def canvas_to_pixel(self, cx, cy):
+        return (cx - self.offset_x) / self.scale, (cy - self.offset_y) / self.scale
+
+    def pixel_to_canvas(self, px, py):
+        return self.offset_x + px * self.scale, self.offset_y + py * self.scale
+
+    #-----------------------------------------------------------
+    # Canvas rectangle (x0, y0, x1, y1) of an image pixel rectangle
+    #-----------------------------------------------------------
+    def box_to_canvas(self, px0, py0, width, height):
+        x0, y0 = self.pixel_to_canvas(px0, py0)
+        return x0, y0, x0 + width * self.scale, y0 + height * self.scale